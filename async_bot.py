@@ -0,0 +1,351 @@
+import asyncio
+import calendar
+import contextvars
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from dotenv import load_dotenv
+from telebot.async_telebot import AsyncTeleBot
+
+from calendar_helper import GoogleUnavailableError, SlotTakenError
+from metrics import timed_handler
+from callback_codec import (
+    BOOK, CALENDAR, CONFIRM, CONFIRM_REPEAT, DAY, FIND_FREE, IGNORE, MY_BOOKINGS, OPTIONS, REPEAT, TIME, VENUE,
+    CallbackRouter, StaleCallback
+)
+from my_telebot import (
+    FREE_SEARCH_LIMIT,
+    LOADING_STICKER_DELAY,
+    RECURRING_MAX_WEEKS,
+    book_recurring,
+    booking_error_text,
+    build_booking_event,
+    calendar_helper,
+    codec,
+    date_label,
+    generate_book_button,
+    generate_calendar,
+    generate_confirmation,
+    generate_free_slots,
+    generate_options,
+    generate_repeat_options,
+    generate_time_slots,
+    generate_user_bookings,
+    logger,
+    stale_note,
+    startup,
+    venue_by_index,
+)
+
+load_dotenv()
+
+# Upper bound on concurrent Google Calendar calls made on behalf of handlers
+CALENDAR_WORKERS = int(os.getenv('CALENDAR_WORKERS', '16'))
+
+bot = AsyncTeleBot(os.getenv('TELEGRAM_BOT_TOKEN'))
+calendar_executor = ThreadPoolExecutor(max_workers=CALENDAR_WORKERS, thread_name_prefix='calendar')
+# Same button payloads as my_telebot, async handlers
+router = CallbackRouter()
+
+
+async def run_blocking(func, *args):
+    """Run blocking calendar code in the bounded executor without stalling the event loop"""
+    loop = asyncio.get_running_loop()
+    # Carry the handler's trace into the worker thread so Google calls count as its stages
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(calendar_executor, context.run, functools.partial(func, *args))
+
+
+def month_view(year, month, option, user_id):
+    # stale_note reads calendar state too (SQLite with CACHE_DB_PATH), so it runs in the executor as well
+    return generate_calendar(year, month, option, user_id), stale_note(option)
+
+
+def time_slots_view(option, day, user_id):
+    return generate_time_slots(option, day, user_id), stale_note(option)
+
+
+async def show_month(call, year, month, option):
+    markup, note = await run_blocking(month_view, year, month, option, call.from_user.id)
+    await bot.edit_message_text(
+        f"Календарь: {calendar.month_name[month]} {year}{note}",
+        chat_id=call.message.chat.id,
+        message_id=call.message.message_id,
+        reply_markup=markup
+    )
+
+
+async def show_time_slots(call, option, day):
+    markup, note = await run_blocking(time_slots_view, option, day, call.from_user.id)
+    await bot.edit_message_text(
+        f"Вы выбрали {option} на {date_label(day)}. Выберите время:{note}",
+        chat_id=call.message.chat.id,
+        message_id=call.message.message_id,
+        reply_markup=markup
+    )
+
+
+@bot.message_handler(commands=['start'])
+@timed_handler
+async def send_welcome(message):
+    username = message.from_user.username or "No username"
+    user_id = message.from_user.id
+    logger.info(f"New user started bot: 👤 @{username} (ID: {user_id})")
+
+    await bot.send_message(
+        message.chat.id,
+        "Добро пожаловать! Нажмите 'Забронировать', чтобы начать.",
+        reply_markup=generate_book_button()
+    )
+
+
+@bot.message_handler(commands=['free'])
+@timed_handler
+async def find_free_command(message):
+    query = message.text.partition(' ')[2].strip()
+    try:
+        text, markup = await run_blocking(generate_free_slots, message.from_user.id, query or None, FREE_SEARCH_LIMIT,
+                                          message.chat.id)
+    except GoogleUnavailableError:
+        text, markup = "Google Calendar сейчас недоступен, попробуйте через минуту.", None
+    await bot.send_message(message.chat.id, text, reply_markup=markup)
+
+
+@bot.message_handler(commands=['my'])
+@timed_handler
+async def my_bookings_command(message):
+    try:
+        text, markup = await run_blocking(generate_user_bookings, message.from_user.id)
+    except GoogleUnavailableError:
+        text, markup = "Google Calendar сейчас недоступен, попробуйте через минуту.", None
+    await bot.send_message(message.chat.id, text, reply_markup=markup)
+
+
+@bot.callback_query_handler(func=lambda call: True)
+async def dispatch_callback(call):
+    try:
+        action, args = codec.decode(call.data, call.message.chat.id)
+    except StaleCallback:
+        await bot.answer_callback_query(call.id, "Кнопка устарела, нажмите /start")
+        return
+    handler = router.handler(action)
+    if handler is None:
+        return
+    try:
+        await handler(call, *args)
+    except GoogleUnavailableError:
+        await bot.answer_callback_query(call.id, "Google Calendar сейчас недоступен, попробуйте через минуту")
+
+
+@router.route(IGNORE)
+@timed_handler
+async def ignore_button(call):
+    await bot.answer_callback_query(call.id)
+
+
+@router.route(BOOK)
+@router.route(OPTIONS)
+@timed_handler
+async def booking_options(call):
+    await bot.edit_message_text(
+        "Выберите опцию:",
+        chat_id=call.message.chat.id,
+        message_id=call.message.message_id,
+        reply_markup=generate_options()
+    )
+
+
+@router.route(FIND_FREE)
+@timed_handler
+async def find_free(call, query):
+    text, markup = await run_blocking(generate_free_slots, call.from_user.id, query, FREE_SEARCH_LIMIT,
+                                      call.message.chat.id)
+    await bot.edit_message_text(
+        text,
+        chat_id=call.message.chat.id,
+        message_id=call.message.message_id,
+        reply_markup=markup
+    )
+
+
+@router.route(MY_BOOKINGS)
+@timed_handler
+async def my_bookings(call):
+    text, markup = await run_blocking(generate_user_bookings, call.from_user.id)
+    await bot.edit_message_text(
+        text,
+        chat_id=call.message.chat.id,
+        message_id=call.message.message_id,
+        reply_markup=markup
+    )
+
+
+@router.route(VENUE)
+@timed_handler
+async def show_venue(call, index):
+    venue = venue_by_index(index)
+    if venue is None:
+        await bot.answer_callback_query(call.id, "Площадка не найдена")
+        return
+    await bot.edit_message_text(
+        f"{venue}. Выберите опцию:",
+        chat_id=call.message.chat.id,
+        message_id=call.message.message_id,
+        reply_markup=generate_options(venue)
+    )
+
+
+@router.route(CALENDAR)
+@timed_handler
+async def show_calendar(call, option, month):
+    year, month = month
+    await show_month(call, year, month, option)
+
+
+@router.route(DAY)
+@timed_handler
+async def handle_date_selection(call, option, day):
+    await show_time_slots(call, option, day)
+
+
+@router.route(TIME)
+@timed_handler
+async def handle_time_selection(call, option, day, hour):
+    try:
+        # Hold the slot while the user is on the confirmation screen
+        if not await run_blocking(calendar_helper.hold_slot, option, day, hour, call.from_user.id):
+            await bot.answer_callback_query(call.id, "Это время уже занято, выберите другое")
+            return
+        await bot.edit_message_text(
+            f"Вы выбрали: \nВид спорта: {option}\nДата: {date_label(day)}\nВремя: {hour}:00\nНажмите 'Подтвердить' для завершения.",
+            chat_id=call.message.chat.id,
+            message_id=call.message.message_id,
+            reply_markup=generate_confirmation(option, day, hour)
+        )
+    except Exception:
+        await bot.answer_callback_query(call.id, "Ошибка при выборе времени")
+
+
+@router.route(REPEAT)
+@timed_handler
+async def show_repeat_options(call, option, day, hour):
+    await bot.edit_message_text(
+        f"{option} в {hour}:00 каждую неделю, начиная с {date_label(day)}. На сколько недель?",
+        chat_id=call.message.chat.id,
+        message_id=call.message.message_id,
+        reply_markup=generate_repeat_options(option, day, hour)
+    )
+
+
+@router.route(CONFIRM_REPEAT)
+@timed_handler
+async def handle_recurring_confirmation(call, option, day, hour, weeks):
+    if not 1 <= weeks <= RECURRING_MAX_WEEKS:
+        await bot.answer_callback_query(call.id, f"Можно забронировать не больше {RECURRING_MAX_WEEKS} недель")
+        return
+    username = call.from_user.username or "No username"
+    # The batch insert runs while the callback is answered
+    booking = asyncio.ensure_future(run_blocking(book_recurring, option, day, hour, weeks, call.from_user.id, username))
+    try:
+        await bot.answer_callback_query(call.id, "Бронируем...")
+    finally:
+        try:
+            text = await booking
+        except Exception as e:
+            logger.error(f"❌ Recurring booking error for 👤 @{username} (ID: {call.from_user.id}): {str(e)}",
+                         exc_info=True)
+            text = booking_error_text(e)
+    await bot.edit_message_text(
+        text,
+        chat_id=call.message.chat.id,
+        message_id=call.message.message_id,
+        reply_markup=generate_book_button()
+    )
+
+
+@router.route(CONFIRM)
+@timed_handler
+async def handle_confirmation(call, option, day, hour):
+    chat_id = call.message.chat.id
+    message_id = call.message.message_id
+    sticker_message = None
+    username = call.from_user.username or "No username"
+    user_id = call.from_user.id
+    try:
+        logger.info(f"Processing booking by 👤 @{username} (ID: {user_id})\nOption: {option}\nDate: {day}\nTime: {hour}:00")
+
+        event = build_booking_event(option, day, hour, user_id, username)
+        # The insert runs while the user already gets feedback
+        booking = asyncio.ensure_future(
+            run_blocking(calendar_helper.book_slot, option, day, hour, user_id, event)
+        )
+        try:
+            await bot.answer_callback_query(call.id, "Бронируем...")
+            await asyncio.wait_for(asyncio.shield(booking), LOADING_STICKER_DELAY)
+        except asyncio.TimeoutError:
+            await bot.edit_message_text("Бронируем...", chat_id=chat_id, message_id=message_id)
+            sticker_message = await bot.send_sticker(chat_id, os.getenv('LOADING_STICKER_ID'))
+        finally:
+            # Also collects the insert's error when the Telegram calls failed
+            await booking
+        logger.info(f"✅ Booking confirmed\nUser: 👤 @{username} (ID: {user_id})\nOption: {option}\nDate: {day}\nTime: {hour}:00")
+
+        await bot.edit_message_text(
+            f"✅ Бронирование подтверждено!\n\nВид спорта: {option}\nДата: {day}\nВремя: {hour}:00",
+            chat_id=chat_id,
+            message_id=message_id,
+            reply_markup=generate_book_button()
+        )
+        if sticker_message is not None:
+            await bot.delete_message(chat_id, sticker_message.message_id)
+
+    except SlotTakenError:
+        if sticker_message is not None:
+            await bot.delete_message(chat_id, sticker_message.message_id)
+        logger.info(f"Slot already taken for 👤 @{username} (ID: {user_id})\nOption: {option}\nDate: {day}\nTime: {hour}:00")
+        markup = await run_blocking(generate_time_slots, option, day, user_id)
+        await bot.edit_message_text(
+            f"❌ Это время уже занято.\nВы выбрали {option} на {date_label(day)}. Выберите время:",
+            chat_id=chat_id,
+            message_id=message_id,
+            reply_markup=markup
+        )
+
+    except Exception as e:
+        if sticker_message is not None:
+            try:
+                await bot.delete_message(chat_id, sticker_message.message_id)
+            except Exception:
+                pass
+        # An outage is no bug, its traceback is only noise in the log channel
+        logger.error(f"❌ Booking error for 👤 @{username} (ID: {user_id}): {str(e)}",
+                     exc_info=not isinstance(e, GoogleUnavailableError))
+        try:
+            await bot.edit_message_text(
+                booking_error_text(e),
+                chat_id=chat_id,
+                message_id=message_id,
+                reply_markup=generate_book_button()
+            )
+        except Exception:
+            pass
+
+
+@bot.message_handler(func=lambda message: True)
+@timed_handler
+async def fallback_message(message):
+    await bot.send_message(
+        message.chat.id,
+        "Нажми /start чтобы перейти к бронированию."
+    )
+
+
+if __name__ == '__main__':
+    print("Бот запущен (asyncio)...")
+    startup()
+    asyncio.run(bot.infinity_polling(
+        timeout=20,
+        request_timeout=30,
+        allowed_updates=["message", "callback_query"]
+    ))
@@ -0,0 +1,59 @@
+"""Load test for async_bot: N simulated users booking at the same time.
+
+    python -m benchmarks.async_load --users 200 --calendar-latency 0.2
+
+Prints p50/p99 callback latency measured around bot.process_new_updates.
+"""
+import argparse
+import asyncio
+import time
+
+from benchmarks.fakes import FakeAsyncTelegram, booking_journey, callback_update, load_bot_module, percentile
+
+
+async def simulate_user(bot, types, user_id, update_ids, latencies):
+    for data in booking_journey(user_id):
+        update = types.Update.de_json(callback_update(next(update_ids), user_id, data))
+        started = time.perf_counter()
+        await bot.process_new_updates([update])
+        latencies.append(time.perf_counter() - started)
+
+
+async def run(args):
+    import itertools
+    my_telebot = load_bot_module(args.calendar_latency)
+    import async_bot
+    from telebot import types
+
+    telegram = FakeAsyncTelegram(args.telegram_latency)
+    telegram.install()
+    # Timing and pacing of Bot API calls as in production, see my_telebot.startup
+    my_telebot.setup_telegram()
+    update_ids = itertools.count(1)
+    latencies = []
+
+    started = time.perf_counter()
+    await asyncio.gather(*[
+        simulate_user(async_bot.bot, types, user_id, update_ids, latencies)
+        for user_id in range(1, args.users + 1)
+    ])
+    elapsed = time.perf_counter() - started
+
+    print(f"users:            {args.users}")
+    print(f"callbacks:        {len(latencies)} in {elapsed:.2f}s ({len(latencies) / elapsed:.1f}/s)")
+    print(f"p50 latency:      {percentile(latencies, 50) * 1000:.1f} ms")
+    print(f"p99 latency:      {percentile(latencies, 99) * 1000:.1f} ms")
+    print(f"google calls:     {dict(my_telebot.calendar_helper.service.calls)}")
+    print(f"telegram calls:   {dict(telegram.calls)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--calendar-latency', type=float, default=0.2, help='seconds per Google call')
+    parser.add_argument('--telegram-latency', type=float, default=0.05, help='seconds per Telegram call')
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
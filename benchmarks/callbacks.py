@@ -0,0 +1,132 @@
+"""Parse and dispatch cost of a button press, colon payloads vs callback_codec.
+
+    python -m benchmarks.callbacks --rounds 20000
+
+Both bots are real TeleBot instances fed the same journey of callback
+queries. The legacy one has the handler chain the bot used before the
+codec (a startswith filter per handler, split(':') and strptime inside);
+the new one has a single handler that decodes the payload and looks the
+action up in a dict. Handlers only parse, nothing is sent. Reports the
+matching and parsing alone and the whole TeleBot dispatch, payload sizes
+and the longest court name each format can carry.
+"""
+import argparse
+import time
+from datetime import date, datetime, timedelta
+
+from benchmarks.fakes import booking_journey, callback_update, load_bot_module
+
+# callback_data is limited to 64 bytes
+LIMIT = 64
+
+
+def legacy_journey(option, day, hour):
+    date_str = f"{day.year}-{day.month}-{day.day}"
+    return [
+        'book',
+        f'option:{option}',
+        f'next_month:{option}:{day.year}-{day.month}',
+        f'prev_month:{option}:{day.year}-{day.month % 12 + 1}',
+        f'select_date:{option}:{date_str}',
+        f'time:{option}:{date_str}:{hour}:00',
+        f'back_to_times:{option}:{date_str}',
+        f'confirm:{option}:{date_str}:{hour}',
+    ]
+
+
+def legacy_handlers():
+    """(filter, handler) pairs as registered before the codec, parsing only"""
+    sink = []
+
+    def parse_date(text):
+        return datetime.strptime(text, '%Y-%m-%d').date()
+
+    filters = [
+        (lambda call: call.data == 'book', lambda call: sink.append(())),
+        (lambda call: call.data == 'find_free', lambda call: sink.append(())),
+        (lambda call: call.data.startswith('venue:'), lambda call: sink.append(int(call.data.split(':')[1]))),
+        (lambda call: call.data.startswith('option:'), lambda call: sink.append(call.data.split(':')[1])),
+        (lambda call: call.data.startswith('prev_month') or call.data.startswith('next_month'),
+         lambda call: sink.append(call.data.split(':'))),
+        (lambda call: call.data.startswith('select_date:'),
+         lambda call: sink.append(parse_date(call.data.split(':')[2]))),
+        (lambda call: call.data.startswith('time:'), lambda call: sink.append(parse_date(call.data.split(':')[2]))),
+        (lambda call: call.data.startswith('confirm:'), lambda call: sink.append(call.data.split(':'))),
+        (lambda call: call.data.startswith('back_to_options'), lambda call: sink.append(())),
+        (lambda call: call.data.startswith('back_to_calendar:'), lambda call: sink.append(call.data.split(':')[1])),
+        (lambda call: call.data.startswith('back_to_times:'), lambda call: sink.append(call.data.split(':'))),
+    ]
+    return filters
+
+
+def legacy_dispatch(filters):
+    def dispatch(call):
+        for func, handler in filters:
+            if func(call):
+                return handler(call)
+    return dispatch
+
+
+def codec_dispatch(codec):
+    sink = []
+    handlers = {action: sink.append for action in range(16)}
+
+    def dispatch(call):
+        action, args = codec.decode(call.data, call.message.chat.id)
+        handlers[action](args)
+    return dispatch
+
+
+def measure(func, calls, rounds):
+    started = time.perf_counter()
+    for _ in range(rounds):
+        func(calls)
+    return (time.perf_counter() - started) / (rounds * len(calls))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rounds', type=int, default=20000)
+    args = parser.parse_args()
+
+    my_telebot = load_bot_module()
+    import telebot
+    from telebot import types
+
+    option = 'Бадминтон'
+    day = date.today() + timedelta(days=3)
+    journeys = {
+        'legacy': legacy_journey(option, day, 18),
+        'codec': booking_journey(1, option=option, day=day, hour=18),
+    }
+    legacy_bot = telebot.TeleBot('123456:LEGACY', threaded=False)
+    for func, handler in legacy_handlers():
+        legacy_bot.register_callback_query_handler(handler, func=func)
+    new_bot = telebot.TeleBot('123456:CODEC', threaded=False)
+    new_bot.register_callback_query_handler(codec_dispatch(my_telebot.codec), func=lambda call: True)
+    dispatchers = {'legacy': legacy_dispatch(legacy_handlers()), 'codec': codec_dispatch(my_telebot.codec)}
+    bots = {'legacy': legacy_bot, 'codec': new_bot}
+
+    for name, payloads in journeys.items():
+        calls = [types.Update.de_json(callback_update(n, 1, data)).callback_query for n, data in enumerate(payloads)]
+        dispatch = dispatchers[name]
+        parse = measure(lambda batch: [dispatch(call) for call in batch], calls, args.rounds)
+        total = measure(bots[name].process_new_callback_query, calls, args.rounds)
+        longest = max(len(data.encode('utf-8')) for data in payloads)
+        print(f"{name:7} match+parse {parse * 1e6:5.2f} us, through TeleBot {total * 1e6:5.2f} us per callback,"
+              f" longest payload {longest} bytes")
+
+    # Longest payload is time:{name}:{date}:{hour}:00, Cyrillic letters take 2 bytes
+    legacy_room = LIMIT - len('time::2000-12-31:23:00')
+    print(f"legacy  court names up to {legacy_room} bytes ({legacy_room // 2} Cyrillic letters)")
+    print("codec   court names of any length, payload size does not depend on them")
+
+    from callback_codec import CONFIRM_REPEAT, MAX_LENGTH
+    longest = my_telebot.codec.encode(CONFIRM_REPEAT, option, date(2099, 12, 31), 23, 52)
+    assert len(longest) == MAX_LENGTH == 13, f"longest codec payload is {len(longest)}, MAX_LENGTH {MAX_LENGTH}"
+    assert all(len(data) <= MAX_LENGTH for data in journeys['codec']), "payload longer than MAX_LENGTH"
+    print(f"codec   longest payload {MAX_LENGTH} characters")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""Perceived latency of tapping "Подтвердить" in my_telebot.
+
+    python -m benchmarks.confirmation --users 8 --calendar-latency 0.3 --telegram-latency 0.08
+
+Every user confirms a slot of their own, all at the same time, through the
+real handle_confirmation. Reported per confirmation:
+
+    feedback   until the first Bot API call for the user went through
+               (the button stops spinning or the message changes)
+    confirmed  until the "✅ Бронирование подтверждено" text is on screen
+    handler    until the handler returned
+    calls      Bot API calls made
+"""
+import argparse
+import itertools
+import threading
+import time
+from datetime import date, timedelta
+
+from benchmarks.fakes import FakeTelegram, booking_journey, callback_update, load_bot_module, percentile
+
+
+def run(args):
+    my_telebot = load_bot_module(args.calendar_latency)
+    from telebot import types
+
+    telegram = FakeTelegram(args.telegram_latency, record=True)
+    telegram.install()
+    bot = my_telebot.bot
+    bot.threaded = False
+    my_telebot.calendar_helper.sync_indexes()
+
+    update_ids = itertools.count(1)
+    users = {}  # callback query ID -> (user ID, started at, handler seconds)
+    lock = threading.Lock()
+
+    def user(user_id):
+        day = date.today() + timedelta(days=1 + user_id // 10)
+        update = callback_update(next(update_ids), user_id,
+                                 booking_journey(user_id, day=day, hour=10 + user_id % 10)[-1])
+        started = time.perf_counter()
+        bot.process_new_updates([types.Update.de_json(update)])
+        with lock:
+            users[update['callback_query']['id']] = (user_id, started, time.perf_counter() - started)
+
+    threads = [threading.Thread(target=user, args=(user_id,)) for user_id in range(1, args.users + 1)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    telegram.uninstall()
+
+    feedback, confirmed, handler = [], [], []
+    for query_id, (user_id, started, seconds) in users.items():
+        calls = [(at, name, params) for at, name, params in telegram.log
+                 if params.get('callback_query_id') == query_id or str(params.get('chat_id')) == str(user_id)]
+        feedback.append(min(at for at, _, _ in calls) - started)
+        confirmed.append(min((at for at, name, params in calls
+                              if name == 'editMessageText' and params.get('text', '').startswith('✅')),
+                             default=float('nan')) - started)
+        handler.append(seconds)
+    return feedback, confirmed, handler, dict(telegram.calls)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=8, help='confirmations at the same time')
+    parser.add_argument('--calendar-latency', type=float, default=0.3, help='seconds per Google call')
+    parser.add_argument('--telegram-latency', type=float, default=0.08, help='seconds per Bot API call')
+    args = parser.parse_args()
+
+    feedback, confirmed, handler, calls = run(args)
+    for name, values in (('feedback', feedback), ('confirmed', confirmed), ('handler', handler)):
+        print(f"{name:10} p50 {percentile(values, 50) * 1000:7.1f} ms  p99 {percentile(values, 99) * 1000:7.1f} ms")
+    print(f"calls      {sum(calls.values()) / args.users:.1f} per confirmation {calls}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+"""Google token refresh across bot processes: on demand inside requests vs the credential manager.
+
+    python -m benchmarks.credentials --processes 4 --lifetime 6 --duration 20
+
+Several processes share one token file and make a request every
+--interval seconds against a local fake token endpoint that hands out
+access tokens valid for --lifetime seconds. "on demand" is how the bot
+worked with token.pickle: the transport refreshes an expired token in
+front of a user request, every process on its own. "managed" runs the
+CredentialManager: refreshes in the background --ahead seconds before
+expiry, under the file lock, reusing tokens other processes refreshed.
+Reports token endpoint calls, requests that waited for a refresh and the
+lowest time-to-expiry a request saw. The library's own 225 s early
+refresh margin is scaled down to --margin to fit the short lifetime.
+"""
+import argparse
+import multiprocessing
+import os
+import tempfile
+import time
+from datetime import timedelta
+
+from benchmarks.fakes import FakeTokenServer, percentile
+
+
+def worker(mode, path, args, results):
+    import google.auth._helpers
+    from google.auth.transport.requests import Request
+    from google_credentials import CredentialManager, TokenFile, credentials_from_info
+
+    google.auth._helpers.REFRESH_THRESHOLD = timedelta(seconds=args.margin)
+    manager = None
+    if mode == 'managed':
+        manager = CredentialManager(path, refresh_ahead=args.ahead, legacy_path=None)
+        creds = manager.load()
+        manager.ensure_valid()
+        manager.start()
+    else:
+        creds = credentials_from_info(TokenFile(path).load())
+
+    request = Request()
+    waits = []
+    lowest = None
+    deadline = time.monotonic() + args.duration
+    while time.monotonic() < deadline:
+        started = time.perf_counter()
+        # What the HTTP transport does before every Google call
+        creds.before_request(request, 'GET', 'https://www.googleapis.com/calendar/v3', {})
+        waits.append(time.perf_counter() - started)
+        expires_in = (creds.expiry - google.auth._helpers.utcnow()).total_seconds()
+        lowest = expires_in if lowest is None else min(lowest, expires_in)
+        time.sleep(args.interval)
+    if manager:
+        manager.stop()
+    results.put((waits, lowest, manager.stats() if manager else None))
+
+
+def run(mode, server, args):
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'token.json')
+        from google_credentials import TokenFile
+        # Processes start with a token about to expire, as after a restart
+        TokenFile(path).save(server.token_info(args.ahead / 2))
+        server.refreshes = 0
+        results = multiprocessing.Queue()
+        processes = [multiprocessing.Process(target=worker, args=(mode, path, args, results))
+                     for _ in range(args.processes)]
+        for process in processes:
+            process.start()
+        outcomes = [results.get() for _ in processes]
+        for process in processes:
+            process.join()
+    waits = [wait for outcome in outcomes for wait in outcome[0]]
+    waited = sum(wait > server.latency / 2 for wait in waits)
+    lowest = min(outcome[1] for outcome in outcomes)
+    adopted = sum(outcome[2]['adopted'] for outcome in outcomes if outcome[2])
+    print(f"{mode:9} token endpoint {server.refreshes:3} calls, {waited:3}/{len(waits)} requests waited,"
+          f" p99 {percentile(waits, 99) * 1000:6.1f} ms, max {max(waits) * 1000:6.1f} ms,"
+          f" lowest time-to-expiry {lowest:5.1f} s, adopted {adopted}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--lifetime', type=float, default=6.0, help='access token lifetime, seconds')
+    parser.add_argument('--ahead', type=float, default=2.0, help='background refresh this early, seconds')
+    parser.add_argument('--margin', type=float, default=0.5, help="library's early refresh margin, seconds")
+    parser.add_argument('--duration', type=float, default=20.0, help='seconds per mode')
+    parser.add_argument('--interval', type=float, default=0.05, help='seconds between requests per process')
+    parser.add_argument('--latency', type=float, default=0.2, help='token endpoint latency, seconds')
+    args = parser.parse_args()
+
+    server = FakeTokenServer(args.lifetime, args.latency)
+    try:
+        for mode in ('on demand', 'managed'):
+            run(mode, server, args)
+    finally:
+        server.close()
+
+
+if __name__ == '__main__':
+    main()
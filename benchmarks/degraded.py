@@ -0,0 +1,115 @@
+"""Time slot views while Google is slow or down: blocking syncs vs stale-while-revalidate.
+
+    python -m benchmarks.degraded --taps 20 --calendar-latency 1.0 --failure-rate 1.0
+
+Calendars go stale before every tap and Google answers each list call
+after --calendar-latency seconds, failing with 503 at --failure-rate.
+"blocking" syncs inside the tap with retries and no circuit breaker, as
+the bot did before; "stale" serves the last known bookings with a
+"may be outdated" note and refreshes in the background. Reports tap
+latency and the Google calls made, retries included. Then checks that
+/my reports Google as unavailable when it never had a calendar's data,
+and shows the note when it serves stale data.
+"""
+import argparse
+import random
+import time
+from datetime import date, timedelta
+
+from benchmarks.fakes import FakeCalendarService, FakeEvents, FakeRequest, http_error, load_bot_module, percentile
+
+
+def flaky_list(failure_rate, rng):
+    original = FakeEvents.list
+
+    def list_events(self, calendarId, **kwargs):
+        request = original(self, calendarId, **kwargs)
+        if rng.random() >= failure_rate:
+            return request
+
+        def fail():
+            raise http_error(503)
+        return FakeRequest(self.service, 'events.list', fail)
+    return list_events
+
+
+def run(my_telebot, args, blocking):
+    helper = my_telebot.calendar_helper
+    if blocking:
+        helper.breaker.failures = 10 ** 9
+        helper.refresh_in_background = lambda: helper.sync_indexes()
+
+    day = date.today() + timedelta(days=2)
+    latencies = []
+    notes = 0
+    helper.service.calls.clear()
+    for _ in range(args.taps):
+        for index in helper.indexes.values():
+            index.sync_interval = 0
+        started = time.perf_counter()
+        my_telebot.generate_time_slots('Бадминтон', day, 1)
+        notes += bool(my_telebot.stale_note('Бадминтон'))
+        latencies.append(time.perf_counter() - started)
+        time.sleep(args.think)
+    return latencies, notes, sum(helper.service.calls.values())
+
+
+def my_bookings_check(my_telebot, calendar_helper, args):
+    """/my must not claim "no bookings" for calendars it has no data of, and must flag stale ones"""
+    from calendar_helper import GoogleUnavailableError
+
+    helper = calendar_helper.GoogleCalendarHelper(my_telebot.calendar_helper.resources)
+    helper.service = FakeCalendarService(args.calendar_latency)
+    my_telebot.calendar_helper = helper
+    FakeEvents.list, original = flaky_list(1.0, random.Random(1)), FakeEvents.list
+    try:
+        try:
+            text, _ = my_telebot.generate_user_bookings(1)
+        except GoogleUnavailableError:
+            text = None
+        assert text is None, f"/my answered during a cold-start outage: {text!r}"
+        print("/my cold start, Google down: GoogleUnavailableError")
+        FakeEvents.list = original
+        helper.sync_indexes()
+        for index in helper.indexes.values():
+            index.sync_interval = 0
+        FakeEvents.list = flaky_list(1.0, random.Random(1))
+        text, _ = my_telebot.generate_user_bookings(1)
+        assert "устаревшими" in text, f"/my served stale data without the note: {text!r}"
+        print("/my stale, Google down: shown with the outdated note")
+    finally:
+        FakeEvents.list = original
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--taps', type=int, default=20)
+    parser.add_argument('--calendar-latency', type=float, default=1.0, help='seconds per Google call')
+    parser.add_argument('--failure-rate', type=float, default=1.0, help='share of list calls answered with 503')
+    parser.add_argument('--think', type=float, default=0.2, help='seconds between taps')
+    args = parser.parse_args()
+
+    import calendar_helper
+    # Retries still happen, just without the real backoff pauses
+    calendar_helper.backoff_delay = lambda attempt: 0.05
+    calendar_helper.STALE_GRACE = 0
+
+    my_telebot = load_bot_module()
+    for mode in ('blocking', 'stale'):
+        # A new helper per mode, handlers look the module global up on every call
+        helper = calendar_helper.GoogleCalendarHelper(my_telebot.calendar_helper.resources)
+        helper.service = FakeCalendarService(args.calendar_latency)
+        helper.sync_indexes()
+        my_telebot.calendar_helper = helper
+        FakeEvents.list, original = flaky_list(args.failure_rate, random.Random(1)), FakeEvents.list
+        try:
+            latencies, notes, calls = run(my_telebot, args, blocking=mode == 'blocking')
+        finally:
+            FakeEvents.list = original
+        print(f"{mode:8} p50 {percentile(latencies, 50) * 1000:7.1f} ms, p99 {percentile(latencies, 99) * 1000:7.1f} ms,"
+              f" google calls {calls:3}, shown as outdated {notes}/{args.taps}")
+    my_bookings_check(my_telebot, calendar_helper, args)
+
+
+if __name__ == '__main__':
+    main()
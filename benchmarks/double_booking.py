@@ -0,0 +1,86 @@
+"""Concurrent bookings of one slot from separate bot processes.
+
+    python -m benchmarks.double_booking --processes 4 --calendar-latency 0.1
+
+Each simulated process has its own GoogleCalendarHelper (own holds and
+local data) over one shared fake Google Calendar, and all of them book
+the same slot at once: first a slot never booked, then the same slot
+after its event was cancelled, which books by reviving the event.
+Fails unless exactly one booking goes through each time. Reports how
+long the losers took to learn the slot was taken.
+"""
+import argparse
+import threading
+import time
+from datetime import date, timedelta
+
+from benchmarks.fakes import FakeCalendarService, load_bot_module
+
+OPTION = 'Бадминтон'
+
+
+def race(helpers, day, hour):
+    from calendar_helper import SlotTakenError
+
+    barrier = threading.Barrier(len(helpers))
+    outcomes = []
+    lock = threading.Lock()
+
+    def book(user_id, helper):
+        event = {'summary': f'user {user_id}', 'extendedProperties': {'private': {'userId': str(user_id)}}}
+        barrier.wait()
+        started = time.perf_counter()
+        try:
+            helper.book_slot(OPTION, day, hour, user_id, event)
+            outcome = 'booked'
+        except SlotTakenError:
+            outcome = 'taken'
+        with lock:
+            outcomes.append((outcome, time.perf_counter() - started))
+
+    threads = [threading.Thread(target=book, args=(user_id, helper))
+               for user_id, helper in enumerate(helpers, 1)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return outcomes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--calendar-latency', type=float, default=0.1, help='seconds per Google call')
+    args = parser.parse_args()
+
+    my_telebot = load_bot_module()
+    from calendar_helper import GoogleCalendarHelper, slot_event_id
+
+    google = FakeCalendarService(args.calendar_latency)
+    helpers = []
+    for _ in range(args.processes):
+        helper = GoogleCalendarHelper(my_telebot.calendar_helper.resources)
+        helper.service = google
+        helper.sync_indexes()
+        helpers.append(helper)
+
+    day = date.today() + timedelta(days=3)
+    hour = 12
+    calendar_id = helpers[0].get_calendar_id(OPTION)
+    event_id = slot_event_id(calendar_id, day, hour)
+    for name in ('new slot', 'cancelled'):
+        if name == 'cancelled':
+            with google.lock:
+                google.save(calendar_id, dict(google.store[calendar_id][event_id], status='cancelled'))
+            for helper in helpers:
+                helper.sync_indexes()
+        outcomes = race(helpers, day, hour)
+        booked = [seconds for outcome, seconds in outcomes if outcome == 'booked']
+        taken = [seconds for outcome, seconds in outcomes if outcome == 'taken']
+        print(f"{name:9} {len(booked)} booked, {len(taken)} told taken"
+              f" (slowest {max(taken, default=0) * 1000:.0f} ms)")
+        assert len(booked) == 1, f"{name}: {len(booked)} processes booked the same slot"
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,404 @@
+"""In-process stand-ins for Google Calendar and Telegram used by the benchmarks"""
+import itertools
+import logging
+import os
+import threading
+import time
+from collections import Counter
+
+
+def http_error(status):
+    import httplib2
+    from googleapiclient.errors import HttpError
+    return HttpError(httplib2.Response({'status': status}), b'{}')
+
+
+def post_calendar_notification(address, channel_id, resource_id, token=None, state='exists'):
+    """Send a Calendar push notification (headers only, no body) and return the HTTP status"""
+    import urllib.request
+    headers = {
+        'X-Goog-Channel-ID': channel_id,
+        'X-Goog-Resource-ID': resource_id,
+        'X-Goog-Resource-State': state,
+        'X-Goog-Message-Number': '1'
+    }
+    if token:
+        headers['X-Goog-Channel-Token'] = token
+    request = urllib.request.Request(address, data=b'', headers=headers, method='POST')
+    with urllib.request.urlopen(request, timeout=5) as response:
+        return response.status
+
+
+class FakeTokenServer:
+    """Local OAuth token endpoint answering every refresh with a token valid for lifetime seconds"""
+
+    def __init__(self, lifetime=3600, latency=0.0):
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        import json
+
+        self.lifetime = lifetime
+        self.latency = latency
+        self.refreshes = 0
+        self._lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get('Content-Length') or 0))
+                time.sleep(server.latency)
+                with server._lock:
+                    server.refreshes += 1
+                    token = f'access-{server.refreshes}'
+                body = json.dumps({'access_token': token, 'expires_in': server.lifetime,
+                                   'token_type': 'Bearer'}).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.uri = f'http://127.0.0.1:{self.httpd.server_address[1]}/token'
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def token_info(self, expires_in):
+        """Token file contents with an access token expiring in expires_in seconds"""
+        from datetime import datetime, timedelta, timezone
+        expiry = datetime.now(timezone.utc) + timedelta(seconds=expires_in)
+        return {'token': 'access-0', 'refresh_token': 'refresh', 'token_uri': self.uri,
+                'client_id': 'client', 'client_secret': 'secret',
+                'scopes': ['https://www.googleapis.com/auth/calendar'],
+                'expiry': expiry.strftime('%Y-%m-%dT%H:%M:%S.%fZ')}
+
+    def close(self):
+        self.httpd.shutdown()
+
+
+class FakeRequest:
+    def __init__(self, service, name, func):
+        self.service = service
+        self.name = name
+        self.func = func
+        # Same method naming and extra headers as googleapiclient's HttpRequest
+        self.methodId = f'calendar.{name}'
+        self.headers = {}
+
+    def execute(self, http=None):
+        self.service.count(self.name)
+        if self.service.latency:
+            time.sleep(self.service.latency)
+        return self.func()
+
+
+class FakeEvents:
+    def __init__(self, service):
+        self.service = service
+
+    def list(self, calendarId, syncToken=None, **kwargs):
+        def run():
+            with self.service.lock:
+                if syncToken:
+                    items = self.service.changes.pop(calendarId, [])
+                else:
+                    items = list(self.service.store.get(calendarId, {}).values())
+                return {'items': items, 'nextSyncToken': f'sync-{next(self.service.ids)}'}
+        return FakeRequest(self.service, 'events.list', run)
+
+    def insert(self, calendarId, body):
+        def run():
+            with self.service.lock:
+                events = self.service.store.setdefault(calendarId, {})
+                if body.get('id') in events:
+                    raise http_error(409)
+                return self.service.save(calendarId, dict(body, status='confirmed'))
+        return FakeRequest(self.service, 'events.insert', run)
+
+    def get(self, calendarId, eventId):
+        def run():
+            with self.service.lock:
+                event = self.service.store.get(calendarId, {}).get(eventId)
+                if event is None:
+                    raise http_error(404)
+                return event
+        return FakeRequest(self.service, 'events.get', run)
+
+    def update(self, calendarId, eventId, body):
+        def run():
+            with self.service.lock:
+                event = self.service.store.get(calendarId, {}).get(eventId)
+                if event is None:
+                    raise http_error(404)
+                if request.headers.get('If-Match') not in (None, event.get('etag')):
+                    raise http_error(412)
+                return self.service.save(calendarId, dict(body, id=eventId, status='confirmed'))
+        request = FakeRequest(self.service, 'events.update', run)
+        return request
+
+    def watch(self, calendarId, body):
+        def run():
+            with self.service.lock:
+                channel = dict(body, calendarId=calendarId, resourceId=f'resource-{calendarId}')
+                self.service.watch_channels[body['id']] = channel
+            expiration = (time.time() + int(body.get('params', {}).get('ttl', 3600))) * 1000
+            return {'id': body['id'], 'resourceId': channel['resourceId'], 'expiration': str(int(expiration))}
+        return FakeRequest(self.service, 'events.watch', run)
+
+
+class FakeChannels:
+    def __init__(self, service):
+        self.service = service
+
+    def stop(self, body):
+        def run():
+            with self.service.lock:
+                self.service.watch_channels.pop(body['id'], None)
+            return {}
+        return FakeRequest(self.service, 'channels.stop', run)
+
+
+class FakeBatch:
+    """BatchHttpRequest stand-in: all requests cost a single round-trip"""
+
+    def __init__(self, service, callback=None):
+        self.service = service
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request, callback=None, request_id=None):
+        self.requests.append((request, callback or self.callback, request_id or str(len(self.requests))))
+
+    def execute(self, http=None):
+        self.service.count('batch')
+        if self.service.latency:
+            time.sleep(self.service.latency)
+        for request, callback, request_id in self.requests:
+            self.service.count(f'batch:{request.name}')
+            try:
+                response, exception = request.func(), None
+            except Exception as e:
+                response, exception = None, e
+            if callback:
+                callback(request_id, response, exception)
+
+
+class FakeCalendarService:
+    """Minimal googleapiclient Calendar `service` with injected latency per call"""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+        self.store = {}    # calendar id -> {event id: event}
+        self.changes = {}  # calendar id -> events not yet seen by a sync
+        self.watch_channels = {}  # watch channel id -> events().watch body
+        self.calls = Counter()
+
+    def save(self, calendar_id, event):
+        event.setdefault('id', f'event{next(self.ids)}')
+        # A new version on every write, like Google's etags
+        event['etag'] = f'"{next(self.ids)}"'
+        self.store.setdefault(calendar_id, {})[event['id']] = event
+        self.changes.setdefault(calendar_id, []).append(event)
+        return event
+
+    def notify(self, calendar_id, state='exists'):
+        """Post a push notification to every channel watching a calendar, like Google does"""
+        with self.lock:
+            channels = [c for c in self.watch_channels.values() if c['calendarId'] == calendar_id]
+        return [post_calendar_notification(c['address'], c['id'], c['resourceId'], c.get('token'), state)
+                for c in channels]
+
+    def count(self, name):
+        with self.lock:
+            self.calls[name] += 1
+
+    def events(self):
+        return FakeEvents(self)
+
+    def channels(self):
+        return FakeChannels(self)
+
+    def new_batch_http_request(self, callback=None):
+        return FakeBatch(self, callback)
+
+
+def fake_result(name, params, message_id):
+    """Bot API result of a faked call: a Message for methods that answer with one, else True"""
+    if name not in FakeTelegram.MESSAGE_METHODS:
+        return True
+    params = params or {}
+    return {
+        'message_id': int(params.get('message_id', message_id)),
+        'date': int(time.time()),
+        'chat': {'id': int(params.get('chat_id', 0) or 0), 'type': 'private'},
+        'text': params.get('text', '')
+    }
+
+
+class FakeAsyncTelegram:
+    """Bot API stand-in for AsyncTeleBot, installed as asyncio_helper._process_request.
+
+    Install it before my_telebot.setup_telegram() so the timing wrapper and
+    the scheduler sit in front of it, as they sit in front of aiohttp.
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = Counter()
+        self.message_ids = itertools.count(1000)
+        self._original = None
+
+    def install(self):
+        from telebot import asyncio_helper
+        self._original = asyncio_helper._process_request
+        asyncio_helper._process_request = self
+
+    def uninstall(self):
+        from telebot import asyncio_helper
+        asyncio_helper._process_request = self._original
+
+    async def __call__(self, token, url, method='get', params=None, files=None, **kwargs):
+        import asyncio
+        self.calls[url] += 1
+        message_id = next(self.message_ids)
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return fake_result(url, params, message_id)
+
+
+class FakeTelegramResponse:
+    status_code = 200
+    reason = 'OK'
+
+    def __init__(self, result):
+        self.result = result
+
+    def json(self):
+        return {'ok': True, 'result': self.result}
+
+    @property
+    def text(self):
+        import json
+        return json.dumps(self.json())
+
+
+class FakeTelegram:
+    """Bot API stand-in for the threaded TeleBot, installed as apihelper.CUSTOM_REQUEST_SENDER.
+
+    Requests go through pyTelegramBotAPI's real serialization, only the HTTP
+    round-trip is replaced by a sleep, so call counts match production.
+    """
+
+    # Methods answering with a Message, everything else answers True
+    MESSAGE_METHODS = ('sendMessage', 'sendSticker', 'editMessageText', 'editMessageReplyMarkup')
+
+    def __init__(self, latency=0.0, record=False):
+        self.latency = latency
+        self.calls = Counter()
+        self.lock = threading.Lock()
+        self.message_ids = itertools.count(1000)
+        # (finished at, method, params) of every call when record is set
+        self.log = [] if record else None
+
+    def install(self):
+        from telebot import apihelper
+        apihelper.CUSTOM_REQUEST_SENDER = self
+
+    def uninstall(self):
+        from telebot import apihelper
+        apihelper.CUSTOM_REQUEST_SENDER = None
+
+    def __call__(self, method, url, params=None, files=None, timeout=None, proxies=None, **kwargs):
+        name = url.rsplit('/', 1)[-1]
+        with self.lock:
+            self.calls[name] += 1
+            message_id = next(self.message_ids)
+        if self.latency:
+            time.sleep(self.latency)
+        if self.log is not None:
+            with self.lock:
+                self.log.append((time.perf_counter(), name, dict(params or {})))
+        return FakeTelegramResponse(fake_result(name, params, message_id))
+
+
+def load_bot_module(calendar_latency=0.0):
+    """Import my_telebot without Google credentials or the Telegram log channel"""
+    os.environ.setdefault('TELEGRAM_BOT_TOKEN', '123456:BENCHMARK')
+    os.environ.setdefault('FIRST_CALENDAR_ID', 'badminton@calendar')
+    os.environ.setdefault('SECOND_CALENDAR_ID', 'squash@calendar')
+    for name, icon in (('PAST_DATE_ICON', '✖️'), ('TODAY_ICON', '⭕️'), ('PAST_BOOKING_ICON', '✔️'),
+                       ('OCCUPIED_TIME_ICON', '🔴'), ('USER_BOOKING_ICON', '⭐️')):
+        os.environ.setdefault(name, icon)
+
+    import calendar_helper
+    calendar_helper.GoogleCalendarHelper.setup_credentials = lambda self: None
+    import my_telebot
+
+    root = logging.getLogger()
+    root.handlers = [h for h in root.handlers if not isinstance(h, my_telebot.TelegramLogHandler)]
+    root.setLevel(logging.WARNING)
+
+    my_telebot.calendar_helper.service = FakeCalendarService(calendar_latency)
+    return my_telebot
+
+
+def callback_update(update_id, user_id, data):
+    return {
+        'update_id': update_id,
+        'callback_query': {
+            'id': str(update_id),
+            'from': {'id': user_id, 'is_bot': False, 'first_name': 'User', 'username': f'user{user_id}'},
+            'chat_instance': str(user_id),
+            'data': data,
+            'message': {
+                'message_id': 1,
+                'date': 0,
+                'chat': {'id': user_id, 'type': 'private'},
+                'text': 'benchmark'
+            }
+        }
+    }
+
+
+def message_update(update_id, user_id, text):
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': 0,
+            'from': {'id': user_id, 'is_bot': False, 'first_name': 'User', 'username': f'user{user_id}'},
+            'chat': {'id': user_id, 'type': 'private'},
+            'text': text
+        }
+    }
+
+
+def booking_journey(user_id, option='Бадминтон', day=None, hour=None):
+    """Callback data a user sends while booking one slot, as my_telebot encodes it"""
+    from datetime import date, timedelta
+    from callback_codec import BOOK, CALENDAR, CONFIRM, DAY, TIME
+    from my_telebot import codec, shift_month
+    day = day or date.today() + timedelta(days=1 + user_id % 20)
+    hour = hour if hour is not None else 10 + user_id % 10
+    month = (day.year, day.month)
+    return [
+        codec.encode(BOOK),
+        codec.encode(CALENDAR, option, month),
+        codec.encode(CALENDAR, option, shift_month('next_month', *month)),
+        codec.encode(CALENDAR, option, month),
+        codec.encode(DAY, option, day),
+        codec.encode(TIME, option, day, hour),
+        codec.encode(DAY, option, day),
+        codec.encode(CONFIRM, option, day, hour),
+    ]
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    k = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[k]
@@ -0,0 +1,171 @@
+"""Offline throughput benchmark of my_telebot's real handlers.
+
+    python -m benchmarks.journeys --users 100 --workers 8 --calendar-latency 0.1 --telegram-latency 0.05
+    python -m benchmarks.journeys --check    # fail on more upstream calls per journey than the baseline
+
+Every simulated user replays a scripted journey (/start, book, option, month
+navigation, date, time, confirm) as raw Telegram updates. The updates go
+through the webhook worker pool into TeleBot, the handlers run unchanged and
+only the network edges are faked: Bot API requests go through the
+production telegram_scheduler and are answered by FakeTelegram, Google by
+FakeCalendarService, both with injected latency.
+
+Reports updates/sec, p50/p99 update latency (queueing included) and the
+Google and Telegram calls per journey. --check compares the per-journey
+call counts with benchmarks/journey_baseline.json, --write-baseline
+updates that file.
+"""
+import argparse
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+from datetime import date, timedelta
+
+from benchmarks.fakes import (
+    FakeTelegram, booking_journey, callback_update, load_bot_module, message_update, percentile
+)
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'journey_baseline.json')
+
+
+def journey_updates(user_id, update_ids):
+    """Raw updates of one user's booking, each user gets a slot of their own"""
+    day = date.today() + timedelta(days=1 + (user_id // 10) % 60)
+    hour = 10 + user_id % 10
+    updates = [message_update(next(update_ids), user_id, '/start')]
+    for data in booking_journey(user_id, day=day, hour=hour):
+        updates.append(callback_update(next(update_ids), user_id, data))
+    return updates
+
+
+def run(args):
+    my_telebot = load_bot_module(args.calendar_latency)
+    from telebot import types
+    from webhook_server import ChatOrderedWorkerPool, update_chat_id
+
+    telegram = FakeTelegram(args.telegram_latency)
+    telegram.install()
+    # Timing and pacing of Bot API calls as in production, see my_telebot.startup
+    my_telebot.setup_telegram()
+    google = my_telebot.calendar_helper.service
+    # Start warm like a running bot, the initial full sync is not part of any journey
+    my_telebot.calendar_helper.sync_indexes()
+    google.calls.clear()
+    bot = my_telebot.bot
+    # Same setup as webhook mode: our pool runs the handlers, not TeleBot's threads
+    bot.threaded = False
+
+    latencies = []
+    lock = threading.Lock()
+
+    def handle(item):
+        enqueued_at, update, done = item
+        try:
+            bot.process_new_updates([types.Update.de_json(update)])
+        finally:
+            with lock:
+                latencies.append(time.perf_counter() - enqueued_at)
+            done.set()
+
+    pool = ChatOrderedWorkerPool(handle, workers=args.workers, max_queue=10 ** 6)
+    pool.start()
+
+    update_ids = itertools.count(1)
+    journeys = [journey_updates(user_id, update_ids) for user_id in range(1, args.users + 1)]
+    total = sum(len(updates) for updates in journeys)
+
+    def user(updates):
+        # A user taps the next button only after the previous answer arrived
+        for update in updates:
+            done = threading.Event()
+            pool.submit(update_chat_id(update), (time.perf_counter(), update, done))
+            done.wait()
+            if args.think:
+                time.sleep(args.think)
+
+    started = time.perf_counter()
+
+    threads = [threading.Thread(target=user, args=(updates,)) for updates in journeys]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    pool.stop()
+    telegram.uninstall()
+
+    google_calls = dict(google.calls)
+    telegram_calls = dict(telegram.calls)
+    per_journey = {
+        'google': round(sum(google_calls.values()) / args.users, 2),
+        'telegram': round(sum(telegram_calls.values()) / args.users, 2),
+    }
+    return {
+        'updates': total,
+        'elapsed': elapsed,
+        'latencies': latencies,
+        'google_calls': google_calls,
+        'telegram_calls': telegram_calls,
+        'per_journey': per_journey,
+        'per_journey_detail': {
+            **{f'google.{name}': round(count / args.users, 2) for name, count in google_calls.items()},
+            **{f'telegram.{name}': round(count / args.users, 2) for name, count in telegram_calls.items()},
+        },
+    }
+
+
+def check_baseline(result, baseline, tolerance=0.05):
+    """Per-journey call counts that went up since the baseline.
+
+    The tolerance absorbs periodic syncs that land inside a long run.
+    """
+    regressions = []
+    for name, value in sorted(result['per_journey_detail'].items()):
+        allowed = baseline.get(name, 0)
+        if value > allowed + tolerance:
+            regressions.append(f"{name}: {value} per journey, baseline {allowed}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--workers', type=int, default=8, help='webhook worker threads')
+    parser.add_argument('--calendar-latency', type=float, default=0.1, help='seconds per Google call')
+    parser.add_argument('--telegram-latency', type=float, default=0.05, help='seconds per Bot API call')
+    parser.add_argument('--think', type=float, default=0.0, help='seconds between a user\'s updates')
+    parser.add_argument('--check', action='store_true', help='exit 1 if calls per journey exceed the baseline')
+    parser.add_argument('--write-baseline', action='store_true', help='store calls per journey as the baseline')
+    args = parser.parse_args()
+
+    result = run(args)
+    latencies = result['latencies']
+    print(f"users:             {args.users} ({result['updates']} updates, {args.workers} workers)")
+    print(f"throughput:        {result['updates'] / result['elapsed']:.1f} updates/s")
+    print(f"p50 latency:       {percentile(latencies, 50) * 1000:.1f} ms")
+    print(f"p99 latency:       {percentile(latencies, 99) * 1000:.1f} ms")
+    print(f"google calls:      {result['google_calls']}")
+    print(f"telegram calls:    {result['telegram_calls']}")
+    print(f"per journey:       google {result['per_journey']['google']}, telegram {result['per_journey']['telegram']}")
+
+    if args.write_baseline:
+        with open(BASELINE_PATH, 'w', encoding='utf-8') as f:
+            json.dump(result['per_journey_detail'], f, indent=2, sort_keys=True)
+            f.write('\n')
+        print(f"baseline written to {BASELINE_PATH}")
+
+    if args.check:
+        with open(BASELINE_PATH, encoding='utf-8') as f:
+            regressions = check_baseline(result, json.load(f))
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            sys.exit(1)
+        print("upstream calls per journey within baseline")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""TelegramLogHandler under load and at exit.
+
+    python -m benchmarks.log_handler --threads 8 --records 100 --queue 1000
+
+--threads threads log --records records each through the handler while the
+log channel answers after --telegram-latency seconds. Reports emit()
+latency, then runs logging.shutdown() like the interpreter does at exit
+and fails unless it returns within --shutdown-limit seconds and every
+record was either delivered or counted as dropped.
+"""
+import argparse
+import logging
+import re
+import threading
+import time
+
+from benchmarks.fakes import load_bot_module, percentile
+
+MARKER = 'benchmark record'
+
+
+class FakeLogBot:
+    """The handler's `bot`, only send_message is used"""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.messages = []
+
+    def send_message(self, chat_id, text, parse_mode=None):
+        time.sleep(self.latency)
+        self.messages.append(text)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--records', type=int, default=100, help='records per thread')
+    parser.add_argument('--queue', type=int, default=1000, help='handler queue size')
+    parser.add_argument('--telegram-latency', type=float, default=0.05, help='seconds per Bot API call')
+    parser.add_argument('--shutdown-limit', type=float, default=2.0, help='seconds logging.shutdown() may take')
+    args = parser.parse_args()
+
+    my_telebot = load_bot_module()
+    bot = FakeLogBot(args.telegram_latency)
+    handler = my_telebot.TelegramLogHandler(bot, 'logs', flush_interval=0.2, min_send_interval=0.3,
+                                            max_queue=args.queue)
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    log = logging.getLogger('benchmark.log_handler')
+    log.propagate = False
+    log.setLevel(logging.INFO)
+    log.addHandler(handler)
+
+    latencies = []
+    lock = threading.Lock()
+
+    def worker(n):
+        own = []
+        for m in range(args.records):
+            started = time.perf_counter()
+            log.info(f"{MARKER} {n}.{m}")
+            own.append(time.perf_counter() - started)
+        with lock:
+            latencies.extend(own)
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(args.threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    started = time.perf_counter()
+    logging.shutdown()
+    shutdown = time.perf_counter() - started
+
+    text = '\n'.join(bot.messages)
+    delivered = text.count(MARKER)
+    dropped = sum(int(n) for n in re.findall(r'Пропущено записей лога: (\d+)', text))
+    total = args.threads * args.records
+    print(f"emit       p50 {percentile(latencies, 50) * 1e6:7.1f} us, p99 {percentile(latencies, 99) * 1e6:7.1f} us")
+    print(f"records    {total} logged, {delivered} delivered in {len(bot.messages)} messages, {dropped} dropped")
+    print(f"shutdown   {shutdown:.2f} s")
+    assert shutdown < args.shutdown_limit, f"logging.shutdown() took {shutdown:.2f} s"
+    assert delivered + dropped == total, f"{total - delivered - dropped} records neither delivered nor counted"
+
+
+if __name__ == '__main__':
+    main()
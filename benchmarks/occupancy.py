@@ -0,0 +1,70 @@
+"""Occupancy of many courts over a date range: day by day vs get_occupancy.
+
+    python -m benchmarks.occupancy --courts 60 --days 31 --repeat 20
+
+Starts from calendars never synced, the way a fresh process sees them.
+"day by day" asks every court for every day like the views do,
+get_occupancy asks for all courts and the whole range in one call. Reports
+Google requests for the first read (batched sync included) and CPU per
+read once synced, and fails unless both give the same busy hours.
+"""
+import argparse
+import random
+import time
+from datetime import date, timedelta
+
+from benchmarks.fakes import load_bot_module
+from benchmarks.user_bookings import seed
+
+
+def make_helper(courts, bookings):
+    from calendar_helper import GoogleCalendarHelper
+    from benchmarks.fakes import FakeCalendarService
+    from resources import Resource, ResourceRegistry
+
+    registry = ResourceRegistry([Resource(f'Корт {n}', f'court{n}@calendar') for n in range(courts)])
+    helper = GoogleCalendarHelper(registry)
+    helper.service = FakeCalendarService()
+    seed(helper.service, registry.calendar_ids().values(), bookings, random.Random(courts))
+    return helper
+
+
+def day_by_day(helper, options, start, days):
+    return {option: {start + timedelta(days=n): helper.get_day_occupancy(start + timedelta(days=n), option)
+                     .mask(start + timedelta(days=n)) for n in range(days)} for option in options}
+
+
+def ranged(helper, options, start, days):
+    occupancy = helper.get_occupancy(options, start, start + timedelta(days=days))
+    return {option: {start + timedelta(days=n): occupancy[option].mask(start + timedelta(days=n))
+                     for n in range(days)} for option in options}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--courts', type=int, default=60)
+    parser.add_argument('--bookings', type=int, default=200, help='bookings per court')
+    parser.add_argument('--days', type=int, default=31)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    # Patches out Google credentials
+    load_bot_module()
+    start = date.today() + timedelta(days=1)
+    results = {}
+    for name, func in (('day by day', day_by_day), ('get_occupancy', ranged)):
+        helper = make_helper(args.courts, args.bookings)
+        options = helper.resources.names()
+        results[name] = func(helper, options, start, args.days)
+        requests = sum(count for method, count in helper.service.calls.items() if not method.startswith('batch:'))
+        started = time.perf_counter()
+        for _ in range(args.repeat):
+            func(helper, options, start, args.days)
+        seconds = (time.perf_counter() - started) / args.repeat
+        print(f"{name:13} first read {requests} google requests {dict(helper.service.calls)},"
+              f" then {seconds * 1e3:7.2f} ms per read ({args.courts} courts x {args.days} days)")
+    assert results['day by day'] == results['get_occupancy'], "occupancy differs between the two reads"
+
+
+if __name__ == '__main__':
+    main()
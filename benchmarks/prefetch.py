@@ -0,0 +1,82 @@
+"""Latency of the tap after the month view, with and without the prefetcher.
+
+    python -m benchmarks.prefetch --users 40 --calendar-latency 0.2 --sync-interval 2 --think 1.5
+
+Each simulated user opens the month, thinks for a while and then opens a
+near day (or the next month). Without prefetching, a calendar that went
+stale during the pause is synced inside that tap; with it, the sync and
+the cache loads have already happened in the background.
+"""
+import argparse
+import random
+import threading
+import time
+from datetime import date, timedelta
+
+from benchmarks.fakes import load_bot_module, percentile
+
+
+def simulate(my_telebot, args, seed):
+    rng = random.Random(seed)
+    latencies = []
+    lock = threading.Lock()
+
+    def user(user_id):
+        time.sleep(rng.uniform(0, args.sync_interval))
+        today = date.today()
+        my_telebot.generate_calendar(today.year, today.month, 'Бадминтон', user_id)
+        time.sleep(args.think)
+        started = time.perf_counter()
+        if user_id % 4:
+            day = today + timedelta(days=user_id % 3)
+            my_telebot.generate_time_slots('Бадминтон', day, user_id)
+        else:
+            year, month = my_telebot.shift_month('next_month', today.year, today.month)
+            my_telebot.generate_calendar(year, month, 'Бадминтон', user_id)
+        with lock:
+            latencies.append(time.perf_counter() - started)
+
+    threads = [threading.Thread(target=user, args=(user_id,)) for user_id in range(1, args.users + 1)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=40)
+    parser.add_argument('--calendar-latency', type=float, default=0.2, help='seconds per Google call')
+    parser.add_argument('--sync-interval', type=float, default=2.0, help='seconds a synced calendar is trusted')
+    parser.add_argument('--think', type=float, default=1.5, help='seconds between the month view and the next tap')
+    args = parser.parse_args()
+
+    my_telebot = load_bot_module(args.calendar_latency)
+    from calendar_helper import TTLCache
+    from prefetch import Prefetcher
+
+    helper = my_telebot.calendar_helper
+    for option in helper.calendar_ids:
+        helper.set_sync_interval(helper.get_calendar_id(option), args.sync_interval)
+
+    for name, workers in (('no prefetch', 0), ('prefetch', 2)):
+        helper.service.calls.clear()
+        # Both runs start with cold view caches
+        helper.busy_slots_cache = TTLCache(helper.busy_slots_cache.maxsize, helper.busy_slots_cache.ttl)
+        helper.month_occupancy_cache = TTLCache(helper.month_occupancy_cache.maxsize, helper.month_occupancy_cache.ttl)
+        my_telebot.prefetcher = Prefetcher(helper, workers=workers, refresh_ahead=args.think + 0.5,
+                                           syncs_per_minute=600)
+        latencies = simulate(my_telebot, args, seed=1)
+        stats = my_telebot.prefetcher.stats()
+        print(f"{name:12} next tap p50 {percentile(latencies, 50) * 1000:7.1f} ms"
+              f"  p99 {percentile(latencies, 99) * 1000:7.1f} ms"
+              f"  google calls {sum(helper.service.calls.values())}")
+        if workers:
+            print(f"{'':12} prefetch hit rate {stats['prefetch_hit_rate']:.0%}"
+                  f" ({stats['prefetch_hits']} of {stats['loaded']} loads), syncs {stats['syncs']}")
+        my_telebot.prefetcher.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""Google Calendar push notifications end to end: notification -> resync, token check, channel renewal.
+
+    python -m benchmarks.push --ttl 3 --renew-margin 2
+
+Opens watch channels through calendar_watch.CalendarWatcher against the
+fake Calendar, serves the notification route on a local port and has the
+fake post notifications to it over HTTP, the way Google does. Reports how
+long a change made in the calendar takes to show up in the bot's index,
+and fails unless:
+
+    a notification resyncs the changed calendar,
+    a notification with a wrong channel token is rejected,
+    every channel is replaced before it expires and the old one stopped,
+    notifications on the renewed channels still resync.
+"""
+import argparse
+import time
+from datetime import date, timedelta
+
+from benchmarks.fakes import FakeCalendarService, load_bot_module, post_calendar_notification
+
+TOKEN = 'benchmark-token'
+
+
+def wait_for(condition, timeout):
+    deadline = time.perf_counter() + timeout
+    while not condition():
+        if time.perf_counter() > deadline:
+            return False
+        time.sleep(0.005)
+    return True
+
+
+def book_directly(google, calendar_id, day, hour, n):
+    """A booking made in Google Calendar itself, not through the bot"""
+    with google.lock:
+        google.save(calendar_id, {
+            'id': f'direct{n}',
+            'start': {'dateTime': f'{day}T{hour:02d}:00:00+03:00'},
+            'end': {'dateTime': f'{day}T{hour + 1:02d}:00:00+03:00'},
+            'extendedProperties': {'private': {'userId': '99'}}
+        })
+
+
+def resync_seconds(helper, google, calendar_id, day, hour, n, timeout):
+    index = helper.indexes[calendar_id]
+    book_directly(google, calendar_id, day, hour, n)
+    started = time.perf_counter()
+    statuses = google.notify(calendar_id)
+    assert statuses and all(status == 200 for status in statuses), f"notification answered {statuses}"
+    seen = wait_for(lambda: any(b['start'].hour == hour for b in index.bookings_for_date(day)), timeout)
+    assert seen, f"{calendar_id} not resynced {timeout}s after the notification"
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--ttl', type=int, default=3, help='watch channel lifetime, seconds')
+    parser.add_argument('--renew-margin', type=int, default=2, help='renew channels this long before expiry')
+    parser.add_argument('--calendar-latency', type=float, default=0.05, help='seconds per Google call')
+    args = parser.parse_args()
+
+    my_telebot = load_bot_module()
+    from calendar_helper import GoogleCalendarHelper
+    from calendar_watch import CalendarWatcher
+    from webhook_server import LocalHTTPServer
+
+    helper = GoogleCalendarHelper(my_telebot.calendar_helper.resources)
+    google = helper.service = FakeCalendarService(args.calendar_latency)
+    helper.sync_indexes()
+
+    server = LocalHTTPServer(port=0)
+    address = f'http://127.0.0.1:{server.httpd.server_address[1]}/calendar'
+    watcher = CalendarWatcher(helper, address, token=TOKEN, ttl=args.ttl, renew_margin=args.renew_margin)
+    server.add_route('POST', '/calendar', watcher.handle_notification)
+    server.start()
+    watcher.start()
+    try:
+        calendar_ids = sorted(set(helper.calendar_ids.values()))
+        first_channels = set(watcher.channels)
+        assert len(first_channels) == len(calendar_ids), f"{len(first_channels)} channels for {len(calendar_ids)} calendars"
+        day = date.today() + timedelta(days=2)
+
+        seconds = resync_seconds(helper, google, calendar_ids[0], day, 10, 1, timeout=5)
+        print(f"change visible {seconds * 1000:6.1f} ms after the notification"
+              f" (watched calendars are polled every {helper.indexes[calendar_ids[0]].sync_interval} s)")
+
+        channel_id = next(iter(first_channels))
+        post_calendar_notification(address, channel_id, 'resource', token='wrong')
+        assert watcher.stats()['rejected'] == 1, "notification with a wrong token was accepted"
+        print("wrong channel token: rejected")
+
+        renewed = wait_for(lambda: not first_channels & set(watcher.channels), args.ttl + 5)
+        assert renewed, f"channels not renewed: {watcher.stats()}"
+        assert watcher.stats()['renewals'] >= len(calendar_ids), f"expired channels dropped: {watcher.stats()}"
+        stopped = wait_for(lambda: not first_channels & set(google.watch_channels), 5)
+        assert stopped, "replaced channels not stopped on Google's side"
+        print(f"renewed {len(calendar_ids)} channels before expiry, old ones stopped")
+
+        seconds = resync_seconds(helper, google, calendar_ids[-1], day, 11, 2, timeout=5)
+        print(f"after renewal, change visible {seconds * 1000:6.1f} ms after the notification")
+        print(f"watcher: {watcher.stats()}")
+    finally:
+        watcher.stop()
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""Pacing of outbound Bot API calls by telegram_scheduler, and how it handles 429 answers.
+
+    python -m benchmarks.rate_limits --calls 20 --telegram-latency 0.02
+
+Goes through pyTelegramBotAPI with the scheduler installed the way
+my_telebot.startup does. Reports how long --calls edits of one message,
+callback answers and new messages in one chat take: edits and answers
+reply to the user's own taps and go straight out, new messages are paced
+at TELEGRAM_CHAT_RATE after a burst of TELEGRAM_CHAT_BURST. Then replays
+an edit answered with 429 while a newer edit of the same message went
+out, and fails unless the message ends up with the newer text.
+"""
+import argparse
+import threading
+import time
+
+from benchmarks.fakes import FakeTelegram, FakeTelegramResponse, load_bot_module
+
+CHAT_ID = 42
+MESSAGE_ID = 7
+
+
+class RateLimitedResponse(FakeTelegramResponse):
+    status_code = 429
+    reason = 'Too Many Requests'
+
+    def __init__(self, retry_after):
+        super().__init__(None)
+        self.retry_after = retry_after
+
+    def json(self):
+        return {'ok': False, 'error_code': 429, 'description': 'Too Many Requests: retry later',
+                'parameters': {'retry_after': self.retry_after}}
+
+
+class FlakyTelegram(FakeTelegram):
+    """FakeTelegram answering the first call of a method with 429 after a delay"""
+
+    def __init__(self, latency=0.0):
+        super().__init__(latency, record=True)
+        self.fail = {}  # method -> (seconds in flight, retry_after)
+
+    def __call__(self, method, url, params=None, files=None, **kwargs):
+        failure = self.fail.pop(url.rsplit('/', 1)[-1], None)
+        if failure is None:
+            return super().__call__(method, url, params, files, **kwargs)
+        time.sleep(failure[0])
+        return RateLimitedResponse(failure[1])
+
+
+def timed(func, calls):
+    started = time.perf_counter()
+    for n in range(calls):
+        func(n)
+    return time.perf_counter() - started
+
+
+def pacing(bot, telegram, calls):
+    for name, func in (
+        ('edits', lambda n: bot.edit_message_text(f'text {n}', CHAT_ID, MESSAGE_ID)),
+        ('answers', lambda n: bot.answer_callback_query(str(n))),
+        ('messages', lambda n: bot.send_message(CHAT_ID, f'text {n}')),
+    ):
+        telegram.calls.clear()
+        elapsed = timed(func, calls)
+        print(f"{calls} {name:8} in one chat {elapsed:6.2f} s, {sum(telegram.calls.values())} Bot API calls")
+
+
+def stale_retry(bot, telegram):
+    """An edit answered with 429 must not overwrite a newer edit sent meanwhile"""
+    telegram.log.clear()
+    # The old edit is in flight for 0.2 s, then told to retry after 0.1 s
+    telegram.fail['editMessageText'] = (0.2, 0.1)
+    # A chat of its own, nothing paced before has used up its burst
+    chat_id = CHAT_ID + 1
+    old = threading.Thread(target=bot.edit_message_text, args=('old', chat_id, MESSAGE_ID))
+    old.start()
+    time.sleep(0.05)
+    bot.edit_message_text('new', chat_id, MESSAGE_ID)
+    old.join()
+    texts = [params.get('text') for _, method, params in telegram.log if method == 'editMessageText']
+    print(f"edit retried after 429 with a newer edit sent meanwhile: sent {texts}")
+    assert texts == ['new'], f"stale edit went out after the newer one: {texts}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--calls', type=int, default=20)
+    parser.add_argument('--telegram-latency', type=float, default=0.02, help='seconds per Bot API call')
+    args = parser.parse_args()
+
+    my_telebot = load_bot_module()
+    telegram = FlakyTelegram(args.telegram_latency)
+    telegram.install()
+    my_telebot.setup_telegram()
+    try:
+        pacing(my_telebot.bot, telegram, args.calls)
+        stale_retry(my_telebot.bot, telegram)
+    finally:
+        telegram.uninstall()
+    print(f"scheduler: {my_telebot.telegram_scheduler.stats()}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""Booking the same slot for several weeks: one confirmation per week vs the weekly series.
+
+    python -m benchmarks.recurring --weeks 8 --calendar-latency 0.3 --telegram-latency 0.08
+
+One user books a court at the same hour for N weeks through the real
+handlers. Week by week means date, time and confirmation taps for every
+date; the series is date, time, "Каждую неделю" and the number of weeks,
+checked with one range read and inserted with one batch request.
+Reports Google and Telegram calls and the time the user spends waiting.
+"""
+import argparse
+import itertools
+import time
+from datetime import date, timedelta
+
+from benchmarks.fakes import FakeTelegram, callback_update, load_bot_module
+
+
+def run(my_telebot, payloads, user_id):
+    from telebot import types
+
+    update_ids = itertools.count(1)
+    started = time.perf_counter()
+    for data in payloads:
+        my_telebot.bot.process_new_updates([types.Update.de_json(callback_update(next(update_ids), user_id, data))])
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--weeks', type=int, default=8)
+    parser.add_argument('--calendar-latency', type=float, default=0.3, help='seconds per Google call')
+    parser.add_argument('--telegram-latency', type=float, default=0.08, help='seconds per Bot API call')
+    args = parser.parse_args()
+
+    my_telebot = load_bot_module(args.calendar_latency)
+    from callback_codec import CONFIRM, CONFIRM_REPEAT, DAY, REPEAT, TIME
+
+    codec = my_telebot.codec
+    my_telebot.RECURRING_MAX_WEEKS = max(my_telebot.RECURRING_MAX_WEEKS, args.weeks)
+    my_telebot.bot.threaded = False
+    google = my_telebot.calendar_helper.service
+    my_telebot.calendar_helper.sync_indexes()
+    telegram = FakeTelegram(args.telegram_latency)
+    telegram.install()
+
+    first = date.today() + timedelta(days=1)
+    weekly = []
+    for day in (first + timedelta(weeks=n) for n in range(args.weeks)):
+        weekly += [codec.encode(DAY, 'Бадминтон', day), codec.encode(TIME, 'Бадминтон', day, 12),
+                   codec.encode(CONFIRM, 'Бадминтон', day, 12)]
+    # Another hour, so the series finds every week free too
+    series = [codec.encode(DAY, 'Бадминтон', first), codec.encode(TIME, 'Бадминтон', first, 13),
+              codec.encode(REPEAT, 'Бадминтон', first, 13), codec.encode(CONFIRM_REPEAT, 'Бадминтон', first, 13, args.weeks)]
+
+    for name, payloads in (('week by week', weekly), ('series', series)):
+        google.calls.clear()
+        telegram.calls.clear()
+        elapsed = run(my_telebot, payloads, 1)
+        # Requests inside a batch share its round-trip
+        google_requests = sum(count for method, count in google.calls.items() if not method.startswith('batch:'))
+        print(f"{name:12} {elapsed:6.2f} s waiting, {len(payloads):3} taps, "
+              f"google {google_requests:2} requests {dict(google.calls)}, "
+              f"telegram {sum(telegram.calls.values()):3} calls")
+    telegram.uninstall()
+
+
+if __name__ == '__main__':
+    main()
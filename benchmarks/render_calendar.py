@@ -0,0 +1,115 @@
+"""Micro-benchmark: month calendar rendering before and after the layout cache.
+
+    python -m benchmarks.render_calendar --bookings 300 --repeat 2000
+
+Both variants read bookings from an already synced index, so the numbers
+are pure CPU per callback.
+"""
+import argparse
+import calendar
+import os
+import random
+import timeit
+from datetime import date, timedelta
+
+from benchmarks.fakes import load_bot_module
+
+
+def legacy_generate_calendar(my_telebot, year, month, option, user_id):
+    """generate_calendar as it was before the layout cache"""
+    types = my_telebot.types
+    calendar_helper = my_telebot.calendar_helper
+    markup = types.InlineKeyboardMarkup()
+    today = date.today()
+
+    month_name = calendar.month_name[month].capitalize()
+    header = [
+        types.InlineKeyboardButton("<<", callback_data=f"prev_month:{option}:{year}-{month}"),
+        types.InlineKeyboardButton(month_name, callback_data="ignore"),
+        types.InlineKeyboardButton(">>", callback_data=f"next_month:{option}:{year}-{month}")
+    ]
+    markup.row(*header)
+
+    week_days = ["Пн", "Вт", "Ср", "Чт", "Пт", "Сб", "Вс"]
+    markup.row(*[types.InlineKeyboardButton(day, callback_data="ignore") for day in week_days])
+
+    start_date = date(year, month, 1)
+    end_date = date(year, month + 1, 1) if month < 12 else date(year + 1, 1, 1)
+    bookings = calendar_helper.get_month_bookings(start_date, end_date, option)
+    user_bookings = calendar_helper.get_user_bookings(start_date, end_date, option, user_id)
+
+    cal = calendar.monthcalendar(year, month)
+    for week in cal:
+        row = []
+        for day in week:
+            if day == 0:
+                btn = types.InlineKeyboardButton(" ", callback_data="ignore")
+            else:
+                current_date = date(year, month, day)
+                display_text = str(day)
+                if current_date < today:
+                    if any(booking['date'] == current_date for booking in bookings):
+                        display_text = f"{day}{os.getenv('PAST_BOOKING_ICON')}"
+                    else:
+                        display_text = f"{day}{os.getenv('PAST_DATE_ICON')}"
+                elif current_date == today:
+                    display_text = f"{day}{os.getenv('TODAY_ICON')}"
+                else:
+                    if any(booking['date'] == current_date and booking['user_id'] == str(user_id) for booking in user_bookings):
+                        display_text = f"{day}{os.getenv('USER_BOOKING_ICON')}"
+
+                btn = types.InlineKeyboardButton(
+                    display_text,
+                    callback_data=f"select_date:{option}:{year}-{month}-{day}"
+                )
+            row.append(btn)
+        markup.row(*row)
+
+    back_button = types.InlineKeyboardButton("« Назад", callback_data="back_to_options")
+    markup.row(back_button)
+    return markup
+
+
+def seed_bookings(service, calendar_id, year, month, count):
+    first = date(year, month, 1)
+    events = service.store.setdefault(calendar_id, {})
+    for n in range(count):
+        day = first + timedelta(days=random.randrange(28))
+        hour = random.randrange(10, 20)
+        events[f'seed{n}'] = {
+            'id': f'seed{n}',
+            'start': {'dateTime': f'{day}T{hour:02d}:00:00+03:00'},
+            'end': {'dateTime': f'{day}T{hour + 1:02d}:00:00+03:00'},
+            'extendedProperties': {'private': {'userId': str(random.randrange(1, 50))}}
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--bookings', type=int, default=300, help='bookings in the rendered month')
+    parser.add_argument('--repeat', type=int, default=2000)
+    args = parser.parse_args()
+
+    my_telebot = load_bot_module()
+    option = 'Бадминтон'
+    today = date.today()
+    seed_bookings(my_telebot.calendar_helper.service, os.getenv('FIRST_CALENDAR_ID'), today.year, today.month, args.bookings)
+    my_telebot.calendar_helper.get_index(option)
+
+    def render(func):
+        return lambda: func(today.year, today.month, option, 7)
+
+    legacy = render(lambda *a: legacy_generate_calendar(my_telebot, *a))
+    current = render(my_telebot.generate_calendar)
+    # Payloads differ since callback_codec, what the user sees must not
+    def labels(markup):
+        return [[button.text for button in row] for row in markup.keyboard]
+    assert labels(legacy()) == labels(current()), "renderers disagree"
+
+    for name, func in (('legacy', legacy), ('cached layout', current)):
+        seconds = timeit.timeit(func, number=args.repeat)
+        print(f"{name:14} {seconds / args.repeat * 1e6:8.1f} us/render")
+
+
+if __name__ == '__main__':
+    main()
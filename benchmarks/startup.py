@@ -0,0 +1,72 @@
+"""Startup time of the bot process: how long until it can answer /start.
+
+    python -m benchmarks.startup --runs 10
+
+Each run starts a fresh interpreter that imports my_telebot and calls
+startup() (locale + background calendar warm-up), like `python my_telebot.py`
+does before polling. Google and Telegram are never contacted: the
+credentials are loaded lazily and the warm-up thread is not waited for.
+The deferred cost of building the Calendar client is measured separately.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+STARTUP_SCRIPT = """
+import time
+started = time.perf_counter()
+import logging
+import my_telebot
+root = logging.getLogger()
+root.handlers = [h for h in root.handlers if not isinstance(h, my_telebot.TelegramLogHandler)]
+my_telebot.calendar_helper.warm_up = lambda: None
+try:
+    my_telebot.startup()
+except Exception:
+    pass  # missing ru_RU locale only affects month names
+print(time.perf_counter() - started)
+"""
+
+BUILD_SCRIPT = """
+import time
+started = time.perf_counter()
+from googleapiclient.discovery import build
+build('calendar', 'v3', developerKey='benchmark', static_discovery=True, cache_discovery=False)
+print(time.perf_counter() - started)
+"""
+
+
+def run_python(script, env):
+    """(wall seconds of the whole process, seconds reported by the script)"""
+    started = time.perf_counter()
+    result = subprocess.run([sys.executable, '-c', script], cwd=ROOT, env=env,
+                            capture_output=True, text=True, check=True)
+    return time.perf_counter() - started, float(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=10)
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    env.setdefault('TELEGRAM_BOT_TOKEN', '123456:BENCHMARK')
+    env.setdefault('LOGS_CHANNEL_ID', '0')
+
+    process, imports = zip(*(run_python(STARTUP_SCRIPT, env) for _ in range(args.runs)))
+    build_time = statistics.median(run_python(BUILD_SCRIPT, env)[1] for _ in range(3))
+
+    print(f"runs:                        {args.runs}")
+    print(f"import + startup() median:   {statistics.median(imports) * 1000:.0f} ms")
+    print(f"whole process median:        {statistics.median(process) * 1000:.0f} ms")
+    print(f"process max:                 {max(process) * 1000:.0f} ms")
+    print(f"calendar client build (lazy, off the startup path): {build_time * 1000:.0f} ms")
+
+
+if __name__ == '__main__':
+    main()
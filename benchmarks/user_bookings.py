@@ -0,0 +1,85 @@
+"""Cost of "my bookings" as the calendars grow, month scans vs the per-user index.
+
+    python -m benchmarks.user_bookings --courts 50 --bookings 200 --repeat 200
+
+Every court's calendar is seeded with bookings over the next two months
+spread over many users, and one user holds a handful of them. The scan
+lists the next two months of every court and filters by user, the way
+get_user_bookings works; the index asks the storage for that user's
+bookings only. Both read synced local data, so the numbers are pure
+CPU per request, for the in-process and the SQLite storage.
+"""
+import argparse
+import os
+import random
+import tempfile
+import timeit
+from datetime import date, timedelta
+
+from benchmarks.fakes import FakeCalendarService, load_bot_module
+
+USER_ID = 7
+USER_BOOKINGS = 5
+
+
+def seed(service, calendar_ids, bookings, rng):
+    today = date.today()
+    slots = [(today + timedelta(days=day), hour) for day in range(1, 60) for hour in range(10, 20)]
+    for n, calendar_id in enumerate(calendar_ids):
+        events = service.store.setdefault(calendar_id, {})
+        for m, (day, hour) in enumerate(rng.sample(slots, bookings)):
+            # The benchmarked user has a few bookings on the first courts, everyone else is random
+            user_id = USER_ID if n < USER_BOOKINGS and m == 0 else rng.randrange(100, 10000)
+            events[f'seed{m}'] = {
+                'id': f'seed{m}',
+                'start': {'dateTime': f'{day}T{hour:02d}:00:00+03:00'},
+                'end': {'dateTime': f'{day}T{hour + 1:02d}:00:00+03:00'},
+                'extendedProperties': {'private': {'userId': str(user_id)}}
+            }
+
+
+def make_helper(courts, bookings, db_path=None):
+    from calendar_helper import GoogleCalendarHelper
+    from booking_storage import SQLiteStorage
+    from resources import Resource, ResourceRegistry
+
+    registry = ResourceRegistry([Resource(f'Корт {n}', f'court{n}@calendar') for n in range(courts)])
+    helper = GoogleCalendarHelper(registry)
+    if db_path:
+        helper.storage = SQLiteStorage(db_path)
+    helper.service = FakeCalendarService()
+    seed(helper.service, registry.calendar_ids().values(), bookings, random.Random(courts))
+    helper.sync_indexes()
+    return helper
+
+
+def scan(helper):
+    start = date.today()
+    end = start + timedelta(days=60)
+    return [(option, booking) for option in helper.resources.names()
+            for booking in helper.get_user_bookings(start, end, option, USER_ID)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--courts', type=int, default=50)
+    parser.add_argument('--bookings', type=int, default=200, help='bookings per court')
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    # Patches out Google credentials
+    load_bot_module()
+    with tempfile.TemporaryDirectory() as directory:
+        for storage, db_path in (('memory', None), ('sqlite', os.path.join(directory, 'cache.db'))):
+            helper = make_helper(args.courts, args.bookings, db_path)
+            found = helper.get_upcoming_user_bookings(USER_ID)
+            assert [b['id'] for _, b in found] == [b['id'] for _, b in sorted(scan(helper), key=lambda i: i[1]['start'])]
+            for name, func in (('scan', lambda: scan(helper)),
+                               ('index', lambda: helper.get_upcoming_user_bookings(USER_ID))):
+                seconds = timeit.timeit(func, number=args.repeat)
+                print(f"{storage:6} {name:5} {seconds / args.repeat * 1e3:8.3f} ms per request"
+                      f" ({args.courts} courts x {args.bookings} bookings, {len(found)} of the user)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,290 @@
+import logging
+import os
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+from time import time
+from zoneinfo import ZoneInfo
+
+logger = logging.getLogger(__name__)
+
+# Bookings are made and displayed in Moscow time
+TIMEZONE_NAME = 'Europe/Moscow'
+TIMEZONE = ZoneInfo(TIMEZONE_NAME)
+
+
+def hour_slots(start_dt, end_dt):
+    """(date, hour) pairs in local time touched by [start_dt, end_dt)"""
+    start_dt = start_dt.astimezone(TIMEZONE)
+    end_dt = end_dt.astimezone(TIMEZONE)
+    current = start_dt.replace(minute=0, second=0, microsecond=0)
+    while current < end_dt:
+        yield current.date(), current.hour
+        current += timedelta(hours=1)
+
+
+def make_booking(event_id, start_dt, end_dt, user_id):
+    """Booking dict as returned by GoogleCalendarHelper"""
+    start_dt = start_dt.astimezone(TIMEZONE)
+    end_dt = end_dt.astimezone(TIMEZONE)
+    return {
+        'id': event_id,
+        'start': start_dt,
+        'end': end_dt,
+        'date': start_dt.date(),
+        'hour': start_dt.hour,
+        'user_id': user_id,
+        # (date, hour) slots covered by the event, computed once here for Occupancy
+        'slots': tuple(hour_slots(start_dt, end_dt))
+    }
+
+
+class MemoryStorage:
+    """Bookings and sync state of every calendar, kept in this process only"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._events = {}   # calendar id -> {event id: booking}
+        self._by_date = {}  # calendar id -> {date: {event id: booking}}
+        self._by_user = {}  # user id -> {(calendar id, event id): booking}
+        self._state = {}    # calendar id -> [sync token, synced at, version]
+
+    def get_state(self, calendar_id):
+        """(sync token, unix time of the last sync, version) of a calendar"""
+        with self._lock:
+            return tuple(self._state.get(calendar_id, (None, None, 0)))
+
+    def reset(self, calendar_id):
+        with self._lock:
+            state = self._state.setdefault(calendar_id, [None, None, 0])
+            state[0] = state[1] = None
+
+    def apply_changes(self, calendar_id, changes, replace=False, sync_token=None):
+        """Store (event id, booking or None for deleted) pairs.
+
+        With replace the calendar's previous bookings are dropped first.
+        A sync_token also marks the calendar as synced now. Returns the
+        set of dates whose bookings changed.
+        """
+        with self._lock:
+            events = self._events.setdefault(calendar_id, {})
+            by_date = self._by_date.setdefault(calendar_id, {})
+            changed_dates = set()
+            if replace:
+                changed_dates.update(by_date)
+                for event_id, booking in events.items():
+                    self._unlink_user(calendar_id, event_id, booking)
+                events.clear()
+                by_date.clear()
+
+            for event_id, booking in changes:
+                old = events.pop(event_id, None)
+                if old:
+                    changed_dates.add(old['date'])
+                    day = by_date.get(old['date'], {})
+                    day.pop(event_id, None)
+                    if not day:
+                        by_date.pop(old['date'], None)
+                    self._unlink_user(calendar_id, event_id, old)
+                if booking:
+                    events[event_id] = booking
+                    by_date.setdefault(booking['date'], {})[event_id] = booking
+                    if booking['user_id']:
+                        self._by_user.setdefault(booking['user_id'], {})[(calendar_id, event_id)] = booking
+                    changed_dates.add(booking['date'])
+
+            state = self._state.setdefault(calendar_id, [None, None, 0])
+            if changed_dates:
+                state[2] += 1
+            if sync_token:
+                state[0] = sync_token
+                state[1] = time()
+            return changed_dates
+
+    def _unlink_user(self, calendar_id, event_id, booking):
+        user_bookings = self._by_user.get(booking['user_id'])
+        if user_bookings is not None:
+            user_bookings.pop((calendar_id, event_id), None)
+            if not user_bookings:
+                del self._by_user[booking['user_id']]
+
+    def bookings_between(self, calendar_id, start_date, end_date):
+        """Bookings with start_date <= date < end_date, ordered by start time"""
+        with self._lock:
+            by_date = self._by_date.get(calendar_id, {})
+            bookings = []
+            day = start_date
+            while day < end_date:
+                bookings.extend(by_date.get(day, {}).values())
+                day += timedelta(days=1)
+        return sorted(bookings, key=lambda b: b['start'])
+
+    def bookings_for_user(self, user_id, since=None):
+        """(calendar id, booking) pairs of one user starting at or after since"""
+        with self._lock:
+            items = list(self._by_user.get(str(user_id), {}).items())
+        result = [(calendar_id, booking) for (calendar_id, _), booking in items
+                  if since is None or booking['start'] >= since]
+        return sorted(result, key=lambda item: item[1]['start'])
+
+
+class SQLiteStorage:
+    """Bookings and sync state in a WAL-mode SQLite file.
+
+    Every bot process on the host can open the same file, so they share
+    one warm copy of the calendars and a restart does not start cold.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS events (
+            calendar_id TEXT NOT NULL,
+            event_id TEXT NOT NULL,
+            start TEXT NOT NULL,
+            end TEXT NOT NULL,
+            user_id TEXT,
+            PRIMARY KEY (calendar_id, event_id)
+        );
+        CREATE INDEX IF NOT EXISTS events_calendar_start ON events (calendar_id, start);
+        DROP INDEX IF EXISTS events_user;
+        CREATE INDEX IF NOT EXISTS events_user_start ON events (user_id, start);
+        CREATE TABLE IF NOT EXISTS sync_state (
+            calendar_id TEXT PRIMARY KEY,
+            sync_token TEXT,
+            synced_at REAL,
+            version INTEGER NOT NULL DEFAULT 0
+        );
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._conn().executescript(self.SCHEMA)
+
+    def _conn(self):
+        # sqlite3 connections must not be shared between threads
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def _connection(self, write=False):
+        return _Transaction(self._conn(), write)
+
+    def get_state(self, calendar_id):
+        """(sync token, unix time of the last sync, version) of a calendar"""
+        with self._connection() as conn:
+            row = conn.execute(
+                'SELECT sync_token, synced_at, version FROM sync_state WHERE calendar_id = ?',
+                (calendar_id,)
+            ).fetchone()
+        return tuple(row) if row else (None, None, 0)
+
+    def reset(self, calendar_id):
+        with self._connection(write=True) as conn:
+            conn.execute(
+                'UPDATE sync_state SET sync_token = NULL, synced_at = NULL WHERE calendar_id = ?',
+                (calendar_id,)
+            )
+
+    def apply_changes(self, calendar_id, changes, replace=False, sync_token=None):
+        """Same contract as MemoryStorage.apply_changes, in one transaction"""
+        with self._connection(write=True) as conn:
+            changed_dates = set()
+            if replace:
+                rows = conn.execute(
+                    'SELECT DISTINCT substr(start, 1, 10) FROM events WHERE calendar_id = ?',
+                    (calendar_id,)
+                )
+                changed_dates.update(datetime.strptime(row[0], '%Y-%m-%d').date() for row in rows)
+                conn.execute('DELETE FROM events WHERE calendar_id = ?', (calendar_id,))
+
+            for event_id, booking in changes:
+                if not replace:
+                    old = conn.execute(
+                        'SELECT start FROM events WHERE calendar_id = ? AND event_id = ?',
+                        (calendar_id, event_id)
+                    ).fetchone()
+                    if old:
+                        changed_dates.add(datetime.fromisoformat(old[0]).date())
+                        conn.execute(
+                            'DELETE FROM events WHERE calendar_id = ? AND event_id = ?',
+                            (calendar_id, event_id)
+                        )
+                if booking:
+                    conn.execute(
+                        'INSERT OR REPLACE INTO events (calendar_id, event_id, start, end, user_id) '
+                        'VALUES (?, ?, ?, ?, ?)',
+                        (calendar_id, event_id, booking['start'].isoformat(),
+                         booking['end'].isoformat(), booking['user_id'])
+                    )
+                    changed_dates.add(booking['date'])
+
+            conn.execute('INSERT OR IGNORE INTO sync_state (calendar_id) VALUES (?)', (calendar_id,))
+            if changed_dates:
+                conn.execute('UPDATE sync_state SET version = version + 1 WHERE calendar_id = ?', (calendar_id,))
+            if sync_token:
+                conn.execute(
+                    'UPDATE sync_state SET sync_token = ?, synced_at = ? WHERE calendar_id = ?',
+                    (sync_token, time(), calendar_id)
+                )
+            return changed_dates
+
+    def bookings_between(self, calendar_id, start_date, end_date):
+        """Bookings with start_date <= date < end_date, ordered by start time"""
+        # Starts are stored as local-time ISO strings, so date prefixes compare correctly
+        with self._connection() as conn:
+            rows = conn.execute(
+                'SELECT event_id, start, end, user_id FROM events '
+                'WHERE calendar_id = ? AND start >= ? AND start < ? ORDER BY start',
+                (calendar_id, start_date.isoformat(), end_date.isoformat())
+            ).fetchall()
+        return [self._booking(row) for row in rows]
+
+    def bookings_for_user(self, user_id, since=None):
+        """(calendar id, booking) pairs of one user starting at or after since"""
+        # Starts are stored in local time, so ISO strings compare like the datetimes
+        since = since.astimezone(TIMEZONE).isoformat() if since is not None else ''
+        with self._connection() as conn:
+            rows = conn.execute(
+                'SELECT calendar_id, event_id, start, end, user_id FROM events '
+                'WHERE user_id = ? AND start >= ? ORDER BY start',
+                (str(user_id), since)
+            ).fetchall()
+        return [(row[0], self._booking(row[1:])) for row in rows]
+
+    @staticmethod
+    def _booking(row):
+        event_id, start, end, user_id = row
+        return make_booking(event_id, datetime.fromisoformat(start), datetime.fromisoformat(end), user_id)
+
+
+class _Transaction:
+    """`with` block around one transaction on an autocommit connection.
+
+    Writers take the lock up front (BEGIN IMMEDIATE) so concurrent
+    processes queue on busy_timeout instead of failing on lock upgrade.
+    """
+
+    def __init__(self, conn, write):
+        self.conn = conn
+        self.write = write
+
+    def __enter__(self):
+        self.conn.execute('BEGIN IMMEDIATE' if self.write else 'BEGIN')
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.execute('ROLLBACK' if exc_type else 'COMMIT')
+        return False
+
+
+def create_storage():
+    """SQLite storage when CACHE_DB_PATH is set, per-process memory otherwise"""
+    path = os.getenv('CACHE_DB_PATH')
+    if path:
+        logger.info(f"Using shared booking cache at {path}")
+        return SQLiteStorage(path)
+    return MemoryStorage()
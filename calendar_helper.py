@@ -1,17 +1,20 @@
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from google.auth.transport.requests import Request
-from googleapiclient.discovery import build
 import os.path
-import pickle
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
+import hashlib
 import socket
 import ssl
-from time import sleep
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from time import sleep, monotonic, time
 import logging
 import os
 from dotenv import load_dotenv
-from telebot import TeleBot
+from metrics import GOOGLE_ERRORS, GOOGLE_RETRIES, GOOGLE_SECONDS, stage
+from google_credentials import LEGACY_TOKEN_FILE, CredentialManager
+from google_transport import RETRY_STATUSES, CircuitBreaker, GoogleUnavailableError, PooledHttp, backoff_delay
+from resources import load_resources
+from booking_storage import TIMEZONE, create_storage, make_booking
 
 logger = logging.getLogger(__name__)
 
@@ -20,84 +23,429 @@ SCOPES = ['https://www.googleapis.com/auth/calendar']  # Remove .readonly
 
 load_dotenv()
 
-class GoogleCalendarHelper:
+# How long (seconds) a synced booking index is trusted before the next incremental sync
+SYNC_INTERVAL = int(os.getenv('CALENDAR_SYNC_INTERVAL', '30'))
+# A calendar whose sync is overdue by more than this many seconds is shown as possibly outdated
+STALE_GRACE = int(os.getenv('CALENDAR_STALE_GRACE', '30'))
+
+# Busy slots cache: max number of (calendar, date) entries and their lifetime in seconds
+BUSY_SLOTS_CACHE_SIZE = int(os.getenv('BUSY_SLOTS_CACHE_SIZE', '512'))
+BUSY_SLOTS_CACHE_TTL = int(os.getenv('BUSY_SLOTS_CACHE_TTL', '60'))
+
+# Google API limit: requests per batch
+BATCH_MAX_REQUESTS = 50
+# Batches sent at the same time when there are more than 50 calendars
+FANOUT_WORKERS = int(os.getenv('CALENDAR_FANOUT_WORKERS', '8'))
+
+# How long (seconds) a user keeps a slot while looking at the confirmation screen
+SLOT_HOLD_SECONDS = int(os.getenv('SLOT_HOLD_SECONDS', '120'))
+
+# How many days ahead find_free_slots looks by default
+FREE_SEARCH_DAYS = int(os.getenv('FREE_SEARCH_DAYS', '14'))
+
+# Outcome of each date in book_slots
+BOOKED = 'booked'
+TAKEN = 'taken'
+CLOSED = 'closed'
+FAILED = 'failed'
+
+_MISSING = object()
+
+
+class SlotTakenError(Exception):
+    """The slot is booked or held by another user"""
+
+
+def http_status(error):
+    """HTTP status of a Google API error, None for any other exception"""
+    from googleapiclient.errors import HttpError
+    return error.resp.status if isinstance(error, HttpError) else None
+
+
+def slot_event_id(calendar_id, day, hour):
+    """Deterministic event ID of a slot, so a second insert for it fails with 409.
+
+    Calendar event IDs allow the characters a-v and 0-9, a hex digest fits.
+    """
+    return hashlib.sha1(f"{calendar_id}|{day.isoformat()}|{hour}".encode()).hexdigest()
+
+
+def parse_event(event):
+    """Convert a Calendar API event into a booking dict (None for all-day events)"""
+    start = event.get('start', {}).get('dateTime')
+    end = event.get('end', {}).get('dateTime')
+    if not start or not end:
+        return None
+    return make_booking(
+        event.get('id'),
+        datetime.fromisoformat(start.replace('Z', '+00:00')),
+        datetime.fromisoformat(end.replace('Z', '+00:00')),
+        event.get('extendedProperties', {}).get('private', {}).get('userId')
+    )
+
+
+def month_range(year, month):
+    """First day of the month and first day of the next one"""
+    start_date = date(year, month, 1)
+    end_date = date(year, month + 1, 1) if month < 12 else date(year + 1, 1, 1)
+    return start_date, end_date
+
+
+class Occupancy:
+    """Busy slots as one bitmask per day (bit N = slot starting at N:00) plus slot owners.
+
+    is_busy(), owner() and has_user_booking() are O(1) whatever the number of bookings.
+    """
+    __slots__ = ('masks', 'owners', 'user_days')
+
     def __init__(self):
+        self.masks = {}      # date -> bitmask of busy hours
+        self.owners = {}     # (date, hour) -> user ID of the booking
+        self.user_days = {}  # user ID -> dates with bookings of that user
+
+    @classmethod
+    def from_bookings(cls, bookings):
+        occupancy = cls()
+        for booking in bookings:
+            for day, hour in booking['slots']:
+                occupancy.add(day, hour, booking.get('user_id'))
+        return occupancy
+
+    def add(self, day, hour, user_id=None):
+        self.masks[day] = self.masks.get(day, 0) | (1 << hour)
+        if user_id:
+            self.owners[(day, hour)] = user_id
+            self.user_days.setdefault(user_id, set()).add(day)
+
+    def mask(self, day):
+        return self.masks.get(day, 0)
+
+    def is_busy(self, day, hour=None):
+        """Whether the slot (or, without hour, any slot of the day) is taken"""
+        if hour is None:
+            return self.masks.get(day, 0) != 0
+        return bool(self.masks.get(day, 0) >> hour & 1)
+
+    def owner(self, day, hour):
+        return self.owners.get((day, hour))
+
+    def has_user_booking(self, day, user_id):
+        return day in self.user_days.get(str(user_id), ())
+
+    def busy_hours(self, day):
+        mask = self.masks.get(day, 0)
+        return [hour for hour in range(24) if mask >> hour & 1]
+
+
+class TTLCache:
+    """Bounded LRU cache whose entries expire after ttl seconds.
+
+    Entries stored with prefetched=True are tracked until their first read,
+    which tells how many speculative loads were actually used.
+    """
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self._prefetched = set()    # prefetched keys not read yet
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.prefetched = 0
+        self.prefetch_hits = 0
+        self.prefetch_wasted = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is _MISSING:
+                self.misses += 1
+                return default
+            expires_at, value = item
+            if expires_at <= monotonic():
+                del self._data[key]
+                self._drop_prefetched(key)
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            if key in self._prefetched:
+                self._prefetched.discard(key)
+                self.prefetch_hits += 1
+            return value
+
+    def contains(self, key):
+        """Whether a live entry exists, without touching the stats or LRU order"""
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            return item is not _MISSING and item[0] > monotonic()
+
+    def set(self, key, value, prefetched=False):
+        with self._lock:
+            self._data[key] = (monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            if prefetched:
+                self._prefetched.add(key)
+                self.prefetched += 1
+            else:
+                self._prefetched.discard(key)
+            while len(self._data) > self.maxsize:
+                evicted, _ = self._data.popitem(last=False)
+                self._drop_prefetched(evicted)
+                self.evictions += 1
+
+    def _drop_prefetched(self, key):
+        if key in self._prefetched:
+            self._prefetched.discard(key)
+            self.prefetch_wasted += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+            self._prefetched.discard(key)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'prefetched': self.prefetched,
+                'prefetch_hits': self.prefetch_hits,
+                'prefetch_wasted': self.prefetch_wasted,
+                'prefetch_hit_rate': self.prefetch_hits / self.prefetched if self.prefetched else 0.0
+            }
+
+
+class SlotReservations:
+    """Short-lived per-process holds on slots, keyed by (calendar ID, date, hour)"""
+
+    def __init__(self, ttl=SLOT_HOLD_SECONDS):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._holds = {}  # key -> (user ID, expires at)
+
+    def hold(self, key, user_id):
+        """Take or extend a hold, returns False if another user holds the slot"""
+        now = monotonic()
+        with self._lock:
+            holder = self._holds.get(key)
+            if holder and holder[0] != user_id and holder[1] > now:
+                return False
+            self._holds[key] = (user_id, now + self.ttl)
+            if len(self._holds) > 1000:
+                self._holds = {k: v for k, v in self._holds.items() if v[1] > now}
+            return True
+
+    def release(self, key, user_id):
+        with self._lock:
+            holder = self._holds.get(key)
+            if holder and holder[0] == user_id:
+                del self._holds[key]
+
+    def holder(self, key):
+        with self._lock:
+            holder = self._holds.get(key)
+            if holder and holder[1] > monotonic():
+                return holder[0]
+            return None
+
+
+class BookingIndex:
+    """One calendar's bookings in local storage, kept fresh with incremental sync"""
+
+    def __init__(self, calendar_id, storage, sync_interval=SYNC_INTERVAL):
+        self.calendar_id = calendar_id
+        self.storage = storage
+        self.sync_interval = sync_interval
+        # Held while talking to Google so only one sync per calendar runs at a time
+        self.sync_lock = threading.Lock()
+
+    @property
+    def sync_token(self):
+        return self.storage.get_state(self.calendar_id)[0]
+
+    @property
+    def seeded(self):
+        return self.sync_token is not None
+
+    @property
+    def version(self):
+        """Bumped on every change, cached views of the calendar are keyed by it"""
+        return self.storage.get_state(self.calendar_id)[2]
+
+    def is_fresh(self):
+        return self.fresh_for() > 0
+
+    def synced_since(self, moment):
+        """Whether a sync finished at or after the given unix time"""
+        synced_at = self.storage.get_state(self.calendar_id)[1]
+        return synced_at is not None and synced_at >= moment
+
+    def fresh_for(self):
+        """Seconds until the index goes stale, <= 0 when the next read will sync"""
+        # Wall clock, the sync may have been done by another process sharing the storage
+        synced_at = self.storage.get_state(self.calendar_id)[1]
+        return 0 if synced_at is None else synced_at + self.sync_interval - time()
+
+    def reset(self):
+        """Forget the sync token, the next sync will be a full one"""
+        self.storage.reset(self.calendar_id)
+
+    def apply(self, events, replace=False, sync_token=None):
+        """Apply raw Calendar API events (new, changed or cancelled) to the index.
+
+        Returns the set of dates whose bookings changed.
+        """
+        changes = []
+        for event in events:
+            booking = None if event.get('status') == 'cancelled' else parse_event(event)
+            changes.append((event.get('id'), booking))
+        return self.storage.apply_changes(self.calendar_id, changes, replace=replace, sync_token=sync_token)
+
+    def bookings_for_date(self, day):
+        return self.storage.bookings_between(self.calendar_id, day, day + timedelta(days=1))
+
+    def bookings_between(self, start_date, end_date):
+        """Bookings with start_date <= date < end_date, ordered by start time"""
+        return self.storage.bookings_between(self.calendar_id, start_date, end_date)
+
+
+class GoogleCalendarHelper:
+    def __init__(self, resources=None):
+        # Credentials and the API client are set up on first use, see `service`
         self.creds = None
-        self.service = None
-        # Define calendar IDs for each option
-        self.calendar_ids = {
-            'Бадминтон': os.getenv('FIRST_CALENDAR_ID'),
-            'Сквош': os.getenv('SECOND_CALENDAR_ID')
-        }
-        self.setup_credentials()
+        self.credentials = CredentialManager(scopes=SCOPES)
+        self._service = None
+        self._service_lock = threading.Lock()
+        # Bookable resources (options) and their calendar IDs, loaded once
+        self.resources = resources or load_resources()
+        self.calendar_ids = self.resources.calendar_ids()
+        # Local booking index per calendar ID, all backed by one storage
+        self.storage = create_storage()
+        self.indexes = {}
+        self._indexes_lock = threading.Lock()
+        # (calendar ID, index version, date) -> busy slots
+        self.busy_slots_cache = TTLCache(BUSY_SLOTS_CACHE_SIZE, BUSY_SLOTS_CACHE_TTL)
+        # (calendar ID, index version, year, month) -> Occupancy
+        self.month_occupancy_cache = TTLCache(BUSY_SLOTS_CACHE_SIZE, BUSY_SLOTS_CACHE_TTL)
+        self.reservations = SlotReservations()
+        # Pooled transport shared by all threads, created with the credentials
+        self.http = None
+        # Runs per-chunk Google requests side by side, created on first fan-out
+        self._fanout_executor = None
+        self._fanout_lock = threading.Lock()
+        # Refuses Google calls during an outage instead of making every handler wait for retries
+        self.breaker = CircuitBreaker()
+        # Stale indexes are served right away and synced by one background refresh at a time
+        self._refresh_executor = None
+        self._refresh_lock = threading.Lock()
+        self._refreshing = False
+        self.stale_reads = 0
+        self.background_refreshes = 0
+
+    @property
+    def service(self):
+        """Calendar API client, credentials are loaded and the client built on first use"""
+        if self._service is None:
+            with self._service_lock:
+                if self._service is None:
+                    self.setup_credentials()
+        return self._service
+
+    @service.setter
+    def service(self, service):
+        self._service = service
+
+    def warm_up(self):
+        """Load credentials and sync calendars in the background so startup does not wait for Google"""
+        def run():
+            started = monotonic()
+            try:
+                self.sync_indexes()
+                logger.info(f"Google Calendar ready in {monotonic() - started:.2f}s")
+            except Exception as e:
+                logger.error(f"Error warming up Google Calendar: {str(e)}")
+
+        thread = threading.Thread(target=run, name='calendar-warm-up', daemon=True)
+        thread.start()
+        return thread
 
     def delete_token(self):
-        """Delete the existing token.pickle file if it exists."""
-        try:
-            if os.path.exists('token.pickle'):
-                os.remove('token.pickle')
-                print("Existing token.pickle file deleted.")
-        except Exception as e:
-            print(f"Error deleting token.pickle: {e}")
+        """Delete the saved Google token (and a leftover token.pickle) so the next start authorizes again."""
+        for path in (self.credentials.token_file.path, LEGACY_TOKEN_FILE):
+            try:
+                if os.path.exists(path):
+                    os.remove(path)
+                    print(f"Existing {path} file deleted.")
+            except Exception as e:
+                print(f"Error deleting {path}: {e}")
 
     def setup_credentials(self):
+        # Google client libraries take about half a second to import, only pay for them here
+        from googleapiclient.discovery import build
+
         try:
             environment = os.getenv('ENVIRONMENT', 'local')
             logger.info(f"Running in {environment} environment")
+            token_path = self.credentials.token_file.path
+
+            # token.pickle of older versions is converted on the way
+            self.creds = self.credentials.load()
+            if self.creds is not None and not self.creds.valid and not self.creds.refresh_token:
+                self.creds = None
 
             if environment == 'server':
-                # Server mode: expect token.pickle to exist
-                if not os.path.exists('token.pickle'):
+                # Server mode: expect the token file to exist
+                if self.creds is None:
                     raise FileNotFoundError(
-                        "token.pickle not found. In server mode, this file must be "
+                        f"{token_path} not found or has no refresh token. In server mode, this file must be "
                         "manually uploaded after being generated in local environment."
                     )
-                with open('token.pickle', 'rb') as token:
-                    self.creds = pickle.load(token)
-
-                if not self.creds or not self.creds.valid:
-                    if self.creds and self.creds.expired and self.creds.refresh_token:
-                        self.creds.refresh(Request())
-                    else:
-                        raise ValueError(
-                            "Invalid credentials in token.pickle. Please regenerate "
-                            "in local environment and upload again."
-                        )
-            else:
+            elif self.creds is None:
                 # Local mode: normal browser-based flow
-                if os.path.exists('token.pickle'):
-                    with open('token.pickle', 'rb') as token:
-                        self.creds = pickle.load(token)
-
-                if not self.creds or not self.creds.valid:
-                    if self.creds and self.creds.expired and self.creds.refresh_token:
-                        self.creds.refresh(Request())
-                    else:
-                        flow = InstalledAppFlow.from_client_secrets_file(
-                            'credentials.json', SCOPES)
-
-                        # Get authorization URL before running local server
-                        auth_url = flow.authorization_url()[0]
-
-                        # Send authorization URL to Telegram channel
-                        bot = TeleBot(os.getenv('TELEGRAM_BOT_TOKEN'))
-                        bot.send_message(
-                            os.getenv('LOGS_CHANNEL_ID'),
-                            f"🔐 *Google Calendar Authorization Required*\n\n"
-                            f"Please authorize the application using this link:\n\n"
-                            f"`{auth_url}`\n\n"
-                            f"⚠️ _This link will expire after first use_",
-                            parse_mode='Markdown'
-                        )
-
-                        self.creds = flow.run_local_server(port=8080)
-
-                        # Save token for future use (and for server deployment)
-                        with open('token.pickle', 'wb') as token:
-                            pickle.dump(self.creds, token)
-                        logger.info("New token.pickle file generated successfully")
-
-            self.service = build('calendar', 'v3', credentials=self.creds)
+                from google_auth_oauthlib.flow import InstalledAppFlow
+                from telebot import TeleBot
+
+                flow = InstalledAppFlow.from_client_secrets_file(
+                    'credentials.json', SCOPES)
+
+                # Get authorization URL before running local server
+                auth_url = flow.authorization_url()[0]
+
+                # Send authorization URL to Telegram channel
+                bot = TeleBot(os.getenv('TELEGRAM_BOT_TOKEN'))
+                bot.send_message(
+                    os.getenv('LOGS_CHANNEL_ID'),
+                    f"🔐 *Google Calendar Authorization Required*\n\n"
+                    f"Please authorize the application using this link:\n\n"
+                    f"`{auth_url}`\n\n"
+                    f"⚠️ _This link will expire after first use_",
+                    parse_mode='Markdown'
+                )
+
+                # Save token for future use (and for server deployment)
+                self.credentials.store(flow.run_local_server(port=8080))
+                self.creds = self.credentials.creds
+                logger.info(f"New {token_path} file generated successfully")
+
+            # Refreshed in place from now on, before it expires, so requests never wait for it
+            self.credentials.ensure_valid()
+            self.credentials.start()
+
+            # Discovery document bundled with the client library, no network fetch on boot
+            self.http = PooledHttp(self.creds)
+            self.service = build('calendar', 'v3', http=self.http,
+                                 static_discovery=True, cache_discovery=False)
             logger.info("Google Calendar service initialized successfully")
 
         except Exception as e:
@@ -108,60 +456,425 @@ class GoogleCalendarHelper:
         """Get calendar ID for specific option"""
         return self.calendar_ids.get(option)
 
-    def get_busy_slots(self, date, option):
-        max_retries = 3
-        retry_count = 0
-        calendar_id = self.get_calendar_id(option)
+    def get_resource(self, option):
+        return self.resources.get(option)
+
+    def _fanout(self, func, items):
+        """Call func for every item concurrently and return the results in order"""
+        items = list(items)
+        if len(items) <= 1:
+            return [func(item) for item in items]
+        with self._fanout_lock:
+            if self._fanout_executor is None:
+                self._fanout_executor = ThreadPoolExecutor(max_workers=FANOUT_WORKERS, thread_name_prefix='fanout')
+        return list(self._fanout_executor.map(func, items))
+
+    def _execute(self, request, max_retries=3):
+        """Execute a Google API request, retrying network errors and 429/5xx with jittered backoff.
+
+        Raises GoogleUnavailableError without calling Google while the circuit is open.
+        """
+        # Only batches come without a methodId
+        method = getattr(request, 'methodId', None) or 'batch'
+        attempt = 0
+        while True:
+            self.breaker.before_call()
+            try:
+                with stage(f'google.{method}'), GOOGLE_SECONDS.time(method):
+                    result = request.execute()
+            except Exception as e:
+                status = http_status(e)
+                GOOGLE_ERRORS.inc(method, status or type(e).__name__)
+                # requests' connection errors are OSErrors too
+                transient = isinstance(e, (socket.error, ssl.SSLError)) or status in RETRY_STATUSES
+                # A 404 or 409 is Google answering, only outages count against the circuit
+                self.breaker.record(ok=not transient)
+                if not transient:
+                    raise
+                attempt += 1
+                if attempt >= max_retries:
+                    logger.error(f"Failed after {max_retries} attempts: {e}")
+                    raise
+                GOOGLE_RETRIES.inc(method)
+                sleep(backoff_delay(attempt))
+                continue
+            if method != 'batch':
+                # A batch is judged by its parts, see _record_parts
+                self.breaker.record(ok=True)
+            return result
+
+    def _record_parts(self, exceptions):
+        """Count the parts of a batch that went through against the circuit"""
+        for exception in exceptions:
+            self.breaker.record(ok=http_status(exception) not in RETRY_STATUSES if exception else True)
+
+    def _get_or_create_index(self, calendar_id):
+        with self._indexes_lock:
+            index = self.indexes.get(calendar_id)
+            if index is None:
+                index = self.indexes[calendar_id] = BookingIndex(calendar_id, self.storage)
+            return index
 
+    def get_index(self, option, fresh=False):
+        """Get the booking index for an option.
+
+        A stale index is returned as it is and synced in the background
+        (stale-while-revalidate). With fresh, or when there is no data yet,
+        it is synced first and GoogleUnavailableError is raised if that fails.
+        """
+        calendar_id = self.get_calendar_id(option)
         if not calendar_id:
             logger.error(f"No calendar ID found for option: {option}")
+            return None
+
+        index = self._get_or_create_index(calendar_id)
+        if not index.is_fresh():
+            if fresh or not index.seeded:
+                self._sync_now(index)
+            else:
+                self.stale_reads += 1
+                self.refresh_in_background()
+        return index
+
+    def _sync_now(self, index):
+        started = time()
+        # Calendars usually go stale together, refresh all of them in one round-trip
+        self.sync_indexes()
+        # Skipped there when another thread was syncing it, wait for that sync to finish
+        with index.sync_lock:
+            pass
+        if not (index.is_fresh() or index.synced_since(started)):
+            raise GoogleUnavailableError(f"Calendar {index.calendar_id} could not be synced")
+
+    def _ready_indexes(self, options):
+        """Make the options' indexes readable: never synced ones now, stale ones in the background.
+
+        Raises GoogleUnavailableError when a calendar has no data at all and
+        can't be synced, as get_index does, instead of reading it as empty.
+        """
+        indexes = [self._get_or_create_index(calendar_id)
+                   for calendar_id in dict.fromkeys(map(self.get_calendar_id, options)) if calendar_id]
+        unseeded = [index for index in indexes if not index.seeded]
+        if unseeded:
+            self.sync_indexes(options=[option for option in options
+                                       if self.get_calendar_id(option) in {index.calendar_id for index in unseeded}])
+            for index in unseeded:
+                # Skipped there when another thread was syncing it, wait for that sync to finish
+                with index.sync_lock:
+                    pass
+                if not index.seeded:
+                    raise GoogleUnavailableError(f"Calendar {index.calendar_id} could not be synced")
+        if any(index.seeded and not index.is_fresh() for index in indexes):
+            self.stale_reads += 1
+            self.refresh_in_background()
+
+    def refresh_in_background(self):
+        """Sync all stale indexes on a background thread, False if one is running or Google is down"""
+        if self.breaker.state == CircuitBreaker.OPEN:
+            return False
+        with self._refresh_lock:
+            if self._refreshing:
+                return False
+            self._refreshing = True
+            if self._refresh_executor is None:
+                self._refresh_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='calendar-refresh')
+        self._refresh_executor.submit(self._refresh)
+        return True
+
+    def _refresh(self):
+        try:
+            self.sync_indexes()
+            self.background_refreshes += 1
+        except Exception as e:
+            logger.error(f"Error refreshing calendars in the background: {str(e)}")
+        finally:
+            with self._refresh_lock:
+                self._refreshing = False
+
+    def is_outdated(self, option):
+        """Whether the option is shown from data whose sync is overdue by more than STALE_GRACE seconds"""
+        index = self.indexes.get(self.get_calendar_id(option))
+        return index is not None and index.seeded and index.fresh_for() < -STALE_GRACE
+
+    def availability_stats(self):
+        return {
+            **self.breaker.stats(),
+            'stale_reads': self.stale_reads,
+            'background_refreshes': self.background_refreshes
+        }
+
+    def sync_index(self, index, force=False):
+        """Bring an index up to date: full list on first use, syncToken changes afterwards"""
+        with index.sync_lock:
+            # Another thread may have synced while we were waiting for the lock
+            if not force and index.is_fresh():
+                return
+            self._sync_locked(index)
+
+    def sync_calendar(self, calendar_id):
+        """Incremental resync of one calendar right now, e.g. after a push notification"""
+        self.sync_index(self._get_or_create_index(calendar_id), force=True)
+
+    def set_sync_interval(self, calendar_id, interval):
+        """Change how long a calendar's index is trusted, None restores the default"""
+        index = self._get_or_create_index(calendar_id)
+        index.sync_interval = SYNC_INTERVAL if interval is None else interval
+
+    def sync_indexes(self, force=False, options=None):
+        """Sync stale calendar indexes (of all options by default) with batched HTTP requests.
+
+        Each batch carries up to 50 calendars and the batches run concurrently,
+        so any number of calendars costs about one round-trip.
+        """
+        calendar_ids = self.calendar_ids.values() if options is None else map(self.get_calendar_id, options)
+        indexes = [self._get_or_create_index(calendar_id)
+                   for calendar_id in dict.fromkeys(calendar_ids) if calendar_id]
+        locked = []
+        for index in indexes:
+            if (force or not index.is_fresh()) and index.sync_lock.acquire(blocking=False):
+                # Re-check, another thread may have finished a sync just before we got the lock
+                if not force and index.is_fresh():
+                    index.sync_lock.release()
+                else:
+                    locked.append(index)
+
+        try:
+            chunks = [locked[i:i + BATCH_MAX_REQUESTS] for i in range(0, len(locked), BATCH_MAX_REQUESTS)]
+            self._fanout(self._sync_chunk, chunks)
+        finally:
+            for index in locked:
+                index.sync_lock.release()
+
+    def _sync_chunk(self, chunk):
+        """Sync up to 50 locked indexes with one batch request"""
+        if len(chunk) == 1:
+            self._sync_locked(chunk[0])
+            return
+
+        responses = {}
+
+        def collect(request_id, response, exception):
+            responses[request_id] = (response, exception)
+
+        batch = self.service.new_batch_http_request(callback=collect)
+        for n, index in enumerate(chunk):
+            batch.add(self._list_request(index, incremental=index.seeded), request_id=str(n))
+        try:
+            self._execute(batch)
+        except Exception as e:
+            logger.error(f"Error in batched calendar sync: {str(e)}")
+            return
+
+        self._record_parts(exception for _, exception in responses.values())
+        for n, index in enumerate(chunk):
+            response, exception = responses.get(str(n), (None, None))
+            if exception is not None:
+                if http_status(exception) == 410:
+                    logger.warning(f"Sync token expired for {index.calendar_id}, doing full sync")
+                    index.reset()
+                    self._sync_locked(index)
+                else:
+                    logger.error(f"Error syncing calendar {index.calendar_id}: {str(exception)}")
+            elif response is not None:
+                self._sync_locked(index, first_page=response)
+
+    def _sync_locked(self, index, first_page=None):
+        """Sync an index whose sync_lock is held by the caller"""
+        try:
+            if index.seeded:
+                try:
+                    self._pull_events(index, incremental=True, events_result=first_page)
+                    return
+                except Exception as e:
+                    if http_status(e) != 410:
+                        raise
+                    # Sync token expired, Google wants a full resync
+                    logger.warning(f"Sync token expired for {index.calendar_id}, doing full sync")
+                    first_page = None
+            self._pull_events(index, incremental=False, events_result=first_page)
+        except GoogleUnavailableError as e:
+            logger.warning(f"Not syncing calendar {index.calendar_id}: {str(e)}")
+        except Exception as e:
+            logger.error(f"Error syncing calendar {index.calendar_id}: {str(e)}")
+
+    def _list_request(self, index, incremental, page_token=None):
+        params = {'calendarId': index.calendar_id, 'singleEvents': True, 'maxResults': 2500}
+        if incremental:
+            params['syncToken'] = index.sync_token
+        if page_token:
+            params['pageToken'] = page_token
+        return self.service.events().list(**params)
+
+    def _pull_events(self, index, incremental, events_result=None):
+        """Fetch all pages of changes (or of the full list) and apply them to the index.
+
+        events_result is an already fetched first page, e.g. from a batch request.
+        """
+        events = []
+        page_token = None
+        while True:
+            if events_result is None:
+                events_result = self._execute(self._list_request(index, incremental, page_token))
+            events.extend(events_result.get('items', []))
+            page_token = events_result.get('nextPageToken')
+            if not page_token:
+                break
+            events_result = None
+
+        # Changes bump the index version, which retires cached views of this calendar
+        index.apply(events, replace=not incremental, sync_token=events_result.get('nextSyncToken'))
+
+    def get_busy_slots(self, date, option):
+        index = self.get_index(option)
+        if index is None:
             return []
 
-        while retry_count < max_retries:
-            try:
-                start_time = datetime.combine(date, datetime.min.time())
-                end_time = datetime.combine(date, datetime.max.time())
+        key = (index.calendar_id, index.version, date)
+        busy_slots = self.busy_slots_cache.get(key)
+        if busy_slots is None:
+            busy_slots = index.bookings_for_date(date)
+            self.busy_slots_cache.set(key, busy_slots)
+        return busy_slots
 
-                start_time_str = start_time.isoformat() + 'Z'
-                end_time_str = end_time.isoformat() + 'Z'
+    def get_day_occupancy(self, day, option):
+        """Occupancy of one day, answers busy/owner questions per hour in O(1)"""
+        return Occupancy.from_bookings(self.get_busy_slots(day, option))
 
-                events_result = self.service.events().list(
-                    calendarId=calendar_id,
-                    timeMin=start_time_str,
-                    timeMax=end_time_str,
-                    singleEvents=True,
-                    orderBy='startTime'
-                ).execute()
-
-                events = events_result.get('items', [])
-                busy_slots = []
-
-                for event in events:
-                    start = event['start'].get('dateTime')
-                    end = event['end'].get('dateTime')
-                    if start and end:
-                        start_dt = datetime.fromisoformat(start.replace('Z', '+00:00'))
-                        end_dt = datetime.fromisoformat(end.replace('Z', '+00:00'))
-                        user_id = event.get('extendedProperties', {}).get('private', {}).get('userId')
-                        busy_slots.append({
-                            'start': start_dt,
-                            'end': end_dt,
-                            'hour': start_dt.hour,
-                            'user_id': user_id
-                        })
-
-                return busy_slots
-
-            except (socket.error, ssl.SSLError) as e:
-                retry_count += 1
-                if retry_count == max_retries:
-                    logger.error(f"Failed after {max_retries} retries: {e}")
-                    return []
-                sleep(1)
+    def get_month_occupancy(self, year, month, option):
+        """Occupancy of a whole month, answers per-day questions in O(1)"""
+        index = self.get_index(option)
+        if index is None:
+            return Occupancy()
 
-            except Exception as e:
-                logger.error(f"Unexpected error: {e}")
-                return []
+        key = (index.calendar_id, index.version, year, month)
+        occupancy = self.month_occupancy_cache.get(key)
+        if occupancy is None:
+            occupancy = Occupancy.from_bookings(index.bookings_between(*month_range(year, month)))
+            self.month_occupancy_cache.set(key, occupancy)
+        return occupancy
+
+    def get_occupancy(self, options, start_date, end_date):
+        """Busy hours of many options over a date range: {option: Occupancy} for start_date <= date < end_date.
+
+        Calendars never synced are synced together in one batched
+        round-trip (50 per batch, batches in parallel), then each calendar's
+        range is read once from local data, so N options x M days cost one
+        request at most instead of N x M.
+        """
+        options = list(options)
+        self._ready_indexes(options)
+        occupancy = {}
+        for option in options:
+            index = self.get_index(option)
+            if index is not None:
+                occupancy[option] = Occupancy.from_bookings(index.bookings_between(start_date, end_date))
+        return occupancy
+
+    def find_free_slots(self, options=None, start_date=None, days=FREE_SEARCH_DAYS, limit=5, user_id=None):
+        """Earliest free slots across resources and dates: [(day, hour, option)] in time order.
+
+        Calendars never synced are synced in one batched round-trip, then each
+        resource's bookings for the whole range are read once into per-day
+        busy bitmasks, so every day costs a few bit operations per resource
+        instead of a get_busy_slots call. Slots held by other users are skipped.
+        """
+        options = self.resources.names() if options is None else list(options)
+        resources = [resource for resource in map(self.get_resource, options) if resource is not None]
+        now = datetime.now(TIMEZONE)
+        start_date = max(start_date or now.date(), now.date())
+        end_date = start_date + timedelta(days=days)
+
+        by_option = self.get_occupancy([resource.name for resource in resources], start_date, end_date)
+        occupancies = [by_option.get(resource.name, Occupancy()) for resource in resources]
+
+        user_id = str(user_id) if user_id is not None else None
+        found = []
+        day = start_date
+        while day < end_date and len(found) < limit:
+            candidates = []
+            for order, (resource, occupancy) in enumerate(zip(resources, occupancies)):
+                free = resource.open_mask(day) & ~occupancy.mask(day)
+                if day == now.date():
+                    # Hours that already started
+                    free &= ~((1 << (now.hour + 1)) - 1)
+                while free:
+                    hour = (free & -free).bit_length() - 1
+                    free &= free - 1
+                    if self.reservations.holder(self.slot_key(resource.name, day, hour)) not in (None, user_id):
+                        continue
+                    candidates.append((hour, order, resource.name))
+            candidates.sort()
+            found.extend((day, hour, name) for hour, _, name in candidates[:limit - len(found)])
+            day += timedelta(days=1)
+        return found
+
+    def fresh_for(self, option):
+        """Seconds until reading the option's calendar will have to sync with Google"""
+        calendar_id = self.get_calendar_id(option)
+        return self._get_or_create_index(calendar_id).fresh_for() if calendar_id else 0
+
+    def prefetch_day(self, day, option):
+        """Load a day's busy slots into the cache ahead of use, False if it was already there"""
+        index = self.get_index(option)
+        if index is None:
+            return False
+        key = (index.calendar_id, index.version, day)
+        if self.busy_slots_cache.contains(key):
+            return False
+        self.busy_slots_cache.set(key, index.bookings_for_date(day), prefetched=True)
+        return True
+
+    def prefetch_month(self, year, month, option):
+        """Load a month's occupancy into the cache ahead of use, False if it was already there"""
+        index = self.get_index(option)
+        if index is None:
+            return False
+        key = (index.calendar_id, index.version, year, month)
+        if self.month_occupancy_cache.contains(key):
+            return False
+        occupancy = Occupancy.from_bookings(index.bookings_between(*month_range(year, month)))
+        self.month_occupancy_cache.set(key, occupancy, prefetched=True)
+        return True
+
+    def cache_stats(self):
+        """Hit/miss/eviction counters of the busy slots cache"""
+        return self.busy_slots_cache.stats()
+
+    def slot_key(self, option, day, hour):
+        return (self.get_calendar_id(option), day, hour)
+
+    def hold_slot(self, option, day, hour, user_id):
+        """Hold a slot for a user who is about to confirm it, False if someone else has it"""
+        if not self.reservations.hold(self.slot_key(option, day, hour), str(user_id)):
+            return False
+        occupancy = self.get_day_occupancy(day, option)
+        owner = occupancy.owner(day, hour)
+        if occupancy.is_busy(day, hour) and owner != str(user_id):
+            self.release_slot(option, day, hour, user_id)
+            return False
+        return True
+
+    def release_slot(self, option, day, hour, user_id):
+        self.reservations.release(self.slot_key(option, day, hour), str(user_id))
+
+    def book_slot(self, option, day, hour, user_id, event_data):
+        """Book one slot for a user.
+
+        The slot is checked against freshly synced local data and the holds
+        of other users, then inserted under its deterministic ID, so a
+        concurrent booking of the same slot is rejected by Google without
+        extra reads. Raises SlotTakenError when the slot is not available and
+        GoogleUnavailableError when Google can't be reached.
+        """
+        # The views may have come from stale data, the booking itself never does
+        self.get_index(option, fresh=True)
+        if not self.hold_slot(option, day, hour, user_id):
+            raise SlotTakenError(f"{option} {day} {hour}:00 is already taken")
+        try:
+            event_data = dict(event_data, id=slot_event_id(self.get_calendar_id(option), day, hour))
+            return self.create_event(event_data, option)
+        finally:
+            self.release_slot(option, day, hour, user_id)
 
     def create_event(self, event_data, option):
         """Create a new event in the option-specific calendar."""
@@ -171,57 +884,179 @@ class GoogleCalendarHelper:
                 raise ValueError(f"No calendar ID found for option: {option}")
 
             logger.info(f"Creating event in {option} calendar")
-            event = self.service.events().insert(
-                calendarId=calendar_id,
-                body=event_data
-            ).execute()
+            try:
+                # Without a fixed ID a lost response could create the event twice, so no retries
+                event = self._execute(self.service.events().insert(
+                    calendarId=calendar_id,
+                    body=event_data
+                ), max_retries=3 if 'id' in event_data else 1)
+            except Exception as e:
+                if http_status(e) != 409 or 'id' not in event_data:
+                    raise
+                event = self._resolve_conflict(calendar_id, event_data)
 
+            self._write_through(calendar_id, [event])
             logger.info(f"Event created successfully in {option} calendar: {event.get('id')}")
             return event
 
+        except SlotTakenError:
+            raise
         except Exception as e:
             logger.error(f"Error creating event in {option} calendar: {str(e)}")
             raise
 
-    def get_month_bookings(self, start_date, end_date, option):
-        """Get all bookings for a specific month"""
+    def book_slots(self, option, hour, user_id, events):
+        """Book the same hour on several dates, e.g. every week, for a user.
+
+        events maps each date to its event body. All dates are checked with
+        one range read of freshly synced local data plus the holds of other users, then the
+        free ones are inserted under their deterministic IDs, 50 per batch
+        request with the batches in flight at once. A 409 is resolved like
+        in create_event. Returns {date: BOOKED, TAKEN, CLOSED or FAILED}.
+        """
         calendar_id = self.get_calendar_id(option)
-        if not calendar_id:
-            return []
+        index = self.get_index(option, fresh=True)
+        if index is None:
+            raise ValueError(f"No calendar ID found for option: {option}")
+        resource = self.get_resource(option)
+        days = sorted(events)
+        occupancy = Occupancy.from_bookings(index.bookings_between(days[0], days[-1] + timedelta(days=1)))
 
+        status = {}
+        held = []
+        for day in days:
+            if hour not in resource.slots_for(day):
+                status[day] = CLOSED
+            elif occupancy.is_busy(day, hour) or not self.hold_slot(option, day, hour, user_id):
+                status[day] = TAKEN
+            else:
+                held.append(day)
+
+        created = []
         try:
-            events_result = self.service.events().list(
-                calendarId=calendar_id,
-                timeMin=start_date.isoformat() + 'T00:00:00Z',
-                timeMax=end_date.isoformat() + 'T00:00:00Z',
-                singleEvents=True,
-                orderBy='startTime'
-            ).execute()
-
-            bookings = []
-            for event in events_result.get('items', []):
-                start = event['start'].get('dateTime')
-                if start:
-                    event_date = datetime.fromisoformat(start.replace('Z', '+00:00')).date()
-                    user_id = event.get('extendedProperties', {}).get('private', {}).get('userId')
-                    bookings.append({
-                        'date': event_date,
-                        'user_id': user_id
-                    })
-            return bookings
+            bodies = [(day, dict(events[day], id=slot_event_id(calendar_id, day, hour))) for day in held]
+            chunks = [bodies[i:i + BATCH_MAX_REQUESTS] for i in range(0, len(bodies), BATCH_MAX_REQUESTS)]
+            for results in self._fanout(lambda chunk: self._insert_chunk(calendar_id, chunk), chunks):
+                for day, body, event, error in results:
+                    if error is not None and http_status(error) == 409:
+                        try:
+                            event, error = self._resolve_conflict(calendar_id, body), None
+                        except SlotTakenError:
+                            status[day] = TAKEN
+                            continue
+                        except Exception as e:
+                            error = e
+                    if event is None:
+                        logger.error(f"Error creating event in {option} calendar for {day}: {str(error)}")
+                        status[day] = FAILED
+                        continue
+                    created.append(event)
+                    status[day] = BOOKED
+            if created:
+                self._write_through(calendar_id, created)
+        finally:
+            for day in held:
+                self.release_slot(option, day, hour, user_id)
+        logger.info(f"Booked {len(created)} of {len(days)} dates in {option} calendar")
+        return status
+
+    def _insert_chunk(self, calendar_id, bodies):
+        """Insert up to 50 (date, event body) pairs with one batch request.
+
+        Returns (date, body, event, error) for each, event is None on error.
+        """
+        if len(bodies) == 1:
+            day, body = bodies[0]
+            try:
+                return [(day, body, self._execute(self.service.events().insert(calendarId=calendar_id, body=body)), None)]
+            except Exception as e:
+                return [(day, body, None, e)]
 
+        responses = {}
+
+        def collect(request_id, response, exception):
+            responses[request_id] = (response, exception)
+
+        batch = self.service.new_batch_http_request(callback=collect)
+        for n, (day, body) in enumerate(bodies):
+            batch.add(self.service.events().insert(calendarId=calendar_id, body=body), request_id=str(n))
+        try:
+            # Event IDs are fixed, a retried batch only gets 409s for what already went in
+            self._execute(batch)
         except Exception as e:
-            logger.error(f"Error getting month bookings: {str(e)}")
+            return [(day, body, None, e) for day, body in bodies]
+        self._record_parts(exception for _, exception in responses.values())
+        return [(day, body, *responses.get(str(n), (None, None))) for n, (day, body) in enumerate(bodies)]
+
+    def _write_through(self, calendar_id, events):
+        """Apply new events to the index and the busy slots cache so users see them without waiting for a sync"""
+        index = self._get_or_create_index(calendar_id)
+        changed_dates = index.apply(events)
+        version = index.version
+        for day in changed_dates:
+            self.busy_slots_cache.set((calendar_id, version, day), index.bookings_for_date(day))
+
+    def _resolve_conflict(self, calendar_id, event_data):
+        """An event with this ID exists: revive it if deleted, accept it if it is ours"""
+        existing = self._execute(self.service.events().get(calendarId=calendar_id, eventId=event_data['id']))
+        if existing.get('status') == 'cancelled':
+            # Deleted events keep their ID, so a freed slot is booked by restoring it
+            request = self.service.events().update(
+                calendarId=calendar_id,
+                eventId=event_data['id'],
+                body=event_data
+            )
+            # Only the version read above: of two processes reviving the slot, the second gets a 412
+            request.headers['If-Match'] = existing['etag']
+            try:
+                return self._execute(request)
+            except Exception as e:
+                if http_status(e) != 412:
+                    raise
+                raise SlotTakenError(f"Event {event_data['id']} in {calendar_id} was revived by another booking")
+
+        def owner(event):
+            return event.get('extendedProperties', {}).get('private', {}).get('userId')
+
+        if owner(existing) and owner(existing) == owner(event_data):
+            # Same user again, e.g. a retried insert whose response was lost
+            return existing
+        raise SlotTakenError(f"Event {event_data['id']} already exists in {calendar_id}")
+
+    def get_month_bookings(self, start_date, end_date, option):
+        """Get all bookings for a specific month"""
+        index = self.get_index(option)
+        if index is None:
             return []
+        return index.bookings_between(start_date, end_date)
 
-    def get_user_bookings(self, start_date, end_date, option):
+    def get_user_bookings(self, start_date, end_date, option, user_id):
         """Get user's bookings for a specific month"""
         all_bookings = self.get_month_bookings(start_date, end_date, option)
-        return [booking for booking in all_bookings if booking.get('user_id')]
+        return [booking for booking in all_bookings if booking.get('user_id') == str(user_id)]
 
     def get_user_bookings_for_date(self, date, option, user_id):
         """Get user's bookings for a specific date"""
-        start_date = datetime.strptime(date, '%Y-%m-%d').date()
-        end_date = start_date + timedelta(days=1)
-        bookings = self.get_month_bookings(start_date, end_date, option)
-        return [booking for booking in bookings if booking.get('user_id') == str(user_id)]
\ No newline at end of file
+        day = datetime.strptime(date, '%Y-%m-%d').date()
+        since = datetime(day.year, day.month, day.day, tzinfo=TIMEZONE)
+        return [booking for _, booking in self.get_upcoming_user_bookings(user_id, [option], since=since)
+                if booking['date'] == day]
+
+    def get_upcoming_user_bookings(self, user_id, options=None, since=None):
+        """A user's bookings starting from now (or since) as (option, booking) pairs, by start time.
+
+        Read from the storage's per-user index, which fetches and inserts keep
+        up to date, so the cost grows with the user's bookings and not with
+        the size of the calendars. Stale calendars are refreshed in the
+        background, GoogleUnavailableError is raised when one was never synced.
+        """
+        options = self.resources.names() if options is None else list(options)
+        self._ready_indexes(options)
+        # Courts sharing a calendar show up once, under the first of them
+        option_by_calendar = {}
+        for option in options:
+            option_by_calendar.setdefault(self.get_calendar_id(option), option)
+        since = since or datetime.now(TIMEZONE)
+        return [(option_by_calendar[calendar_id], booking)
+                for calendar_id, booking in self.storage.bookings_for_user(user_id, since=since)
+                if calendar_id in option_by_calendar]
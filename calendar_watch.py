@@ -0,0 +1,168 @@
+import logging
+import os
+import threading
+import uuid
+from time import time
+
+logger = logging.getLogger(__name__)
+
+# Requested lifetime of a watch channel (seconds), Google may grant less
+WATCH_CHANNEL_TTL = int(os.getenv('CALENDAR_WATCH_TTL', str(7 * 24 * 3600)))
+# Channels are replaced this long (seconds) before they expire
+WATCH_RENEW_MARGIN = int(os.getenv('CALENDAR_WATCH_RENEW_MARGIN', '3600'))
+# Polling interval (seconds) of a calendar that has a live channel, kept as a safety net
+WATCHED_SYNC_INTERVAL = int(os.getenv('CALENDAR_WATCHED_SYNC_INTERVAL', '600'))
+
+
+class CalendarWatcher:
+    """Keeps an events().watch channel open for every calendar of a GoogleCalendarHelper.
+
+    Google posts a notification to `address` whenever a calendar changes;
+    the notification only says *that* something changed, so the affected
+    calendar gets an incremental (syncToken) resync in a background thread.
+    Notifications arriving during a sync are coalesced into one more sync.
+    """
+
+    def __init__(self, helper, address, token=None, ttl=WATCH_CHANNEL_TTL, renew_margin=WATCH_RENEW_MARGIN):
+        self.helper = helper
+        self.address = address
+        self.token = token
+        self.ttl = ttl
+        self.renew_margin = renew_margin
+        self.channels = {}  # channel id -> {'calendar_id', 'resource_id', 'expiration'}
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+        self._dirty = set()  # calendars with notifications not yet synced
+        self._stopping = threading.Event()
+        self._threads = []
+        # Metrics
+        self.notifications = 0
+        self.rejected = 0
+        self.syncs = 0
+        self.renewals = 0
+
+    def start(self):
+        """Open channels for all calendars and start the sync and renewal threads"""
+        for calendar_id in set(self.helper.calendar_ids.values()):
+            if calendar_id:
+                self.watch(calendar_id)
+        for target, name in ((self._sync_loop, 'calendar-watch-sync'), (self._renew_loop, 'calendar-watch-renew')):
+            thread = threading.Thread(target=target, name=name, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def watch(self, calendar_id):
+        """Open a new channel for a calendar, returns its id or None on failure"""
+        channel_id = str(uuid.uuid4())
+        body = {
+            'id': channel_id,
+            'type': 'web_hook',
+            'address': self.address,
+            'params': {'ttl': str(self.ttl)}
+        }
+        if self.token:
+            body['token'] = self.token
+        try:
+            response = self.helper._execute(self.helper.service.events().watch(calendarId=calendar_id, body=body))
+        except Exception as e:
+            logger.error(f"Error opening watch channel for {calendar_id}: {str(e)}")
+            return None
+
+        # expiration is a unix timestamp in milliseconds
+        expiration = int(response.get('expiration') or 0) / 1000 or time() + self.ttl
+        with self._lock:
+            self.channels[channel_id] = {
+                'calendar_id': calendar_id,
+                'resource_id': response.get('resourceId'),
+                'expiration': expiration
+            }
+        # Pushes keep the index fresh, polling only has to catch missed notifications
+        self.helper.set_sync_interval(calendar_id, WATCHED_SYNC_INTERVAL)
+        logger.info(f"Watching calendar {calendar_id} until {expiration:.0f}")
+        return channel_id
+
+    def unwatch(self, channel_id):
+        """Close a channel on Google's side and forget it"""
+        with self._lock:
+            channel = self.channels.pop(channel_id, None)
+        if channel is None:
+            return
+        try:
+            self.helper._execute(self.helper.service.channels().stop(
+                body={'id': channel_id, 'resourceId': channel['resource_id']}
+            ))
+        except Exception as e:
+            logger.warning(f"Error closing watch channel {channel_id}: {str(e)}")
+
+    def handle_notification(self, request):
+        """LocalHTTPServer route for Google's push notifications"""
+        headers = request.headers
+        channel_id = headers.get('X-Goog-Channel-ID')
+        with self._cond:
+            channel = self.channels.get(channel_id)
+            if channel is None or (self.token and headers.get('X-Goog-Channel-Token') != self.token):
+                self.rejected += 1
+                # Anything but 200 makes Google retry, an unknown channel is not worth it
+                return 200, 'text/plain', 'ignored'
+            self.notifications += 1
+            # 'sync' only confirms that the channel was opened
+            if headers.get('X-Goog-Resource-State') != 'sync':
+                self._dirty.add(channel['calendar_id'])
+                self._cond.notify()
+        return 200, 'text/plain', 'ok'
+
+    def _sync_loop(self):
+        while not self._stopping.is_set():
+            with self._cond:
+                while not self._dirty and not self._stopping.is_set():
+                    self._cond.wait()
+                calendar_ids, self._dirty = self._dirty, set()
+            for calendar_id in calendar_ids:
+                self.helper.sync_calendar(calendar_id)
+                self.syncs += 1
+
+    def _renew_loop(self):
+        while not self._stopping.wait(min(60, self.renew_margin / 2)):
+            with self._lock:
+                expiring = [(channel_id, channel['calendar_id']) for channel_id, channel in self.channels.items()
+                            if channel['expiration'] - time() < self.renew_margin]
+            for channel_id, calendar_id in expiring:
+                # Open the replacement first so no change goes unnoticed in between
+                if self.watch(calendar_id):
+                    self.renewals += 1
+                    self.unwatch(channel_id)
+                elif self.channels.get(channel_id, {}).get('expiration', 0) <= time():
+                    # Channel is gone and could not be replaced, fall back to polling
+                    with self._lock:
+                        self.channels.pop(channel_id, None)
+                    self.helper.set_sync_interval(calendar_id, None)
+
+    def stop(self):
+        """Close all channels and stop the background threads"""
+        self._stopping.set()
+        with self._cond:
+            self._cond.notify_all()
+        for channel_id in list(self.channels):
+            self.unwatch(channel_id)
+        for calendar_id in set(self.helper.calendar_ids.values()):
+            if calendar_id:
+                self.helper.set_sync_interval(calendar_id, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'channels': len(self.channels),
+                'notifications': self.notifications,
+                'rejected': self.rejected,
+                'syncs': self.syncs,
+                'renewals': self.renewals,
+                'pending': len(self._dirty)
+            }
+
+
+def create_watcher(helper):
+    """CalendarWatcher configured from env, or None when CALENDAR_WATCH_URL is not set"""
+    address = os.getenv('CALENDAR_WATCH_URL')
+    if not address:
+        return None
+    return CalendarWatcher(helper, address, token=os.getenv('CALENDAR_WATCH_TOKEN') or None)
@@ -0,0 +1,218 @@
+import binascii
+import struct
+import threading
+from collections import OrderedDict
+from datetime import date, datetime
+from time import monotonic
+
+# Marks a packed payload, buttons sent before the codec never start with it
+PREFIX = '!'
+
+# Actions, the first byte of a payload
+IGNORE = 0
+BOOK = 1
+OPTIONS = 2
+VENUE = 3
+CALENDAR = 4
+DAY = 5
+TIME = 6
+CONFIRM = 7
+FIND_FREE = 8
+MY_BOOKINGS = 9
+REPEAT = 10
+CONFIRM_REPEAT = 11
+
+# Fields of every action, packed in this order
+FIELDS = {
+    IGNORE: (),
+    BOOK: (),
+    OPTIONS: (),
+    VENUE: ('index',),
+    CALENDAR: ('resource', 'month'),
+    DAY: ('resource', 'day'),
+    TIME: ('resource', 'day', 'hour'),
+    CONFIRM: ('resource', 'day', 'hour'),
+    FIND_FREE: ('session',),
+    MY_BOOKINGS: (),
+    REPEAT: ('resource', 'day', 'hour'),
+    CONFIRM_REPEAT: ('resource', 'day', 'hour', 'weeks'),
+}
+FIELD_FORMATS = {'index': 'B', 'resource': 'I', 'month': 'H', 'day': 'H', 'hour': 'B', 'session': 'H', 'weeks': 'B'}
+STRUCTS = {action: struct.Struct('>B' + ''.join(FIELD_FORMATS[field] for field in fields))
+           for action, fields in FIELDS.items()}
+# Longest payload: the prefix and the largest struct in unpadded base64
+MAX_LENGTH = len(PREFIX) + -(-4 * max(packer.size for packer in STRUCTS.values()) // 3)
+
+# Dates travel as days since this one
+EPOCH = date(2000, 1, 1).toordinal()
+
+
+class StaleCallback(Exception):
+    """A button whose payload can't be read any more (unknown court, expired session, garbage)"""
+
+
+class SessionStore:
+    """Small per-chat state referenced from buttons by a 16-bit key.
+
+    Keeps at most max_entries values per chat and max_chats chats, least
+    recently used ones go first, and values expire after ttl seconds.
+    """
+
+    def __init__(self, max_chats=10000, max_entries=16, ttl=3600):
+        self.max_chats = max_chats
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._chats = OrderedDict()  # chat ID -> OrderedDict(key -> (value, expires at))
+        self._next_key = 1
+
+    def put(self, chat_id, value):
+        with self._lock:
+            # 0 means "no session" in payloads
+            key = self._next_key
+            self._next_key = key % 0xFFFF + 1
+            entries = self._chats.pop(chat_id, None) or OrderedDict()
+            entries[key] = (value, monotonic() + self.ttl)
+            while len(entries) > self.max_entries:
+                entries.popitem(last=False)
+            self._chats[chat_id] = entries
+            while len(self._chats) > self.max_chats:
+                self._chats.popitem(last=False)
+            return key
+
+    def get(self, chat_id, key):
+        with self._lock:
+            entries = self._chats.get(chat_id)
+            item = entries.get(key) if entries else None
+            if item is None or item[1] < monotonic():
+                return None
+            self._chats.move_to_end(chat_id)
+            return item[0]
+
+    def __len__(self):
+        return len(self._chats)
+
+
+class CallbackCodec:
+    """Packs button payloads as an action byte plus fixed-size fields, base64 encoded.
+
+    Courts travel as their 32-bit resource ID and dates as day numbers, so
+    a payload is at most MAX_LENGTH (13) characters whatever the court is
+    called, far below Telegram's 64 byte callback_data limit.
+    decode() returns (action, args) with the fields turned back into
+    resource names, dates and hours. Payloads of buttons sent before the
+    codec still decode to the same actions.
+    """
+
+    def __init__(self, resources, sessions=None):
+        self.resources = resources
+        self.sessions = sessions if sessions is not None else SessionStore()
+        packers = {
+            'resource': self._pack_resource,
+            'day': lambda day: day.toordinal() - EPOCH,
+            'month': lambda month: month[0] * 12 + month[1] - 1,
+        }
+        unpackers = {
+            'resource': self._unpack_resource,
+            'day': lambda value, chat_id: date.fromordinal(EPOCH + value),
+            'month': lambda value, chat_id: (value // 12, value % 12 + 1),
+            'session': lambda value, chat_id: self.sessions.get(chat_id, value) if value else None,
+        }
+        plain_pack = lambda value: value or 0
+        plain_unpack = lambda value, chat_id: value
+        # Converters per action, looked up once instead of per field
+        self._packers = {action: tuple(packers.get(field, plain_pack) for field in fields)
+                         for action, fields in FIELDS.items()}
+        self._unpackers = {action: tuple(unpackers.get(field, plain_unpack) for field in fields)
+                           for action, fields in FIELDS.items()}
+
+    def encode(self, action, *args):
+        packers = self._packers[action]
+        # Trailing fields left out are packed as 0
+        args = args + (None,) * (len(packers) - len(args))
+        payload = STRUCTS[action].pack(action, *[pack(value) for pack, value in zip(packers, args)])
+        return PREFIX + binascii.b2a_base64(payload, newline=False).rstrip(b'=').decode('ascii')
+
+    def session(self, chat_id, value):
+        """Key of value stored for the chat, to be passed to encode"""
+        return self.sessions.put(chat_id, value)
+
+    def decode(self, data, chat_id=None):
+        if data[:1] != PREFIX:
+            return self.decode_legacy(data)
+        try:
+            payload = binascii.a2b_base64(data[1:] + '=' * (-(len(data) - 1) % 4))
+            action = payload[0]
+            values = STRUCTS[action].unpack(payload)
+        except (ValueError, KeyError, IndexError, struct.error, binascii.Error):
+            raise StaleCallback(data)
+        return action, tuple(unpack(value, chat_id) for unpack, value in zip(self._unpackers[action], values[1:]))
+
+    def _pack_resource(self, name):
+        resource = self.resources.get(name)
+        if resource is None:
+            raise ValueError(f"Unknown resource: {name}")
+        return resource.id
+
+    def _unpack_resource(self, value, chat_id):
+        resource = self.resources.by_id(value)
+        if resource is None:
+            raise StaleCallback(f"resource {value}")
+        return resource.name
+
+    def decode_legacy(self, data):
+        """(action, args) of a colon separated payload from before the codec"""
+        name, _, rest = data.partition(':')
+        parts = rest.split(':') if rest else []
+        try:
+            if name in ('ignore', 'busy'):
+                return IGNORE, ()
+            if name == 'book':
+                return BOOK, ()
+            if name == 'back_to_options':
+                return OPTIONS, ()
+            if name == 'find_free':
+                return FIND_FREE, (None,)
+            if name == 'venue':
+                return VENUE, (int(parts[0]),)
+            if name in ('option', 'back_to_calendar'):
+                today = date.today()
+                return CALENDAR, (self._legacy_resource(parts[0]), (today.year, today.month))
+            if name in ('prev_month', 'next_month'):
+                year, month = map(int, parts[1].split('-'))
+                month += -1 if name == 'prev_month' else 1
+                year, month = year + (month - 1) // 12, (month - 1) % 12 + 1
+                return CALENDAR, (self._legacy_resource(parts[0]), (year, month))
+            if name in ('select_date', 'back_to_times'):
+                return DAY, (self._legacy_resource(parts[0]), _legacy_date(parts[1]))
+            if name in ('time', 'confirm'):
+                action = TIME if name == 'time' else CONFIRM
+                return action, (self._legacy_resource(parts[0]), _legacy_date(parts[1]), int(parts[2]))
+        except (ValueError, IndexError):
+            pass
+        raise StaleCallback(data)
+
+    def _legacy_resource(self, name):
+        if self.resources.get(name) is None:
+            raise StaleCallback(name)
+        return name
+
+
+def _legacy_date(text):
+    return datetime.strptime(text, '%Y-%m-%d').date()
+
+
+class CallbackRouter:
+    """Callback handlers by action, so dispatch is one dict lookup per update"""
+
+    def __init__(self):
+        self.handlers = {}
+
+    def route(self, action):
+        def register(func):
+            self.handlers[action] = func
+            return func
+        return register
+
+    def handler(self, action):
+        return self.handlers.get(action)
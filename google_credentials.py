@@ -0,0 +1,226 @@
+import json
+import logging
+import os
+import random
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+try:
+    import fcntl
+except ImportError:  # Windows, fine for local development with one process
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# OAuth token of the Google account, plain JSON shared by every bot process on the host
+GOOGLE_TOKEN_FILE = os.getenv('GOOGLE_TOKEN_FILE', 'token.json')
+# The access token is refreshed this many seconds before it expires, in the background
+GOOGLE_TOKEN_REFRESH_AHEAD = int(os.getenv('GOOGLE_TOKEN_REFRESH_AHEAD', '300'))
+# Written by older versions of the bot, converted to GOOGLE_TOKEN_FILE once and removed
+LEGACY_TOKEN_FILE = 'token.pickle'
+
+GOOGLE_TOKEN_URI = 'https://oauth2.googleapis.com/token'
+
+
+def utcnow():
+    # google-auth keeps expiry as naive UTC
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def credentials_from_info(info, scopes=None):
+    """google.oauth2 Credentials from the token file's JSON, keeping its token_uri"""
+    from google.oauth2.credentials import Credentials
+
+    expiry = info.get('expiry')
+    return Credentials(
+        token=info.get('token'),
+        refresh_token=info.get('refresh_token'),
+        token_uri=info.get('token_uri') or GOOGLE_TOKEN_URI,
+        client_id=info.get('client_id'),
+        client_secret=info.get('client_secret'),
+        scopes=scopes or info.get('scopes'),
+        expiry=datetime.strptime(expiry.rstrip('Z').split('.')[0], '%Y-%m-%dT%H:%M:%S') if expiry else None
+    )
+
+
+def credentials_info(creds):
+    return json.loads(creds.to_json())
+
+
+class TokenFile:
+    """JSON token file guarded by an exclusive lock on a side file.
+
+    Every process takes the lock for the whole read-refresh-write, and
+    writes go to a temporary file renamed over the old one, so readers
+    never see half a token.
+    """
+
+    def __init__(self, path=GOOGLE_TOKEN_FILE):
+        self.path = path
+        self.lock_path = path + '.lock'
+        self._thread_lock = threading.Lock()
+
+    @contextmanager
+    def locked(self):
+        with self._thread_lock:
+            if fcntl is None:
+                yield
+                return
+            with open(self.lock_path, 'a') as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def load(self):
+        """Token info dict, None when there is no file"""
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def save(self, info):
+        temporary = f"{self.path}.{os.getpid()}.tmp"
+        # Holds a refresh token, only the bot's user may read it
+        fd = os.open(temporary, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(info, f)
+        os.replace(temporary, self.path)
+
+    def delete(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class CredentialManager:
+    """Google OAuth credentials of the process, refreshed before they expire.
+
+    The credentials object handed out by load() is the one the HTTP
+    transport uses, a background thread refreshes it in place
+    refresh_ahead seconds before expiry, so no user request waits for a
+    token round-trip. Refreshes happen under the token file's lock: a
+    process that finds a newer token in the file (another worker already
+    refreshed) takes it over instead of calling Google itself.
+    """
+
+    def __init__(self, path=GOOGLE_TOKEN_FILE, scopes=None, refresh_ahead=GOOGLE_TOKEN_REFRESH_AHEAD,
+                 legacy_path=LEGACY_TOKEN_FILE):
+        self.token_file = TokenFile(path)
+        self.scopes = scopes
+        self.refresh_ahead = refresh_ahead
+        self.legacy_path = legacy_path
+        self.creds = None
+        self._stop = threading.Event()
+        self._thread = None
+        # Metrics
+        self.refreshes = 0
+        self.adopted = 0
+        self.failures = 0
+
+    def load(self):
+        """Credentials from the token file (converting token.pickle first), None when there are none"""
+        with self.token_file.locked():
+            if not self.token_file.exists():
+                self._migrate_legacy()
+            info = self.token_file.load()
+        if info is None:
+            return None
+        self.creds = credentials_from_info(info, self.scopes)
+        return self.creds
+
+    def _migrate_legacy(self):
+        # Token file lock held
+        if not self.legacy_path or not os.path.exists(self.legacy_path):
+            return
+        import pickle
+
+        with open(self.legacy_path, 'rb') as f:
+            creds = pickle.load(f)
+        self.token_file.save(credentials_info(creds))
+        os.remove(self.legacy_path)
+        logger.info(f"Converted {self.legacy_path} to {self.token_file.path}")
+
+    def store(self, creds):
+        """Use and save credentials from a fresh authorization"""
+        with self.token_file.locked():
+            self.token_file.save(credentials_info(creds))
+        self.creds = creds
+
+    def expires_in(self):
+        """Seconds until the access token expires, None when unknown"""
+        creds = self.creds
+        if creds is None or creds.expiry is None:
+            return None
+        return (creds.expiry - utcnow()).total_seconds()
+
+    def refresh(self, force=False):
+        """Refresh the access token unless it (or a newer one in the file) is good for refresh_ahead seconds"""
+        from google.auth.transport.requests import Request
+
+        with self.token_file.locked():
+            info = self.token_file.load()
+            if info is not None and info.get('expiry'):
+                stored = credentials_from_info(info, self.scopes)
+                if self.creds.expiry is None or stored.expiry > self.creds.expiry:
+                    # Another process refreshed while this one was waiting for the lock
+                    self.creds.token = stored.token
+                    self.creds.expiry = stored.expiry
+                    self.adopted += 1
+            expires_in = self.expires_in()
+            if not force and expires_in is not None and expires_in > self.refresh_ahead:
+                return False
+            self.creds.refresh(Request())
+            self.token_file.save(credentials_info(self.creds))
+            self.refreshes += 1
+        logger.info(f"Google access token refreshed, valid for {self.expires_in():.0f}s")
+        return True
+
+    def ensure_valid(self):
+        """Refresh now when the loaded token is expired or about to expire"""
+        expires_in = self.expires_in()
+        if expires_in is None or expires_in <= self.refresh_ahead:
+            self.refresh()
+
+    def start(self):
+        """Keep the token refreshed from a background thread"""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name='google-token', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            expires_in = self.expires_in()
+            # Workers started together would all wake at once, a little jitter lets one refresh for all
+            delay = 0 if expires_in is None else expires_in - self.refresh_ahead + random.uniform(0, self.refresh_ahead / 10)
+            if delay > 0 and self._stop.wait(delay):
+                return
+            try:
+                self.refresh()
+            except Exception as e:
+                self.failures += 1
+                logger.error(f"Error refreshing Google access token: {str(e)}")
+                # Try again soon, the old token may still be good for a while
+                self._stop.wait(min(60, max(5, (self.expires_in() or 0) / 4)))
+                continue
+            # Tokens shorter lived than refresh_ahead would otherwise be refreshed in a loop
+            if (self.expires_in() or 0) <= self.refresh_ahead:
+                self._stop.wait(1)
+
+    def stats(self):
+        expires_in = self.expires_in()
+        return {
+            'expires_in_seconds': round(expires_in, 1) if expires_in is not None else -1,
+            'refreshes': self.refreshes,
+            'adopted': self.adopted,
+            'failures': self.failures
+        }
@@ -0,0 +1,147 @@
+import os
+import random
+import threading
+from time import monotonic
+
+# Keep-alive connections per Google host shared by all threads; callers beyond it wait for a free one
+GOOGLE_HTTP_POOL_SIZE = int(os.getenv('GOOGLE_HTTP_POOL_SIZE', '10'))
+# Seconds to wait for Google to connect or answer
+GOOGLE_HTTP_TIMEOUT = float(os.getenv('GOOGLE_HTTP_TIMEOUT', '30'))
+
+# Backoff between retries: full jitter over base * 2^attempt, capped
+RETRY_BASE_DELAY = 0.5
+RETRY_MAX_DELAY = 8.0
+# Statuses worth retrying, everything else is the caller's problem
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+# Failed Google calls in a row that open the circuit, and seconds before one trial call is let through
+GOOGLE_CIRCUIT_FAILURES = int(os.getenv('GOOGLE_CIRCUIT_FAILURES', '5'))
+GOOGLE_CIRCUIT_RESET = float(os.getenv('GOOGLE_CIRCUIT_RESET', '30'))
+
+
+def backoff_delay(attempt, base=RETRY_BASE_DELAY, cap=RETRY_MAX_DELAY):
+    """Seconds to sleep before retry number `attempt` (1-based)"""
+    return random.uniform(0, min(cap, base * 2 ** (attempt - 1)))
+
+
+class GoogleUnavailableError(Exception):
+    """Google is failing (or the circuit is open) and no fresh data can be had"""
+
+
+class CircuitBreaker:
+    """Stops calling Google during an outage.
+
+    After `failures` failed calls in a row the circuit opens and calls fail
+    at once with GoogleUnavailableError. reset_after seconds later a single
+    trial call is let through: success closes the circuit, failure opens it
+    for another reset_after.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+    def __init__(self, failures=GOOGLE_CIRCUIT_FAILURES, reset_after=GOOGLE_CIRCUIT_RESET):
+        self.failures = failures
+        self.reset_after = reset_after
+        self._lock = threading.Lock()
+        self._failed = 0
+        self._opened_at = None
+        self._trial = False
+        # Metrics
+        self.opened = 0
+        self.rejected = 0
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state(monotonic())
+
+    def _state(self, now):
+        # Lock held
+        if self._opened_at is None:
+            return self.CLOSED
+        if now - self._opened_at < self.reset_after or self._trial:
+            return self.OPEN
+        return self.HALF_OPEN
+
+    def before_call(self):
+        """Raise GoogleUnavailableError unless a call may go out now"""
+        with self._lock:
+            now = monotonic()
+            state = self._state(now)
+            if state == self.CLOSED:
+                return
+            if state == self.HALF_OPEN:
+                self._trial = True
+                return
+            self.rejected += 1
+            retry_in = max(0.0, self._opened_at + self.reset_after - now)
+        raise GoogleUnavailableError(f"Google Calendar circuit open, next try in {retry_in:.0f}s")
+
+    def record(self, ok):
+        with self._lock:
+            self._trial = False
+            if ok:
+                self._failed = 0
+                self._opened_at = None
+                return
+            self._failed += 1
+            if self._opened_at is not None or self._failed >= self.failures:
+                if self._opened_at is None:
+                    self.opened += 1
+                self._opened_at = monotonic()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'open': int(self._state(monotonic()) != self.CLOSED),
+                'failures_in_row': self._failed,
+                'opened': self.opened,
+                'rejected': self.rejected
+            }
+
+
+class PooledHttp:
+    """httplib2.Http look-alike that googleapiclient can use from many threads at once.
+
+    Requests go through one google-auth AuthorizedSession whose urllib3 pool
+    keeps TLS connections to Google open between calls, so concurrent
+    handlers share warm connections instead of each thread opening (and
+    handshaking) its own.
+    """
+
+    def __init__(self, credentials, pool_size=GOOGLE_HTTP_POOL_SIZE, timeout=GOOGLE_HTTP_TIMEOUT):
+        from google.auth.transport.requests import AuthorizedSession
+        from requests.adapters import HTTPAdapter
+
+        # Read by googleapiclient to authorize the parts of batch requests
+        self.credentials = credentials
+        self.timeout = timeout
+        self.session = AuthorizedSession(credentials)
+        # Retries are done by GoogleCalendarHelper._execute with backoff, not by urllib3
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, pool_block=True, max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self._lock = threading.Lock()
+        self.requests = 0
+
+    def request(self, uri, method='GET', body=None, headers=None, redirections=5, connection_type=None):
+        """Same call and return shape as httplib2.Http.request: (response, content)"""
+        import httplib2
+
+        with self._lock:
+            self.requests += 1
+        response = self.session.request(
+            method, uri, data=body, headers=headers,
+            timeout=self.timeout, allow_redirects=redirections > 0
+        )
+        info = dict(response.headers)
+        info['status'] = str(response.status_code)
+        resp = httplib2.Response(info)
+        resp.reason = response.reason
+        return resp, response.content
+
+    def close(self):
+        self.session.close()
+
+    def stats(self):
+        return {'requests': self.requests}
@@ -0,0 +1,272 @@
+import asyncio
+import contextvars
+import functools
+import json
+import logging
+import os
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from time import perf_counter
+
+# Callbacks slower than this (seconds) are written to SLOW_REQUEST_LOG with their stages
+SLOW_REQUEST_SECONDS = float(os.getenv('SLOW_REQUEST_SECONDS', '1.0'))
+SLOW_REQUEST_LOG = os.getenv('SLOW_REQUEST_LOG', 'slow_requests.log')
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _labels_text(labelnames, values):
+    if not labelnames:
+        return ''
+    pairs = ','.join(f'{name}="{str(value)}"' for name, value in zip(labelnames, values))
+    return '{' + pairs + '}'
+
+
+class Counter:
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}  # label values -> count
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_labels_text(self.labelnames, labels)} {value}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._values = {}  # label values -> [bucket counts..., count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        with self._lock:
+            data = self._values.get(labels)
+            if data is None:
+                data = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    data[i] += 1
+            data[-2] += 1
+            data[-1] += value
+
+    @contextmanager
+    def time(self, *labels):
+        started = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(perf_counter() - started, *labels)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            for labels, data in sorted(self._values.items()):
+                for i, bound in enumerate(self.buckets):
+                    bucket_labels = _labels_text(self.labelnames + ('le',), labels + (bound,))
+                    lines.append(f'{self.name}_bucket{bucket_labels} {data[i]}')
+                inf_labels = _labels_text(self.labelnames + ('le',), labels + ('+Inf',))
+                lines.append(f'{self.name}_bucket{inf_labels} {data[-2]}')
+                lines.append(f'{self.name}_count{_labels_text(self.labelnames, labels)} {data[-2]}')
+                lines.append(f'{self.name}_sum{_labels_text(self.labelnames, labels)} {data[-1]:.6f}')
+        return lines
+
+
+def format_stats(prefix, stats):
+    """Render a stats dict as Prometheus text lines"""
+    return ''.join(f"{prefix}_{name} {value}\n" for name, value in stats.items())
+
+
+class Registry:
+    """All metrics of the process, rendered together on /metrics.
+
+    Besides counters and histograms it takes collectors: callables returning
+    a plain stats dict (caches, worker pools), read at render time.
+    """
+
+    def __init__(self):
+        self.metrics = []
+        self.collectors = {}  # prefix -> callable returning a stats dict
+
+    def counter(self, name, help, labelnames=()):
+        metric = Counter(name, help, labelnames)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, help, labelnames, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def add_collector(self, prefix, func):
+        self.collectors[prefix] = func
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        text = '\n'.join(lines) + '\n'
+        for prefix, func in self.collectors.items():
+            try:
+                text += format_stats(prefix, func())
+            except Exception as e:
+                logging.getLogger(__name__).warning(f"Error collecting {prefix} metrics: {str(e)}")
+        return text
+
+
+REGISTRY = Registry()
+
+HANDLER_SECONDS = REGISTRY.histogram('bot_handler_seconds', 'Time spent in a Telegram update handler', ['handler'])
+HANDLER_ERRORS = REGISTRY.counter('bot_handler_errors_total', 'Exceptions escaping a handler', ['handler'])
+GOOGLE_SECONDS = REGISTRY.histogram('bot_google_request_seconds', 'Google API call time per attempt', ['method'])
+GOOGLE_RETRIES = REGISTRY.counter('bot_google_retries_total', 'Google API calls retried', ['method'])
+GOOGLE_ERRORS = REGISTRY.counter('bot_google_errors_total', 'Failed Google API attempts', ['method', 'status'])
+TELEGRAM_SECONDS = REGISTRY.histogram('bot_telegram_request_seconds', 'Telegram Bot API call time', ['method'])
+TELEGRAM_WAIT_SECONDS = REGISTRY.histogram('bot_telegram_wait_seconds', 'Time a Bot API call waited for the rate limiter',
+                                          ['method'])
+TELEGRAM_ERRORS = REGISTRY.counter('bot_telegram_errors_total', 'Failed Telegram Bot API calls', ['method'])
+SLOW_REQUESTS = REGISTRY.counter('bot_slow_requests_total', 'Handlers slower than SLOW_REQUEST_SECONDS', ['handler'])
+
+
+class Trace:
+    """Stages of one handler run: (name, seconds) in the order they finished"""
+
+    def __init__(self, name):
+        self.name = name
+        self.stages = []
+
+
+# Context variables follow asyncio tasks and are copied into executor threads by run_blocking
+_current_trace = contextvars.ContextVar('trace', default=None)
+
+
+@contextmanager
+def stage(name):
+    """Time a piece of work as a stage of the current handler, if there is one"""
+    started = perf_counter()
+    try:
+        yield
+    finally:
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.stages.append((name, perf_counter() - started))
+
+
+def _slow_logger():
+    logger = logging.getLogger('slow_requests')
+    if not logger.handlers:
+        # Own file, not the root handlers, so samples never reach the Telegram log channel
+        logger.addHandler(logging.FileHandler(SLOW_REQUEST_LOG, encoding='utf-8'))
+        logger.propagate = False
+        logger.setLevel(logging.INFO)
+    return logger
+
+
+def _finish(trace, elapsed, error):
+    HANDLER_SECONDS.observe(elapsed, trace.name)
+    if error is not None:
+        HANDLER_ERRORS.inc(trace.name)
+    if elapsed >= SLOW_REQUEST_SECONDS:
+        SLOW_REQUESTS.inc(trace.name)
+        breakdown = {}
+        for name, seconds in trace.stages:
+            breakdown[name] = round(breakdown.get(name, 0.0) + seconds, 4)
+        sample = {
+            'time': datetime.now().isoformat(timespec='seconds'),
+            'handler': trace.name,
+            'seconds': round(elapsed, 4),
+            'stages': breakdown,
+            'unaccounted': round(elapsed - sum(seconds for _, seconds in trace.stages), 4),
+        }
+        if error is not None:
+            sample['error'] = repr(error)
+        _slow_logger().info(json.dumps(sample, ensure_ascii=False))
+
+
+def timed_handler(func):
+    """Record latency, errors and slow samples of a (sync or async) bot handler"""
+    name = func.__name__
+
+    if asyncio.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            trace = Trace(name)
+            token = _current_trace.set(trace)
+            started = perf_counter()
+            error = None
+            try:
+                return await func(*args, **kwargs)
+            except Exception as e:
+                error = e
+                raise
+            finally:
+                _current_trace.reset(token)
+                _finish(trace, perf_counter() - started, error)
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        trace = Trace(name)
+        token = _current_trace.set(trace)
+        started = perf_counter()
+        error = None
+        try:
+            return func(*args, **kwargs)
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            _current_trace.reset(token)
+            _finish(trace, perf_counter() - started, error)
+    return wrapper
+
+
+def instrument_telegram():
+    """Time every Telegram Bot API call made through pyTelegramBotAPI (sync and asyncio)"""
+    from telebot import apihelper, asyncio_helper
+
+    if getattr(apihelper._make_request, 'instrumented', False):
+        return
+
+    make_request = apihelper._make_request
+
+    def timed_make_request(token, method_name, method='get', params=None, files=None):
+        started = perf_counter()
+        try:
+            with stage(f'telegram.{method_name}'):
+                return make_request(token, method_name, method, params, files)
+        except Exception:
+            TELEGRAM_ERRORS.inc(method_name)
+            raise
+        finally:
+            TELEGRAM_SECONDS.observe(perf_counter() - started, method_name)
+
+    process_request = asyncio_helper._process_request
+
+    async def timed_process_request(token, url, method='get', params=None, files=None, **kwargs):
+        started = perf_counter()
+        try:
+            with stage(f'telegram.{url}'):
+                return await process_request(token, url, method, params, files, **kwargs)
+        except Exception:
+            TELEGRAM_ERRORS.inc(url)
+            raise
+        finally:
+            TELEGRAM_SECONDS.observe(perf_counter() - started, url)
+
+    timed_make_request.instrumented = True
+    apihelper._make_request = timed_make_request
+    asyncio_helper._process_request = timed_process_request
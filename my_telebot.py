@@ -1,14 +1,32 @@
+import time
+# Reference point for the startup time report
+STARTED_AT = time.perf_counter()
+
 import telebot
 from telebot import types
-from datetime import datetime, date
+from datetime import datetime, date, timedelta
 import calendar
-from calendar_helper import GoogleCalendarHelper
+import contextvars
+import functools
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from calendar_helper import (
+    BOOKED, CLOSED, FREE_SEARCH_DAYS, TAKEN, GoogleCalendarHelper, GoogleUnavailableError, SlotTakenError
+)
+from prefetch import Prefetcher
+from resources import DEFAULT_HOURS
+from metrics import REGISTRY, instrument_telegram, stage, timed_handler
+from callback_codec import (
+    BOOK, CALENDAR, CONFIRM, CONFIRM_REPEAT, DAY, FIND_FREE, IGNORE, MY_BOOKINGS, OPTIONS, REPEAT, TIME, VENUE,
+    CallbackCodec, CallbackRouter, StaleCallback
+)
+from telegram_scheduler import TelegramScheduler
 import logging
 import os
 from dotenv import load_dotenv
 import locale
 import requests
-import time
+import queue
+import threading
 
 # Load environment variables
 load_dotenv()
@@ -16,151 +34,480 @@ load_dotenv()
 # Remove the hardcoded values and use environment variables
 LOGS_CHANNEL_ID = os.getenv('LOGS_CHANNEL_ID')
 bot = telebot.TeleBot(os.getenv('TELEGRAM_BOT_TOKEN'))
+# Paces all outbound Bot API calls, replies to users go before the log channel
+telegram_scheduler = TelegramScheduler(low_priority_chats=[LOGS_CHANNEL_ID])
 
-# Set Russian locale for month names
-locale.setlocale(locale.LC_ALL, 'ru_RU.UTF-8')
+LOG_SEND_SECONDS = REGISTRY.histogram('bot_log_send_seconds', 'Time to deliver one batch to the log channel')
 
 # Define TelegramLogHandler
 class TelegramLogHandler(logging.Handler):
-    def __init__(self, bot, channel_id):
+    """Sends log records to a Telegram channel without blocking the caller.
+
+    emit() only puts the formatted record on a bounded queue. A background
+    thread collects records for up to flush_interval seconds and sends them
+    as one message, at most one message per min_send_interval seconds
+    (close() sends what is left without waiting for it). When the queue is
+    full records are dropped and reported in the next batch.
+    """
+    MAX_MESSAGE_LENGTH = 4096
+
+    def __init__(self, bot, channel_id, flush_interval=2.0, min_send_interval=3.0, max_queue=1000):
         super().__init__()
         self.bot = bot
         self.channel_id = channel_id
+        self.flush_interval = flush_interval
+        # Telegram allows about 20 messages per minute in a channel
+        self.min_send_interval = min_send_interval
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.dropped = 0
+        # Not the handler's own lock: logging.shutdown() holds that one while close() waits for _run
+        self._dropped_lock = threading.Lock()
+        self.sent_messages = 0
+        self._last_send = 0.0
+        self._closing = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='telegram-log', daemon=True)
+        self._thread.start()
 
     def emit(self, record):
         try:
-            msg = self.format(record)
-            formatted_msg = f"🔵GoogleCalendarBot📅 *{record.levelname}*\n" \
-                          f"⏰ {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n" \
-                          f"📝 {msg}"
-            self.bot.send_message(
-                self.channel_id,
-                formatted_msg,
-                parse_mode='Markdown'
-            )
+            with stage('log'):
+                msg = self.format(record)
+                formatted_msg = f"*{record.levelname}* ⏰ {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n" \
+                                f"📝 {msg}"
+                self.queue.put_nowait(formatted_msg)
+        except queue.Full:
+            # emit runs in every logging thread and _run resets the counter
+            with self._dropped_lock:
+                self.dropped += 1
         except Exception:
             self.handleError(record)
 
+    def _run(self):
+        while not (self._closing.is_set() and self.queue.empty()):
+            try:
+                records = [self.queue.get(timeout=0.5)]
+            except queue.Empty:
+                continue
+
+            # Coalesce everything that arrives within the flush window,
+            # and wait out the rate limit while we are at it
+            deadline = max(time.monotonic() + self.flush_interval, self._last_send + self.min_send_interval)
+            while not self._closing.is_set():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    records.append(self.queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            while True:
+                try:
+                    records.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            # None is only a wake-up from close()
+            records = [record for record in records if record is not None]
+            with self._dropped_lock:
+                dropped, self.dropped = self.dropped, 0
+            if dropped:
+                records.append(f"⚠️ Пропущено записей лога: {dropped}")
+
+            for chunk in self._chunks(records):
+                self._send(chunk)
+
+    def _chunks(self, records):
+        header = "🔵GoogleCalendarBot📅\n\n"
+        limit = self.MAX_MESSAGE_LENGTH - len(header)
+        chunk = ''
+        for record in records:
+            record = record[:limit]
+            if chunk and len(chunk) + len(record) + 2 > limit:
+                yield header + chunk
+                chunk = ''
+            chunk = f"{chunk}\n\n{record}" if chunk else record
+        if chunk:
+            yield header + chunk
+
+    def _send(self, text):
+        delay = self._last_send + self.min_send_interval - time.monotonic()
+        # On close the rest goes out at once, telegram_scheduler still paces the channel
+        if delay > 0 and not self._closing.is_set():
+            time.sleep(delay)
+        started = time.perf_counter()
+        try:
+            try:
+                # 429 answers are waited out and retried by telegram_scheduler
+                self.bot.send_message(self.channel_id, text, parse_mode='Markdown')
+            except telebot.apihelper.ApiTelegramException as e:
+                if e.error_code == 400:
+                    # Batching or truncation broke the Markdown, send as plain text
+                    self.bot.send_message(self.channel_id, text)
+                else:
+                    raise
+            self.sent_messages += 1
+        except Exception as e:
+            # Logging from here would only come back to this handler
+            print(f"Error sending logs to Telegram: {e}")
+        finally:
+            self._last_send = time.monotonic()
+            LOG_SEND_SECONDS.observe(time.perf_counter() - started)
+
+    def stats(self):
+        return {
+            'queue_depth': self.queue.qsize(),
+            'dropped': self.dropped,
+            'sent_messages': self.sent_messages
+        }
+
+    def close(self):
+        """Send what is still queued, then stop the background thread"""
+        self._closing.set()
+        try:
+            # Wake the thread right away instead of after its poll timeout
+            self.queue.put_nowait(None)
+        except queue.Full:
+            pass
+        self._thread.join(timeout=10)
+        super().close()
+
 # Configure logging
+telegram_log_handler = TelegramLogHandler(bot, LOGS_CHANNEL_ID)
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(levelname)s - %(message)s',
     handlers=[
         logging.StreamHandler(),
-        TelegramLogHandler(bot, LOGS_CHANNEL_ID)
+        telegram_log_handler
     ]
 )
 logger = logging.getLogger(__name__)
 
 calendar_helper = GoogleCalendarHelper()
+# Button payloads and the handler of each button action
+codec = CallbackCodec(calendar_helper.resources)
+router = CallbackRouter()
+# Loads the views a user is likely to open after a month is shown
+prefetcher = Prefetcher(calendar_helper)
+
+REGISTRY.add_collector('bot_log', telegram_log_handler.stats)
+REGISTRY.add_collector('bot_busy_slots_cache', calendar_helper.busy_slots_cache.stats)
+REGISTRY.add_collector('bot_month_cache', calendar_helper.month_occupancy_cache.stats)
+REGISTRY.add_collector('bot_prefetch', prefetcher.stats)
+REGISTRY.add_collector('bot_telegram_scheduler', telegram_scheduler.stats)
+REGISTRY.add_collector('bot_calendar_availability', calendar_helper.availability_stats)
+REGISTRY.add_collector('bot_google_token', calendar_helper.credentials.stats)
 
 # Add after other configurations
 LOGS_CHANNEL_ID = "YOUR_CHANNEL_ID"  # Replace with your channel ID
 
-def generate_calendar(year, month, option, user_id):
-    markup = types.InlineKeyboardMarkup()
-    today = date.today()
-
+# Confirmations that take longer than this (seconds) show the loading sticker
+LOADING_STICKER_DELAY = float(os.getenv('LOADING_STICKER_DELAY', '0.7'))
+# Calendar inserts running at the same time, each waits for Google for a few hundred ms
+booking_executor = ThreadPoolExecutor(max_workers=int(os.getenv('BOOKING_WORKERS', '8')), thread_name_prefix='booking')
+
+# Slots shown by /free and the search button
+FREE_SEARCH_LIMIT = int(os.getenv('FREE_SEARCH_LIMIT', '5'))
+# Upcoming bookings listed by /my, the rest is only counted
+MY_BOOKINGS_LIMIT = int(os.getenv('MY_BOOKINGS_LIMIT', '20'))
+# Longest weekly series one confirmation can book, the first week included
+RECURRING_MAX_WEEKS = int(os.getenv('RECURRING_MAX_WEEKS', '8'))
+
+# Calendar icons are read once instead of on every day cell
+PAST_DATE_ICON = os.getenv('PAST_DATE_ICON')
+TODAY_ICON = os.getenv('TODAY_ICON')
+PAST_BOOKING_ICON = os.getenv('PAST_BOOKING_ICON')
+OCCUPIED_TIME_ICON = os.getenv('OCCUPIED_TIME_ICON')
+USER_BOOKING_ICON = os.getenv('USER_BOOKING_ICON')
+
+@functools.lru_cache(maxsize=128)
+def calendar_layout(year, month, option):
+    """Static part of a month grid, built once per (year, month, option).
+
+    Returns the header and weekday rows, the weeks as lists of
+    (date, {state: button}) cells (None for padding) and the back row.
+    Buttons are never mutated, so cached ones can be shared between markups.
+    """
+    ignore = codec.encode(IGNORE)
     # Russian month name
     month_name = calendar.month_name[month].capitalize()
     header = [
-        types.InlineKeyboardButton("<<", callback_data=f"prev_month:{option}:{year}-{month}"),
-        types.InlineKeyboardButton(month_name, callback_data="ignore"),
-        types.InlineKeyboardButton(">>", callback_data=f"next_month:{option}:{year}-{month}")
+        types.InlineKeyboardButton("<<", callback_data=codec.encode(CALENDAR, option, shift_month('prev_month', year, month))),
+        types.InlineKeyboardButton(month_name, callback_data=ignore),
+        types.InlineKeyboardButton(">>", callback_data=codec.encode(CALENDAR, option, shift_month('next_month', year, month)))
     ]
-    markup.row(*header)
 
     # Russian weekday names
     week_days = ["Пн", "Вт", "Ср", "Чт", "Пт", "Сб", "Вс"]
-    markup.row(*[types.InlineKeyboardButton(day, callback_data="ignore") for day in week_days])
+    week_days_row = [types.InlineKeyboardButton(day, callback_data=ignore) for day in week_days]
+
+    empty = types.InlineKeyboardButton(" ", callback_data=ignore)
+    weeks = []
+    for week in calendar.monthcalendar(year, month):
+        cells = []
+        for day in week:
+            if day == 0:
+                cells.append((None, empty))
+                continue
+            callback_data = codec.encode(DAY, option, date(year, month, day))
+            variants = {
+                'free': str(day),
+                'past': f"{day}{PAST_DATE_ICON}",
+                'past_booking': f"{day}{PAST_BOOKING_ICON}",
+                'today': f"{day}{TODAY_ICON}",
+                'user_booking': f"{day}{USER_BOOKING_ICON}"
+            }
+            buttons = {state: types.InlineKeyboardButton(text, callback_data=callback_data)
+                       for state, text in variants.items()}
+            cells.append((date(year, month, day), buttons))
+        weeks.append(cells)
+
+    back_row = [types.InlineKeyboardButton("« Назад", callback_data=codec.encode(OPTIONS))]
+    return header, week_days_row, weeks, back_row
+
+def generate_calendar(year, month, option, user_id):
+    markup = types.InlineKeyboardMarkup()
+    today = date.today()
+    header, week_days_row, weeks, back_row = calendar_layout(year, month, option)
+    markup.row(*header)
+    markup.row(*week_days_row)
 
     # Get all bookings for this month
-    start_date = date(year, month, 1)
-    end_date = date(year, month + 1, 1) if month < 12 else date(year + 1, 1, 1)
-    bookings = calendar_helper.get_month_bookings(start_date, end_date, option)
-    user_bookings = calendar_helper.get_user_bookings(start_date, end_date, option)
+    occupancy = calendar_helper.get_month_occupancy(year, month, option)
 
-    cal = calendar.monthcalendar(year, month)
-    for week in cal:
+    for week in weeks:
         row = []
-        for day in week:
-            if day == 0:
-                btn = types.InlineKeyboardButton(" ", callback_data="ignore")
+        for current_date, buttons in week:
+            if current_date is None:
+                row.append(buttons)
+                continue
+
+            # Past dates
+            if current_date < today:
+                state = 'past_booking' if occupancy.is_busy(current_date) else 'past'
+            # Today
+            elif current_date == today:
+                state = 'today'
+            # Future dates
+            elif occupancy.has_user_booking(current_date, user_id):
+                state = 'user_booking'
             else:
-                current_date = date(year, month, day)
-                display_text = str(day)
-
-                # Past dates
-                if current_date < today:
-                    if any(booking['date'] == current_date for booking in bookings):
-                        display_text = f"{day}{os.getenv('PAST_BOOKING_ICON')}"
-                    else:
-                        display_text = f"{day}{os.getenv('PAST_DATE_ICON')}"
-                # Today
-                elif current_date == today:
-                    display_text = f"{day}{os.getenv('TODAY_ICON')}"
-                # Future dates
-                else:
-                    if any(booking['date'] == current_date and booking['user_id'] == str(user_id) for booking in user_bookings):
-                        display_text = f"{day}{os.getenv('USER_BOOKING_ICON')}"
-
-                btn = types.InlineKeyboardButton(
-                    display_text,
-                    callback_data=f"select_date:{option}:{year}-{month}-{day}"
-                )
-            row.append(btn)
+                state = 'free'
+            row.append(buttons[state])
         markup.row(*row)
 
-    back_button = types.InlineKeyboardButton("« Назад", callback_data="back_to_options")
-    markup.row(back_button)
+    markup.row(*back_row)
+    # Next tap is usually a near day or the next month, have them ready
+    prefetcher.after_calendar(year, month, option)
     return markup
 
-def generate_time_slots(option, date, user_id):
+def generate_time_slots(option, day, user_id):
     markup = types.InlineKeyboardMarkup()
-    busy_slots = calendar_helper.get_busy_slots(
-        datetime.strptime(date, '%Y-%m-%d').date(),
-        option
-    )
-
-    # Create a dictionary of hour -> (is_busy, user_id)
-    slot_info = {}
-    for slot in busy_slots:
-        hour = slot['hour']
-        event_user_id = slot.get('user_id')
-        slot_info[hour] = event_user_id
-
-    for hour in range(10, 20):
-        if hour in slot_info:
-            event_user_id = slot_info[hour]
-            if event_user_id == str(user_id):
+    occupancy = calendar_helper.get_day_occupancy(day, option)
+    resource = calendar_helper.get_resource(option)
+    hours = resource.slots_for(day) if resource else range(*DEFAULT_HOURS)
+    if not hours:
+        markup.add(types.InlineKeyboardButton("Закрыто в этот день", callback_data=codec.encode(IGNORE)))
+
+    for hour in hours:
+        if occupancy.is_busy(day, hour):
+            if occupancy.owner(day, hour) == str(user_id):
                 # User's own booking
-                time_text = f"{hour}:00 {os.getenv('USER_BOOKING_ICON')}"
+                time_text = f"{hour}:00 {USER_BOOKING_ICON}"
             else:
                 # Someone else's booking
-                time_text = f"{hour}:00 {os.getenv('OCCUPIED_TIME_ICON')}"
-            callback_data = f"busy:{hour}:00"
+                time_text = f"{hour}:00 {OCCUPIED_TIME_ICON}"
+            callback_data = codec.encode(IGNORE)
         else:
             # Free time slot
             time_text = f"{hour}:00"
-            callback_data = f"time:{option}:{date}:{hour}:00"
+            callback_data = codec.encode(TIME, option, day, hour)
 
         time_button = types.InlineKeyboardButton(time_text, callback_data=callback_data)
         markup.add(time_button)
 
-    back_button = types.InlineKeyboardButton("« Назад", callback_data=f"back_to_calendar:{option}")
+    back_button = types.InlineKeyboardButton("« Назад", callback_data=codec.encode(CALENDAR, option, (day.year, day.month)))
     markup.row(back_button)
     return markup
 
 
-def generate_confirmation(option, date, time):
+def generate_options(venue=None):
+    """Resource buttons, or venue buttons first when resources are spread over several venues"""
+    markup = types.InlineKeyboardMarkup(row_width=2)
+    resources = calendar_helper.resources
+    venues = resources.venues()
+    buttons = []
+    if venue is None and len(venues) > 1:
+        buttons += [types.InlineKeyboardButton(text=name, callback_data=codec.encode(VENUE, n))
+                    for n, name in enumerate(venues)]
+        shown = [resource for resource in resources if resource.venue is None]
+    else:
+        shown = resources.in_venue(venue) if venue else list(resources)
+    today = date.today()
+    buttons += [types.InlineKeyboardButton(text=resource.name,
+                                           callback_data=codec.encode(CALENDAR, resource.name, (today.year, today.month)))
+                for resource in shown]
+    markup.add(*buttons)
+    if venue is None:
+        markup.row(types.InlineKeyboardButton("🔎 Ближайшее свободное время", callback_data=codec.encode(FIND_FREE)))
+        markup.row(types.InlineKeyboardButton("📋 Мои бронирования", callback_data=codec.encode(MY_BOOKINGS)))
+    if venue is not None and len(venues) > 1:
+        markup.row(types.InlineKeyboardButton("« Назад", callback_data=codec.encode(OPTIONS)))
+    return markup
+
+def generate_free_slots(user_id, query=None, limit=FREE_SEARCH_LIMIT, chat_id=None):
+    """Text and buttons with the earliest free slots, optionally only resources matching query"""
+    resources = list(calendar_helper.resources)
+    if query:
+        query = query.lower()
+        resources = [resource for resource in resources
+                     if query in resource.name.lower() or query in (resource.venue or '').lower()]
+    markup = types.InlineKeyboardMarkup()
+    if not resources:
+        markup.row(types.InlineKeyboardButton("« Назад", callback_data=codec.encode(OPTIONS)))
+        return "Ничего не найдено. Попробуйте /free без уточнения.", markup
+
+    slots = calendar_helper.find_free_slots([resource.name for resource in resources], limit=limit, user_id=user_id)
+    week_days = ["Пн", "Вт", "Ср", "Чт", "Пт", "Сб", "Вс"]
+    for day, hour, option in slots:
+        # Same callback as a time button, so the usual confirmation flow takes over
+        markup.add(types.InlineKeyboardButton(
+            f"{day:%d.%m} {week_days[day.weekday()]} {hour}:00 — {option}",
+            callback_data=codec.encode(TIME, option, day, hour)
+        ))
+    # The query is free text of any length, the button only carries its session key
+    session = codec.session(chat_id, query) if query and chat_id is not None else None
+    markup.row(types.InlineKeyboardButton("🔄 Обновить", callback_data=codec.encode(FIND_FREE, session)),
+               types.InlineKeyboardButton("« Назад", callback_data=codec.encode(OPTIONS)))
+    note = stale_note(*[resource.name for resource in resources])
+    if not slots:
+        return f"Свободного времени в ближайшие {FREE_SEARCH_DAYS} дней нет.{note}", markup
+    return f"Ближайшее свободное время:{note}", markup
+
+def generate_user_bookings(user_id, limit=MY_BOOKINGS_LIMIT):
+    """Text listing the user's upcoming bookings of every resource, and a back button"""
+    bookings = calendar_helper.get_upcoming_user_bookings(user_id)
+    markup = types.InlineKeyboardMarkup()
+    markup.row(types.InlineKeyboardButton("« Назад", callback_data=codec.encode(OPTIONS)))
+    note = stale_note(*calendar_helper.resources.names())
+    if not bookings:
+        return f"У вас нет предстоящих бронирований.{note}", markup
+    week_days = ["Пн", "Вт", "Ср", "Чт", "Пт", "Сб", "Вс"]
+    lines = [f"{booking['date']:%d.%m} {week_days[booking['date'].weekday()]} "
+             f"{booking['start']:%H:%M}–{booking['end']:%H:%M} — {option}"
+             for option, booking in bookings[:limit]]
+    if len(bookings) > limit:
+        lines.append(f"…и ещё {len(bookings) - limit}")
+    return "Ваши бронирования:\n\n" + "\n".join(lines) + note, markup
+
+def stale_note(*options):
+    """Note for views built from calendars that could not be synced lately"""
+    if any(calendar_helper.is_outdated(option) for option in options):
+        return "\n\n⚠️ Данные могут быть устаревшими"
+    return ""
+
+def booking_error_text(error):
+    if isinstance(error, GoogleUnavailableError):
+        return "⚠️ Google Calendar сейчас недоступен, бронирование не создано. Попробуйте через минуту."
+    return "❌ Ошибка при бронировании. Попробуйте ещё раз."
+
+def venue_by_index(index):
+    venues = calendar_helper.resources.venues()
+    return venues[index] if 0 <= index < len(venues) else None
+
+def shift_month(action, year, month):
+    """Move one month back for 'prev_month' or forward for 'next_month'"""
+    if action == 'prev_month':
+        month -= 1
+        if month == 0:
+            month = 12
+            year -= 1
+    else:  # next_month
+        month += 1
+        if month == 13:
+            month = 1
+            year += 1
+    return year, month
+
+def date_label(day):
+    return f"{day.year}-{day.month}-{day.day}"
+
+def build_booking_event(option, day, hour, user_id, username):
+    """Build the Google Calendar event body for a booking"""
+    # Format times in RFC3339 format
+    start_time = datetime(day.year, day.month, day.day, hour, 0).isoformat() + '+03:00'
+    end_time = datetime(day.year, day.month, day.day, hour + 1, 0).isoformat() + '+03:00'
+
+    return {
+        'summary': f'{option} Booking',
+        'description': (
+            f'Booked via Telegram Bot\n'
+            f'User ID: {user_id}\n'
+            f'Username: @{username}'
+        ),
+        'start': {
+            'dateTime': start_time,
+            'timeZone': 'Europe/Moscow',
+        },
+        'end': {
+            'dateTime': end_time,
+            'timeZone': 'Europe/Moscow',
+        },
+        'reminders': {'useDefault': True},
+        'transparency': 'opaque',
+        'status': 'confirmed',
+        'extendedProperties': {
+            'private': {
+                'userId': str(user_id)
+            }
+        }
+    }
+
+def generate_book_button():
+    markup = types.InlineKeyboardMarkup()
+    markup.add(types.InlineKeyboardButton(text='Забронировать', callback_data=codec.encode(BOOK)))
+    return markup
+
+def submit_booking(option, day, hour, user_id, event):
+    """Start calendar_helper.book_slot in the background, returns a Future"""
+    # Carry the handler's trace along so the insert still counts as its stage
+    context = contextvars.copy_context()
+    return booking_executor.submit(context.run, calendar_helper.book_slot, option, day, hour, user_id, event)
+
+def generate_confirmation(option, day, hour):
     markup = types.InlineKeyboardMarkup()
-    confirm_button = types.InlineKeyboardButton("Подтвердить", callback_data=f"confirm:{option}:{date}:{time}")
-    back_button = types.InlineKeyboardButton("« Назад", callback_data=f"back_to_times:{option}:{date}")
+    confirm_button = types.InlineKeyboardButton("Подтвердить", callback_data=codec.encode(CONFIRM, option, day, hour))
+    back_button = types.InlineKeyboardButton("« Назад", callback_data=codec.encode(DAY, option, day))
     markup.row(confirm_button)
+    if RECURRING_MAX_WEEKS > 1:
+        markup.row(types.InlineKeyboardButton("🔁 Каждую неделю", callback_data=codec.encode(REPEAT, option, day, hour)))
     markup.row(back_button)
     return markup
 
+def generate_repeat_options(option, day, hour):
+    """Buttons with the number of weeks to book, up to RECURRING_MAX_WEEKS"""
+    markup = types.InlineKeyboardMarkup(row_width=4)
+    weeks = sorted({n for n in (2, 4, 8) if n < RECURRING_MAX_WEEKS} | {RECURRING_MAX_WEEKS})
+    markup.add(*[types.InlineKeyboardButton(f"{n} нед.", callback_data=codec.encode(CONFIRM_REPEAT, option, day, hour, n))
+                 for n in weeks])
+    markup.row(types.InlineKeyboardButton("« Назад", callback_data=codec.encode(TIME, option, day, hour)))
+    return markup
+
+def book_recurring(option, day, hour, weeks, user_id, username):
+    """Book the slot on day and the same weekday of the following weeks, returns the summary text"""
+    days = [day + timedelta(weeks=n) for n in range(weeks)]
+    events = {d: build_booking_event(option, d, hour, user_id, username) for d in days}
+    status = calendar_helper.book_slots(option, hour, user_id, events)
+    labels = {BOOKED: "✅", TAKEN: "❌ занято", CLOSED: "❌ закрыто"}
+    lines = [f"{date_label(d)} {labels.get(status[d], '❌ ошибка')}" for d in days]
+    booked = sum(1 for d in days if status[d] == BOOKED)
+    logger.info(f"🔁 Recurring booking by 👤 @{username} (ID: {user_id})\nOption: {option}\n"
+                f"Time: {hour}:00\nBooked: {booked} of {weeks}")
+    return (f"🔁 Бронирование каждую неделю\n\nВид спорта: {option}\nВремя: {hour}:00\n\n"
+            + "\n".join(lines) + f"\n\nЗабронировано {booked} из {weeks}.")
+
 @bot.message_handler(commands=['start'])
+@timed_handler
 def send_welcome(message):
     # Add username logging
     username = message.from_user.username or "No username"
@@ -168,222 +515,247 @@ def send_welcome(message):
     logger.info(f"New user started bot: 👤 @{username} (ID: {user_id})")
 
     # Приветственное сообщение и кнопка "Забронировать"
-    markup = types.InlineKeyboardMarkup()
-    book_button = types.InlineKeyboardButton(text='Забронировать', callback_data='book')
-    markup.add(book_button)
     bot.send_message(
         message.chat.id,
         "Добро пожаловать! Нажмите 'Забронировать', чтобы начать.",
-        reply_markup=markup
+        reply_markup=generate_book_button()
     )
 
-@bot.callback_query_handler(func=lambda call: call.data == 'book')
+@bot.message_handler(commands=['free'])
+@timed_handler
+def find_free_command(message):
+    # /free or /free сквош: earliest free slots without tapping through days
+    query = message.text.partition(' ')[2].strip()
+    try:
+        text, markup = generate_free_slots(message.from_user.id, query or None, chat_id=message.chat.id)
+    except GoogleUnavailableError:
+        text, markup = "Google Calendar сейчас недоступен, попробуйте через минуту.", None
+    bot.send_message(message.chat.id, text, reply_markup=markup)
+
+@bot.message_handler(commands=['my'])
+@timed_handler
+def my_bookings_command(message):
+    try:
+        text, markup = generate_user_bookings(message.from_user.id)
+    except GoogleUnavailableError:
+        text, markup = "Google Calendar сейчас недоступен, попробуйте через минуту.", None
+    bot.send_message(message.chat.id, text, reply_markup=markup)
+
+@bot.callback_query_handler(func=lambda call: True)
+def dispatch_callback(call):
+    """Every button lands here: decode the payload and look its handler up by action"""
+    try:
+        action, args = codec.decode(call.data, call.message.chat.id)
+    except StaleCallback:
+        bot.answer_callback_query(call.id, "Кнопка устарела, нажмите /start")
+        return
+    handler = router.handler(action)
+    if handler is None:
+        return
+    try:
+        handler(call, *args)
+    except GoogleUnavailableError:
+        # Only a calendar never synced gets here, stale ones are still shown
+        bot.answer_callback_query(call.id, "Google Calendar сейчас недоступен, попробуйте через минуту")
+
+@router.route(IGNORE)
+@timed_handler
+def ignore_button(call):
+    bot.answer_callback_query(call.id)
+
+@router.route(BOOK)
+@router.route(OPTIONS)
+@timed_handler
 def booking_options(call):
-    # Buttons for different options
-    markup = types.InlineKeyboardMarkup()
-    first_button = types.InlineKeyboardButton(text='БадминтонЪ', callback_data='option:Бадминтон')
-    second_button = types.InlineKeyboardButton(text='СквошЪ', callback_data='option:Сквош')
-    markup.add(first_button, second_button)
     bot.edit_message_text(
         "Выберите опцию:",
         chat_id=call.message.chat.id,
         message_id=call.message.message_id,
-        reply_markup=markup
+        reply_markup=generate_options()
     )
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith('option:'))
-def show_calendar(call):
-    option = call.data.split(':')[1]
-    now = datetime.now()
-    year, month = now.year, now.month
-    markup = generate_calendar(year, month, option, call.from_user.id)
+@router.route(FIND_FREE)
+@timed_handler
+def find_free(call, query):
+    text, markup = generate_free_slots(call.from_user.id, query, chat_id=call.message.chat.id)
     bot.edit_message_text(
-        f"Календарь: {calendar.month_name[month]} {year}",
+        text,
         chat_id=call.message.chat.id,
         message_id=call.message.message_id,
         reply_markup=markup
     )
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith('prev_month') or call.data.startswith('next_month'))
-def change_month(call):
-    action, option, date_info = call.data.split(':')
-    year, month = map(int, date_info.split('-'))
+@router.route(MY_BOOKINGS)
+@timed_handler
+def my_bookings(call):
+    text, markup = generate_user_bookings(call.from_user.id)
+    bot.edit_message_text(
+        text,
+        chat_id=call.message.chat.id,
+        message_id=call.message.message_id,
+        reply_markup=markup
+    )
 
-    if action == 'prev_month':
-        month -= 1
-        if month == 0:
-            month = 12
-            year -= 1
-    else:  # next_month
-        month += 1
-        if month == 13:
-            month = 1
-            year += 1
+@router.route(VENUE)
+@timed_handler
+def show_venue(call, index):
+    venue = venue_by_index(index)
+    if venue is None:
+        bot.answer_callback_query(call.id, "Площадка не найдена")
+        return
+    bot.edit_message_text(
+        f"{venue}. Выберите опцию:",
+        chat_id=call.message.chat.id,
+        message_id=call.message.message_id,
+        reply_markup=generate_options(venue)
+    )
 
+@router.route(CALENDAR)
+@timed_handler
+def show_calendar(call, option, month):
+    year, month = month
     markup = generate_calendar(year, month, option, call.from_user.id)
     bot.edit_message_text(
-        f"Календарь: {calendar.month_name[month]} {year}",
+        f"Календарь: {calendar.month_name[month]} {year}{stale_note(option)}",
+        chat_id=call.message.chat.id,
+        message_id=call.message.message_id,
+        reply_markup=markup
+    )
+
+@router.route(DAY)
+@timed_handler
+def handle_date_selection(call, option, day):
+    markup = generate_time_slots(option, day, call.from_user.id)
+    bot.edit_message_text(
+        f"Вы выбрали {option} на {date_label(day)}. Выберите время:{stale_note(option)}",
         chat_id=call.message.chat.id,
         message_id=call.message.message_id,
         reply_markup=markup
     )
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith('select_date:'))
-def handle_date_selection(call):
-    # Обработка выбранной даты
+@router.route(TIME)
+@timed_handler
+def handle_time_selection(call, option, day, hour):
     try:
-        _, option, date = call.data.split(':')
-        markup = generate_time_slots(option, date, call.from_user.id)
+        # Hold the slot while the user is on the confirmation screen
+        if not calendar_helper.hold_slot(option, day, hour, call.from_user.id):
+            bot.answer_callback_query(call.id, "Это время уже занято, выберите другое")
+            return
+        markup = generate_confirmation(option, day, hour)
         bot.edit_message_text(
-            f"Вы выбрали {option} на {date}. Выберите время:",
+            f"Вы выбрали: \nВид спорта: {option}\nДата: {date_label(day)}\nВремя: {hour}:00\nНажмите 'Подтвердить' для завершения.",
             chat_id=call.message.chat.id,
             message_id=call.message.message_id,
             reply_markup=markup
         )
-    except ValueError:
-        bot.answer_callback_query(call.id, "Произошла ошибка при обработке даты.")
-
-@bot.callback_query_handler(func=lambda call: call.data.startswith('time:'))
-def handle_time_selection(call):
-    try:
-        parts = call.data.split(':')
-        if len(parts) >= 4:
-            _, option, date, time = parts[:4]
-            markup = generate_confirmation(option, date, time)
-            bot.edit_message_text(
-                f"Вы выбрали: \nВид спорта: {option}\nДата: {date}\nВремя: {time}\nНажмите 'Подтвердить' для завершения.",
-                chat_id=call.message.chat.id,
-                message_id=call.message.message_id,
-                reply_markup=markup
-            )
-        else:
-            raise ValueError("Неверный формат")
     except Exception as e:
         bot.answer_callback_query(call.id, "Ошибка при выборе времени")
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith('confirm:'))
-def handle_confirmation(call):
-    try:
-        # Send "Бронируем" message with sticker
-        message = bot.edit_message_text(
-            "Бронируем...",
-            chat_id=call.message.chat.id,
-            message_id=call.message.message_id
-        )
-        sticker_message = bot.send_sticker(
-            call.message.chat.id,
-            os.getenv('LOADING_STICKER_ID')
-        )
-
-        _, option, date, time = call.data.split(':')
-
-        # Get user information
-        username = call.from_user.username or "No username"
-        user_id = call.from_user.id
-        logger.info(f"Processing booking by 👤 @{username} (ID: {user_id})\nOption: {option}\nDate: {date}\nTime: {time}")
-
-        # Parse the date and add leading zeros
-        year, month, day = map(int, date.split('-'))
-        formatted_date = f"{year}-{month:02d}-{day:02d}"
-
-        # Format times in RFC3339 format
-        hour = int(time.split(':')[0])
-        start_time = datetime(year, month, day, hour, 0).isoformat() + '+03:00'
-        end_time = datetime(year, month, day, hour + 1, 0).isoformat() + '+03:00'
-
-        event = {
-            'summary': f'{option} Booking',
-            'description': (
-                f'Booked via Telegram Bot\n'
-                f'User ID: {user_id}\n'
-                f'Username: @{username}'
-            ),
-            'start': {
-                'dateTime': start_time,
-                'timeZone': 'Europe/Moscow',
-            },
-            'end': {
-                'dateTime': end_time,
-                'timeZone': 'Europe/Moscow',
-            },
-            'reminders': {'useDefault': True},
-            'transparency': 'opaque',
-            'status': 'confirmed',
-            'extendedProperties': {
-                'private': {
-                    'userId': str(user_id)
-                }
-            }
-        }
+@router.route(REPEAT)
+@timed_handler
+def show_repeat_options(call, option, day, hour):
+    bot.edit_message_text(
+        f"{option} в {hour}:00 каждую неделю, начиная с {date_label(day)}. На сколько недель?",
+        chat_id=call.message.chat.id,
+        message_id=call.message.message_id,
+        reply_markup=generate_repeat_options(option, day, hour)
+    )
 
-        created_event = calendar_helper.create_event(event, option)
-        logger.info(f"✅ Booking confirmed\nUser: 👤 @{username} (ID: {user_id})\nOption: {option}\nDate: {formatted_date}\nTime: {time}")
+@router.route(CONFIRM_REPEAT)
+@timed_handler
+def handle_recurring_confirmation(call, option, day, hour, weeks):
+    if not 1 <= weeks <= RECURRING_MAX_WEEKS:
+        bot.answer_callback_query(call.id, f"Можно забронировать не больше {RECURRING_MAX_WEEKS} недель")
+        return
+    username = call.from_user.username or "No username"
+    # The batch insert runs while the callback is answered
+    context = contextvars.copy_context()
+    booking = booking_executor.submit(context.run, book_recurring, option, day, hour, weeks, call.from_user.id, username)
+    try:
+        try:
+            bot.answer_callback_query(call.id, "Бронируем...")
+        finally:
+            text = booking.result()
+    except Exception as e:
+        logger.error(f"❌ Recurring booking error for 👤 @{username} (ID: {call.from_user.id}): {str(e)}", exc_info=True)
+        text = booking_error_text(e)
+    # One summary for the whole series instead of a confirmation per week
+    bot.edit_message_text(
+        text,
+        chat_id=call.message.chat.id,
+        message_id=call.message.message_id,
+        reply_markup=generate_book_button()
+    )
 
-        # Delete the sticker message
-        bot.delete_message(call.message.chat.id, sticker_message.message_id)
+@router.route(CONFIRM)
+@timed_handler
+def handle_confirmation(call, option, day, hour):
+    chat_id = call.message.chat.id
+    message_id = call.message.message_id
+    username = call.from_user.username or "No username"
+    user_id = call.from_user.id
+    sticker_message = None
+    try:
+        logger.info(f"Processing booking by 👤 @{username} (ID: {user_id})\nOption: {option}\nDate: {day}\nTime: {hour}:00")
 
-        # Show confirmation and new booking option
+        event = build_booking_event(option, day, hour, user_id, username)
+        # The insert runs while the user already gets feedback
+        booking = submit_booking(option, day, hour, user_id, event)
+        try:
+            bot.answer_callback_query(call.id, "Бронируем...")
+            booking.result(timeout=LOADING_STICKER_DELAY)
+        except FutureTimeoutError:
+            # Only a slow insert is worth the sticker and the calls to show and remove it
+            bot.edit_message_text("Бронируем...", chat_id=chat_id, message_id=message_id)
+            sticker_message = bot.send_sticker(chat_id, os.getenv('LOADING_STICKER_ID'))
+        finally:
+            # Also raises the insert's error when the Telegram calls failed
+            booking.result()
+        logger.info(f"✅ Booking confirmed\nUser: 👤 @{username} (ID: {user_id})\nOption: {option}\nDate: {day}\nTime: {hour}:00")
+
+        # Confirmation and the next "Забронировать" in one edit
         bot.edit_message_text(
-            f"✅ Бронирование подтверждено!\n\nВид спорта: {option}\nДата: {formatted_date}\nВремя: {time}",
-            chat_id=call.message.chat.id,
-            message_id=call.message.message_id
+            f"✅ Бронирование подтверждено!\n\nВид спорта: {option}\nДата: {day}\nВремя: {hour}:00",
+            chat_id=chat_id,
+            message_id=message_id,
+            reply_markup=generate_book_button()
         )
+        if sticker_message is not None:
+            bot.delete_message(chat_id, sticker_message.message_id)
 
-        markup = types.InlineKeyboardMarkup()
-        book_button = types.InlineKeyboardButton(text='Забронировать', callback_data='book')
-        markup.add(book_button)
-        bot.send_message(
-            call.message.chat.id,
-            "Нажмите 'Забронировать', чтобы начать.",
-            reply_markup=markup
+    except SlotTakenError:
+        if sticker_message is not None:
+            bot.delete_message(chat_id, sticker_message.message_id)
+        logger.info(f"Slot already taken for 👤 @{username} (ID: {user_id})\nOption: {option}\nDate: {day}\nTime: {hour}:00")
+        bot.edit_message_text(
+            f"❌ Это время уже занято.\nВы выбрали {option} на {date_label(day)}. Выберите время:",
+            chat_id=chat_id,
+            message_id=message_id,
+            reply_markup=generate_time_slots(option, day, user_id)
         )
 
     except Exception as e:
         try:
-            bot.delete_message(call.message.chat.id, sticker_message.message_id)
+            if sticker_message is not None:
+                bot.delete_message(chat_id, sticker_message.message_id)
+        except:
+            pass
+        # An outage is no bug, its traceback is only noise in the log channel
+        logger.error(f"❌ Booking error for 👤 @{username} (ID: {user_id}): {str(e)}",
+                     exc_info=not isinstance(e, GoogleUnavailableError))
+        try:
+            # The callback query is already answered, say it in the message
+            bot.edit_message_text(
+                booking_error_text(e),
+                chat_id=chat_id,
+                message_id=message_id,
+                reply_markup=generate_book_button()
+            )
         except:
             pass
-        logger.error(f"❌ Booking error for 👤 @{username} (ID: {user_id}): {str(e)}", exc_info=True)
-        bot.answer_callback_query(call.id, "Ошибка при бронировании")
-
-@bot.callback_query_handler(func=lambda call: call.data.startswith('back_to_options'))
-def back_to_options(call):
-    markup = types.InlineKeyboardMarkup()
-    first_button = types.InlineKeyboardButton(text='Бадминтон', callback_data='option:Бадминтон')
-    second_button = types.InlineKeyboardButton(text='Сквош', callback_data='option:Сквош')
-    markup.add(first_button, second_button)
-    bot.edit_message_text(
-        "Выберите опцию:",
-        chat_id=call.message.chat.id,
-        message_id=call.message.message_id,
-        reply_markup=markup
-    )
-
-@bot.callback_query_handler(func=lambda call: call.data.startswith('back_to_calendar:'))
-def back_to_calendar(call):
-    option = call.data.split(':')[1]
-    now = datetime.now()
-    year, month = now.year, now.month
-    markup = generate_calendar(year, month, option, call.from_user.id)
-    bot.edit_message_text(
-        f"Календарь: {calendar.month_name[month]} {year}",
-        chat_id=call.message.chat.id,
-        message_id=call.message.message_id,
-        reply_markup=markup
-    )
-
-@bot.callback_query_handler(func=lambda call: call.data.startswith('back_to_times:'))
-def back_to_times(call):
-    _, option, date = call.data.split(':')
-    markup = generate_time_slots(option, date, call.from_user.id)
-    bot.edit_message_text(
-        f"Вы выбрали {option} на {date}. Выберите время:",
-        chat_id=call.message.chat.id,
-        message_id=call.message.message_id,
-        reply_markup=markup
-    )
 
 @bot.message_handler(func=lambda message: True)
+@timed_handler
 def fallback_message(message):
     # Ответ на любое другое текстовое сообщение
     bot.send_message(
@@ -391,8 +763,79 @@ def fallback_message(message):
         "Нажми /start чтобы перейти к бронированию."
     )
 
-if __name__ == '__main__':
-    print("Бот запущен...")
+def setup_locale():
+    # Set Russian locale for month names
+    locale.setlocale(locale.LC_ALL, 'ru_RU.UTF-8')
+
+def setup_telegram():
+    """Time and pace outbound Bot API calls, the benchmarks call this too"""
+    instrument_telegram()
+    # Installed after the timing wrapper so bot_telegram_request_seconds leaves out the waiting
+    telegram_scheduler.install()
+
+def startup():
+    """Process-wide setup done before serving updates, Google is connected in the background"""
+    setup_locale()
+    setup_telegram()
+    calendar_helper.warm_up()
+    logger.info(f"Bot started in {time.perf_counter() - STARTED_AT:.3f}s")
+
+def start_calendar_watch():
+    """Open Calendar push channels when CALENDAR_WATCH_URL is set.
+
+    Returns the watcher and its (method, path, func) route, or (None, None).
+    """
+    from urllib.parse import urlparse
+    from calendar_watch import create_watcher
+
+    watcher = create_watcher(calendar_helper)
+    if watcher is None:
+        return None, None
+    watcher.start()
+    REGISTRY.add_collector('bot_calendar_watch', watcher.stats)
+    return watcher, ('POST', urlparse(watcher.address).path or '/', watcher.handle_notification)
+
+def run_webhook():
+    from urllib.parse import urlparse
+    from webhook_server import serve_webhook
+
+    watcher, watch_route = start_calendar_watch()
+    url = os.getenv('WEBHOOK_URL')
+    try:
+        serve_webhook(
+            bot,
+            url=url,
+            host=os.getenv('WEBHOOK_HOST', '127.0.0.1'),
+            port=int(os.getenv('WEBHOOK_PORT', '8081')),
+            path=urlparse(url).path or '/',
+            secret_token=os.getenv('WEBHOOK_SECRET') or None,
+            workers=int(os.getenv('WEBHOOK_WORKERS', '8')),
+            max_queue=int(os.getenv('WEBHOOK_QUEUE_SIZE', '1000')),
+            routes=[watch_route] if watch_route else []
+        )
+    finally:
+        if watcher:
+            watcher.stop()
+
+def run_polling():
+    # Polling fails while a webhook is registered, e.g. after running in webhook mode
+    bot.remove_webhook()
+    from webhook_server import LocalHTTPServer, metrics_route
+
+    # Without the webhook server, metrics and Calendar notifications need their own listeners
+    routes = {}
+    if os.getenv('METRICS_PORT'):
+        address = (os.getenv('METRICS_HOST', '127.0.0.1'), int(os.getenv('METRICS_PORT')))
+        routes.setdefault(address, []).append(('GET', '/metrics', metrics_route))
+    watcher, watch_route = start_calendar_watch()
+    if watcher:
+        address = (os.getenv('CALENDAR_WATCH_HOST', '127.0.0.1'), int(os.getenv('CALENDAR_WATCH_PORT', '8082')))
+        routes.setdefault(address, []).append(watch_route)
+    for (host, port), server_routes in routes.items():
+        server = LocalHTTPServer(host, port)
+        for route in server_routes:
+            server.add_route(*route)
+        server.start()
     while True:
         try:
             # Configure polling with shorter timeout and retry on failure
@@ -414,3 +857,11 @@ if __name__ == '__main__':
             logger.error(f"Critical error occurred: {str(e)}")
             time.sleep(30)
             continue
+
+if __name__ == '__main__':
+    print("Бот запущен...")
+    startup()
+    if os.getenv('WEBHOOK_URL'):
+        run_webhook()
+    else:
+        run_polling()
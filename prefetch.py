@@ -0,0 +1,135 @@
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from time import monotonic
+
+logger = logging.getLogger(__name__)
+
+# Threads doing speculative loads, 0 disables prefetching
+PREFETCH_WORKERS = int(os.getenv('PREFETCH_WORKERS', '2'))
+# Upcoming days of the shown month whose time slots are loaded ahead
+PREFETCH_DAYS = int(os.getenv('PREFETCH_DAYS', '3'))
+# A calendar that goes stale within this many seconds is synced ahead of the next tap
+PREFETCH_REFRESH_AHEAD = int(os.getenv('PREFETCH_REFRESH_AHEAD', '10'))
+# Google syncs the prefetcher may start per minute, on top of what users trigger
+PREFETCH_SYNCS_PER_MINUTE = int(os.getenv('PREFETCH_SYNCS_PER_MINUTE', '6'))
+
+
+def adjacent_months(year, month):
+    """(year, month) before and after the given one"""
+    previous = (year - 1, 12) if month == 1 else (year, month - 1)
+    following = (year + 1, 1) if month == 12 else (year, month + 1)
+    return previous, following
+
+
+class Prefetcher:
+    """Warms GoogleCalendarHelper caches for what a user is likely to open next.
+
+    After a month is shown the user almost always picks a near day or moves
+    one month, so those views are loaded by a small pool of background
+    workers. Work for the same (option, month) is never queued twice, the
+    queue is bounded, and syncs started by the prefetcher are rate limited
+    so speculation cannot eat the Calendar API quota.
+    """
+
+    def __init__(self, helper, workers=PREFETCH_WORKERS, days=PREFETCH_DAYS, refresh_ahead=PREFETCH_REFRESH_AHEAD,
+                 syncs_per_minute=PREFETCH_SYNCS_PER_MINUTE, max_pending=32):
+        self.helper = helper
+        self.workers = workers
+        self.days = days
+        self.refresh_ahead = refresh_ahead
+        self.syncs_per_minute = syncs_per_minute
+        self.max_pending = max_pending
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='prefetch') if workers else None
+        self._lock = threading.Lock()
+        self._pending = set()  # (option, year, month) queued or running
+        self._window_start = monotonic()
+        self._window_syncs = 0
+        # Metrics
+        self.scheduled = 0
+        self.dropped = 0
+        self.syncs = 0
+        self.quota_skips = 0
+        self.loaded = 0
+        self.failed = 0
+
+    def after_calendar(self, year, month, option, today=None):
+        """Queue prefetching for a month that was just shown, never blocks the caller"""
+        if self.executor is None:
+            return False
+        task = (option, year, month)
+        with self._lock:
+            if task in self._pending or len(self._pending) >= self.max_pending:
+                self.dropped += 1
+                return False
+            self._pending.add(task)
+            self.scheduled += 1
+        self.executor.submit(self._run, task, today or date.today())
+        return True
+
+    def _run(self, task, today):
+        option, year, month = task
+        try:
+            if self.helper.fresh_for(option) < self.refresh_ahead:
+                if self._take_sync():
+                    calendar_id = self.helper.get_calendar_id(option)
+                    if calendar_id:
+                        self.helper.sync_calendar(calendar_id)
+                        self.syncs += 1
+                else:
+                    # Loading now would sync on the quota of a real user request, leave it to them
+                    self.quota_skips += 1
+                    return
+
+            for other_year, other_month in adjacent_months(year, month):
+                # Months that are over are rarely opened
+                if (other_year, other_month) >= (today.year, today.month):
+                    self.loaded += self.helper.prefetch_month(other_year, other_month, option)
+
+            first = max(today, date(year, month, 1))
+            for offset in range(self.days):
+                day = first + timedelta(days=offset)
+                if day.month != month:
+                    break
+                self.loaded += self.helper.prefetch_day(day, option)
+        except Exception as e:
+            self.failed += 1
+            logger.error(f"Error prefetching {option} {year}-{month}: {str(e)}")
+        finally:
+            with self._lock:
+                self._pending.discard(task)
+
+    def _take_sync(self):
+        with self._lock:
+            now = monotonic()
+            if now - self._window_start >= 60:
+                self._window_start, self._window_syncs = now, 0
+            if self._window_syncs >= self.syncs_per_minute:
+                return False
+            self._window_syncs += 1
+            return True
+
+    def stats(self):
+        """Prefetcher counters plus how many prefetched entries users actually read"""
+        caches = (self.helper.busy_slots_cache.stats(), self.helper.month_occupancy_cache.stats())
+        prefetched = sum(cache['prefetched'] for cache in caches)
+        hits = sum(cache['prefetch_hits'] for cache in caches)
+        with self._lock:
+            return {
+                'scheduled': self.scheduled,
+                'dropped': self.dropped,
+                'pending': len(self._pending),
+                'syncs': self.syncs,
+                'quota_skips': self.quota_skips,
+                'loaded': self.loaded,
+                'failed': self.failed,
+                'prefetch_hits': hits,
+                'prefetch_wasted': sum(cache['prefetch_wasted'] for cache in caches),
+                'prefetch_hit_rate': hits / prefetched if prefetched else 0.0
+            }
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
@@ -0,0 +1,135 @@
+import json
+import logging
+import os
+import zlib
+
+logger = logging.getLogger(__name__)
+
+# JSON list of bookable resources, see README; without it the two calendars from .env are used
+RESOURCES_FILE = os.getenv('RESOURCES_FILE', 'resources.json')
+
+DEFAULT_HOURS = (10, 20)
+WEEKDAYS = ('mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun')
+
+
+class Resource:
+    """A bookable court (or any other resource) backed by one Google Calendar"""
+
+    __slots__ = ('name', 'calendar_id', 'venue', 'hours', 'weekday_hours', 'id')
+
+    def __init__(self, name, calendar_id, venue=None, hours=DEFAULT_HOURS, weekday_hours=None, id=None):
+        self.name = name
+        # Short ID used in button payloads, stable across restarts and reordering of the file
+        self.id = id if id is not None else zlib.crc32(name.encode('utf-8'))
+        self.calendar_id = calendar_id
+        self.venue = venue
+        # Opening hours as [open, close), hour slots start at every full hour in between
+        self.hours = tuple(hours)
+        # Weekday name -> [open, close) or None when closed that day
+        self.weekday_hours = dict(weekday_hours or {})
+
+    def slots_for(self, day):
+        """Start hours that can be booked on a date"""
+        hours = self.weekday_hours.get(WEEKDAYS[day.weekday()], self.hours)
+        if not hours:
+            return range(0)
+        return range(hours[0], hours[1])
+
+    def open_mask(self, day):
+        """Bookable hours of a date as a bitmask, same layout as Occupancy masks"""
+        hours = self.slots_for(day)
+        return ((1 << hours.stop) - (1 << hours.start)) if hours else 0
+
+    @classmethod
+    def from_dict(cls, data, venue=None):
+        weekday_hours = data.get('weekday_hours') or {}
+        unknown = set(weekday_hours) - set(WEEKDAYS)
+        if unknown:
+            raise ValueError(f"Unknown weekdays for {data.get('name')}: {', '.join(sorted(unknown))}")
+        return cls(
+            name=data['name'],
+            calendar_id=data['calendar_id'],
+            venue=data.get('venue', venue),
+            hours=data.get('hours', DEFAULT_HOURS),
+            weekday_hours=weekday_hours,
+            id=data.get('id')
+        )
+
+
+class ResourceRegistry:
+    """All bookable resources, in display order, looked up by name"""
+
+    def __init__(self, resources):
+        self.resources = list(resources)
+        self._by_name = {}
+        self._by_id = {}
+        for resource in self.resources:
+            if resource.name in self._by_name:
+                raise ValueError(f"Duplicate resource name: {resource.name}")
+            if not 0 <= resource.id <= 0xFFFFFFFF:
+                raise ValueError(f"Resource ID of {resource.name} must be between 0 and 4294967295")
+            if resource.id in self._by_id:
+                raise ValueError(f"Resource ID {resource.id} of {resource.name} clashes with "
+                                 f"{self._by_id[resource.id].name}, set \"id\" in the resources file")
+            self._by_name[resource.name] = resource
+            self._by_id[resource.id] = resource
+
+    def __iter__(self):
+        return iter(self.resources)
+
+    def __len__(self):
+        return len(self.resources)
+
+    def get(self, name):
+        return self._by_name.get(name)
+
+    def by_id(self, resource_id):
+        return self._by_id.get(resource_id)
+
+    def names(self):
+        return [resource.name for resource in self.resources]
+
+    def calendar_ids(self):
+        """{resource name: calendar id}"""
+        return {resource.name: resource.calendar_id for resource in self.resources}
+
+    def venues(self):
+        """Venue names in display order, without None"""
+        venues = []
+        for resource in self.resources:
+            if resource.venue and resource.venue not in venues:
+                venues.append(resource.venue)
+        return venues
+
+    def in_venue(self, venue):
+        return [resource for resource in self.resources if resource.venue == venue]
+
+    @classmethod
+    def from_file(cls, path):
+        """Load a JSON file: a list of resources or {"venues": [{"name", "resources"}]}"""
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+        if isinstance(data, dict):
+            resources = [Resource.from_dict(item, venue=venue['name'])
+                         for venue in data.get('venues', []) for item in venue.get('resources', [])]
+        else:
+            resources = [Resource.from_dict(item) for item in data]
+        return cls(resources)
+
+    @classmethod
+    def from_env(cls):
+        """The two calendars the bot started with, from FIRST/SECOND_CALENDAR_ID"""
+        return cls([
+            Resource('Бадминтон', os.getenv('FIRST_CALENDAR_ID')),
+            Resource('Сквош', os.getenv('SECOND_CALENDAR_ID'))
+        ])
+
+
+def load_resources(path=None):
+    """Registry from RESOURCES_FILE when it exists, otherwise from the environment"""
+    path = path or RESOURCES_FILE
+    if path and os.path.exists(path):
+        registry = ResourceRegistry.from_file(path)
+        logger.info(f"Loaded {len(registry)} resources from {path}")
+        return registry
+    return ResourceRegistry.from_env()
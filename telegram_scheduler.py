@@ -0,0 +1,327 @@
+import asyncio
+import logging
+import os
+import threading
+from concurrent.futures import Future
+from time import monotonic
+
+from metrics import TELEGRAM_WAIT_SECONDS, stage
+
+logger = logging.getLogger(__name__)
+
+# Telegram allows about 30 messages per second per bot and about one per second in a chat.
+# Only new messages are paced (and everything sent to the log channel), edits and
+# callback answers replying to a user's own tap go straight out
+TELEGRAM_GLOBAL_RATE = float(os.getenv('TELEGRAM_GLOBAL_RATE', '30'))
+TELEGRAM_CHAT_RATE = float(os.getenv('TELEGRAM_CHAT_RATE', '1'))
+# Short bursts per chat are fine, a booking confirmation makes a handful of calls at once
+TELEGRAM_CHAT_BURST = int(os.getenv('TELEGRAM_CHAT_BURST', '5'))
+# How often one call is retried after a 429 answer
+TELEGRAM_MAX_RETRIES = int(os.getenv('TELEGRAM_MAX_RETRIES', '3'))
+
+HIGH, LOW = 0, 1
+
+# Methods that post into a chat, everything else (getUpdates, setWebhook, ...) is never queued
+SCHEDULED_PREFIXES = ('send', 'edit', 'delete', 'forward', 'copy', 'answer', 'pin', 'unpin')
+# Methods that start a new message, the ones Telegram's per chat and per bot limits are about
+PACED_PREFIXES = ('send', 'forward', 'copy')
+# A newer call of the same method for the same message makes an older, still waiting one pointless
+MERGEABLE_METHODS = {'editMessageText', 'editMessageReplyMarkup', 'editMessageCaption'}
+
+
+def retry_after(error):
+    """Seconds Telegram asked to wait for a 429 error, None for any other exception"""
+    if getattr(error, 'error_code', None) != 429:
+        return None
+    result = getattr(error, 'result_json', None) or {}
+    return float(result.get('parameters', {}).get('retry_after', 1))
+
+
+def _copy_result(source, target):
+    error = source.exception()
+    if error is not None:
+        target.set_exception(error)
+    else:
+        target.set_result(source.result())
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = monotonic()
+        # Set from retry_after, nothing goes out before it
+        self.blocked_until = 0.0
+
+    def blocked_for(self, now):
+        """Seconds left of a retry_after block"""
+        return max(0.0, self.blocked_until - now)
+
+    def delay(self, now):
+        """Seconds until a token is available"""
+        if now > self.updated:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    def block(self, until):
+        self.blocked_until = max(self.blocked_until, until)
+
+
+class Ticket:
+    """One outbound call waiting for its turn"""
+
+    __slots__ = ('method', 'chat_id', 'merge_key', 'priority', 'paced', 'future', 'superseded_by', 'sending')
+
+    def __init__(self, method, chat_id, merge_key, priority, paced):
+        self.method = method
+        self.chat_id = chat_id
+        self.merge_key = merge_key
+        self.priority = priority
+        self.paced = paced
+        self.future = Future()
+        self.superseded_by = None
+        # Set while the request is out, a newer edit can't be merged into it any more
+        self.sending = False
+
+
+class TelegramScheduler:
+    """Paces every outbound Bot API call made through pyTelegramBotAPI.
+
+    A new message needs a token from the global bucket and from its chat's
+    bucket and waits in the caller's thread (or task) until both have one.
+    Edits, callback answers and deletes reply to the user's own taps and
+    are not paced, they only wait out a 429 block. Calls to low priority
+    chats, the log channel, are always paced and wait while any user-facing
+    call is waiting. An edit still waiting when a newer edit of the same
+    message arrives is dropped and returns the newer one's result. A 429
+    answer blocks the chat (or the whole bot) for retry_after seconds and
+    the call is retried, unless a newer edit of the same message came along
+    meanwhile.
+    """
+
+    def __init__(self, global_rate=TELEGRAM_GLOBAL_RATE, chat_rate=TELEGRAM_CHAT_RATE,
+                 chat_burst=TELEGRAM_CHAT_BURST, max_retries=TELEGRAM_MAX_RETRIES, low_priority_chats=()):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.low_priority_chats = {str(chat_id) for chat_id in low_priority_chats if chat_id}
+        self.global_bucket = TokenBucket(global_rate, max(1, int(global_rate)))
+        self._buckets = {}  # chat ID -> TokenBucket
+        self._lock = threading.Condition()
+        self._high_waiting = 0
+        self._edits = {}  # (method, chat ID, message ID) -> latest Ticket not finished yet
+        # Metrics
+        self.sent = 0
+        self.throttled = 0
+        self.merged = 0
+        self.retries = 0
+        self.failed = 0
+
+    def ticket(self, method_name, params):
+        """Ticket for a call, None when the method is not paced"""
+        if not method_name.startswith(SCHEDULED_PREFIXES):
+            return None
+        params = params or {}
+        chat_id = params.get('chat_id')
+        chat_id = str(chat_id) if chat_id is not None else None
+        priority = LOW if chat_id in self.low_priority_chats else HIGH
+        merge_key = None
+        if method_name in MERGEABLE_METHODS and chat_id is not None and 'message_id' in params:
+            merge_key = (method_name, chat_id, str(params['message_id']))
+        paced = priority == LOW or method_name.startswith(PACED_PREFIXES)
+        ticket = Ticket(method_name, chat_id, merge_key, priority, paced)
+        with self._lock:
+            if priority == HIGH:
+                self._high_waiting += 1
+            if merge_key is not None:
+                previous = self._edits.get(merge_key)
+                if previous is not None:
+                    # One already out is only dropped if it has to be retried, see _retry
+                    previous.superseded_by = ticket
+                    if not previous.sending:
+                        self._merge(previous, ticket)
+                self._edits[merge_key] = ticket
+            self._lock.notify_all()
+        return ticket
+
+    def _merge(self, ticket, newer):
+        # Lock held, ticket returns newer's result instead of going out
+        newer.future.add_done_callback(lambda done: _copy_result(done, ticket.future))
+        self.merged += 1
+
+    def _bucket(self, chat_id):
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            if len(self._buckets) > 10000:
+                now = monotonic()
+                self._buckets = {key: value for key, value in self._buckets.items()
+                                 if value.delay(now) or value.tokens < value.burst}
+            bucket = self._buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    def _try_acquire(self, ticket):
+        """0 when the ticket may go now, else seconds to wait; None when it was merged away"""
+        with self._lock:
+            if ticket.superseded_by is not None:
+                self._leave(ticket)
+                return None
+            if ticket.priority == LOW and self._high_waiting:
+                return 0.05
+            now = monotonic()
+            if not ticket.paced:
+                # Not worth a bucket of its own, but a chat blocked by a 429 is blocked for edits too
+                bucket = self._buckets.get(ticket.chat_id)
+                delay = max(self.global_bucket.blocked_for(now), bucket.blocked_for(now) if bucket else 0.0)
+                if delay:
+                    return delay
+                ticket.sending = True
+                self._leave(ticket)
+                return 0.0
+            buckets = [self.global_bucket]
+            if ticket.chat_id is not None:
+                buckets.append(self._bucket(ticket.chat_id))
+            delay = max(bucket.delay(now) for bucket in buckets)
+            if delay:
+                return delay
+            for bucket in buckets:
+                bucket.take()
+            ticket.sending = True
+            self._leave(ticket)
+            return 0.0
+
+    def _leave(self, ticket):
+        # Lock held
+        if ticket.priority == HIGH:
+            self._high_waiting -= 1
+        self._lock.notify_all()
+
+    def _finish(self, ticket, result=None, error=None):
+        if ticket.merge_key is not None:
+            with self._lock:
+                if self._edits.get(ticket.merge_key) is ticket:
+                    del self._edits[ticket.merge_key]
+        if error is not None:
+            self.failed += 1
+            ticket.future.set_exception(error)
+        else:
+            self.sent += 1
+            ticket.future.set_result(result)
+
+    def call(self, send, method_name, params):
+        """Run send() once the call may go out, blocking the calling thread"""
+        ticket = self.ticket(method_name, params)
+        if ticket is None:
+            return send()
+        for attempt in range(self.max_retries + 1):
+            started = monotonic()
+            with stage('telegram.wait'):
+                while True:
+                    delay = self._try_acquire(ticket)
+                    if delay is None:
+                        # The newer edit's result is copied over once it went out
+                        return ticket.future.result()
+                    if not delay:
+                        break
+                    with self._lock:
+                        self._lock.wait(delay)
+            self._waited(method_name, started)
+            try:
+                result = send()
+            except Exception as e:
+                if not self._retry(ticket, e, attempt):
+                    raise
+                continue
+            self._finish(ticket, result)
+            return result
+
+    async def call_async(self, send, method_name, params):
+        """call() for the asyncio bot, waits without blocking the event loop"""
+        ticket = self.ticket(method_name, params)
+        if ticket is None:
+            return await send()
+        for attempt in range(self.max_retries + 1):
+            started = monotonic()
+            with stage('telegram.wait'):
+                while True:
+                    delay = self._try_acquire(ticket)
+                    if delay is None:
+                        return await asyncio.wrap_future(ticket.future)
+                    if not delay:
+                        break
+                    await asyncio.sleep(delay)
+            self._waited(method_name, started)
+            try:
+                result = await send()
+            except Exception as e:
+                if not self._retry(ticket, e, attempt):
+                    raise
+                continue
+            self._finish(ticket, result)
+            return result
+
+    def _waited(self, method_name, started):
+        waited = monotonic() - started
+        TELEGRAM_WAIT_SECONDS.observe(waited, method_name)
+        if waited > 0.001:
+            self.throttled += 1
+
+    def _retry(self, ticket, error, attempt):
+        """Queue the ticket again after a 429, False when the error should reach the caller"""
+        seconds = retry_after(error)
+        if seconds is None or attempt == self.max_retries:
+            self._finish(ticket, error=error)
+            return False
+        logger.warning(f"Telegram {ticket.method} hit the rate limit, retrying in {seconds}s")
+        with self._lock:
+            # retry_after is per chat when the call had one, otherwise for the whole bot
+            bucket = self._bucket(ticket.chat_id) if ticket.chat_id is not None else self.global_bucket
+            bucket.block(monotonic() + seconds)
+            self.retries += 1
+            if ticket.priority == HIGH:
+                self._high_waiting += 1
+            ticket.sending = False
+            if ticket.superseded_by is not None:
+                # A newer edit of the message is queued or already sent, this one would overwrite it
+                self._merge(ticket, ticket.superseded_by)
+        return True
+
+    def install(self):
+        """Route pyTelegramBotAPI's sync and asyncio requests through this scheduler"""
+        from telebot import apihelper, asyncio_helper
+
+        if getattr(apihelper._make_request, 'scheduler', None) is not None:
+            return
+        make_request = apihelper._make_request
+        process_request = asyncio_helper._process_request
+
+        def scheduled_make_request(token, method_name, method='get', params=None, files=None):
+            return self.call(lambda: make_request(token, method_name, method, params, files), method_name, params)
+
+        async def scheduled_process_request(token, url, method='get', params=None, files=None, **kwargs):
+            return await self.call_async(lambda: process_request(token, url, method, params, files, **kwargs),
+                                         url, params)
+
+        scheduled_make_request.scheduler = self
+        apihelper._make_request = scheduled_make_request
+        asyncio_helper._process_request = scheduled_process_request
+
+    def stats(self):
+        with self._lock:
+            return {
+                'sent': self.sent,
+                'waiting': self._high_waiting,
+                'throttled': self.throttled,
+                'merged': self.merged,
+                'retries': self.retries,
+                'failed': self.failed,
+                'chats': len(self._buckets)
+            }
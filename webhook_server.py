@@ -0,0 +1,244 @@
+import json
+import logging
+import threading
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import monotonic
+from types import SimpleNamespace
+
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+
+class ChatOrderedWorkerPool:
+    """Bounded worker pool that runs updates of one chat strictly in order.
+
+    Each chat has its own FIFO of pending updates and is held by at most one
+    worker at a time, so different chats run in parallel while callbacks of
+    the same chat never overtake each other.
+    """
+
+    def __init__(self, handler, workers=8, max_queue=1000):
+        self.handler = handler
+        self.workers = workers
+        self.max_queue = max_queue
+        self._cond = threading.Condition()
+        self._pending = {}     # chat id -> deque of (enqueued_at, item)
+        self._active = set()   # chats currently held by a worker
+        self._ready = deque()  # chats with pending updates and no worker
+        self._threads = []
+        self._stopping = False
+        # Metrics
+        self.queue_depth = 0
+        self.max_queue_depth = 0
+        self.received = 0
+        self.processed = 0
+        self.rejected = 0
+        self.failed = 0
+        self.total_wait = 0.0
+
+    def start(self):
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f'webhook-worker-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, chat_id, item):
+        """Queue an update, returns False when the pool is full"""
+        with self._cond:
+            if self._stopping or self.queue_depth >= self.max_queue:
+                self.rejected += 1
+                return False
+            queue = self._pending.setdefault(chat_id, deque())
+            queue.append((monotonic(), item))
+            if len(queue) == 1 and chat_id not in self._active:
+                self._ready.append(chat_id)
+            self.received += 1
+            self.queue_depth += 1
+            self.max_queue_depth = max(self.max_queue_depth, self.queue_depth)
+            self._cond.notify()
+            return True
+
+    def _work(self):
+        while True:
+            with self._cond:
+                while not self._ready and not self._stopping:
+                    self._cond.wait()
+                if not self._ready:
+                    return
+                chat_id = self._ready.popleft()
+                enqueued_at, item = self._pending[chat_id].popleft()
+                self._active.add(chat_id)
+                self.queue_depth -= 1
+                self.total_wait += monotonic() - enqueued_at
+
+            failed = False
+            try:
+                self.handler(item)
+            except Exception as e:
+                failed = True
+                logger.error(f"Error processing update for chat {chat_id}: {str(e)}", exc_info=True)
+
+            with self._cond:
+                self.processed += 1
+                self.failed += failed
+                self._active.discard(chat_id)
+                if self._pending[chat_id]:
+                    self._ready.append(chat_id)
+                    self._cond.notify()
+                else:
+                    del self._pending[chat_id]
+
+    def stop(self, timeout=10):
+        """Stop accepting updates and let workers drain what is already queued"""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def stats(self):
+        with self._cond:
+            return {
+                'queue_depth': self.queue_depth,
+                'max_queue_depth': self.max_queue_depth,
+                'queue_capacity': self.max_queue,
+                'busy_workers': len(self._active),
+                'workers': self.workers,
+                'waiting_chats': len(self._ready),
+                'received': self.received,
+                'processed': self.processed,
+                'rejected': self.rejected,
+                'failed': self.failed,
+                'avg_queue_wait_seconds': self.total_wait / self.processed if self.processed else 0.0
+            }
+
+
+class LocalHTTPServer:
+    """Tiny threaded HTTP server dispatching (method, path) to plain functions.
+
+    A route function gets a request with `path`, `headers` and `body` and
+    returns (status, content_type, body).
+    """
+
+    def __init__(self, host='127.0.0.1', port=8081):
+        self.routes = {}
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _dispatch(self, method):
+                route = server.routes.get((method, self.path.split('?')[0]))
+                if route is None:
+                    self._respond(404, 'text/plain', b'not found')
+                    return
+                length = int(self.headers.get('Content-Length') or 0)
+                request = SimpleNamespace(path=self.path, headers=self.headers, body=self.rfile.read(length))
+                try:
+                    self._respond(*route(request))
+                except Exception as e:
+                    logger.error(f"Error in {method} {self.path}: {str(e)}", exc_info=True)
+                    self._respond(500, 'text/plain', b'error')
+
+            def _respond(self, status, content_type, body):
+                if isinstance(body, str):
+                    body = body.encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                self._dispatch('GET')
+
+            def do_POST(self):
+                self._dispatch('POST')
+
+            def log_message(self, format, *args):
+                logger.debug(format % args)
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+
+    def add_route(self, method, path, func):
+        self.routes[(method, path)] = func
+
+    def serve_forever(self):
+        self.httpd.serve_forever()
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, name='http-server', daemon=True)
+        thread.start()
+        return thread
+
+    def shutdown(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def update_chat_id(update):
+    """Chat an incoming Telegram update belongs to (raw JSON dict)"""
+    for key in ('callback_query', 'message', 'edited_message'):
+        part = update.get(key)
+        if not part:
+            continue
+        message = part.get('message', part)
+        chat = message.get('chat') or {}
+        if 'id' in chat:
+            return chat['id']
+        return part.get('from', {}).get('id')
+    return update.get('update_id')
+
+
+def metrics_route(request):
+    """GET /metrics in the Prometheus text format"""
+    return 200, 'text/plain; version=0.0.4', REGISTRY.render()
+
+
+def serve_webhook(bot, url, host, port, path, secret_token=None, workers=8, max_queue=1000, routes=()):
+    """Receive Telegram updates on a local endpoint and process them in a worker pool.
+
+    routes are extra (method, path, func) served on the same port.
+    """
+    from telebot import types
+
+    # Updates must run inside our workers, TeleBot's own thread pool would reorder them
+    bot.threaded = False
+    pool = ChatOrderedWorkerPool(
+        lambda update: bot.process_new_updates([types.Update.de_json(update)]),
+        workers=workers,
+        max_queue=max_queue
+    )
+
+    def receive_update(request):
+        if secret_token and request.headers.get('X-Telegram-Bot-Api-Secret-Token') != secret_token:
+            return 403, 'text/plain', 'forbidden'
+        update = json.loads(request.body)
+        if not pool.submit(update_chat_id(update), update):
+            # Telegram retries non-2xx deliveries, which gives us backpressure for free
+            return 503, 'text/plain', 'queue full'
+        return 200, 'text/plain', 'ok'
+
+    REGISTRY.add_collector('bot_webhook', pool.stats)
+
+    server = LocalHTTPServer(host, port)
+    server.add_route('POST', path, receive_update)
+    server.add_route('GET', '/metrics', metrics_route)
+    for route in routes:
+        server.add_route(*route)
+
+    pool.start()
+    bot.remove_webhook()
+    bot.set_webhook(
+        url=url,
+        secret_token=secret_token,
+        allowed_updates=["message", "callback_query"],
+        max_connections=workers
+    )
+    logger.info(f"Webhook mode: listening on {host}:{port}{path}")
+    try:
+        server.serve_forever()
+    finally:
+        server.shutdown()
+        pool.stop()